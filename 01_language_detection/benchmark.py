@@ -0,0 +1,467 @@
+"""
+Benchmarks for the language scanner on synthetic monorepos.
+
+`run` builds a throwaway tree of a configurable shape (file count, directory
+depth, size distribution, language mix, huge minified files and deep
+excluded directories), times each stage of generate_language_representation
+separately and writes the results as a JSON baseline. `compare` diffs two such
+files and exits non-zero when a timing regressed by more than a threshold.
+
+    python benchmark.py run --files 20000 --output before.json
+    python benchmark.py run --files 20000 --output after.json
+    python benchmark.py compare before.json after.json --threshold 0.10
+
+Every stage is measured twice:
+
+* cold - the first run: empty scan cache, empty output directory, and the
+  tree's pages evicted with posix_fadvise(DONTNEED) where the platform
+  supports it. This is best effort; it is not a true cold boot (metadata and
+  dentry caches stay warm, and dirty pages cannot be dropped).
+* warm - the best of `--repeat` further runs, with everything cached.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from generate_language_representation import (
+    EXCLUDE_DIR_NAMES,
+    LanguageStats,
+    allocate_dummy_lines_per_language,
+    count_non_empty_lines,
+    gather_language_stats,
+    gather_language_stats_async,
+    iter_source_files,
+    write_dummy_files,
+)
+
+BASELINE_VERSION = 1
+
+# Default language mix, as extension -> relative weight.
+DEFAULT_MIX = {".py": 5, ".ts": 3, ".js": 2, ".yaml": 2, ".sh": 1, ".md": 1}
+
+# Directories the scanner must prune; the generator buries files inside them.
+EXCLUDED_SAMPLE = sorted(EXCLUDE_DIR_NAMES - {".git"})
+
+# allocate_dummy_lines_per_language() is too fast to time one call at a time.
+ALLOCATE_LOOPS = 1000
+
+
+@dataclass
+class TreeShape:
+    """Parameters of a synthetic tree; the same shape and seed give the same tree."""
+
+    files: int = 5000
+    depth: int = 4
+    fanout: int = 6
+    median_bytes: int = 2048
+    size_sigma: float = 1.2
+    mix: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_MIX))
+    minified_files: int = 2
+    minified_bytes: int = 8 * 1024 * 1024
+    excluded_dirs: int = 4
+    excluded_depth: int = 6
+    excluded_files: int = 200
+    seed: int = 1
+
+
+@dataclass
+class Timing:
+    """Cold and warm wall time of one stage, with throughput for the warm run."""
+
+    cold_seconds: float
+    warm_seconds: float
+    files: int = 0
+    bytes: int = 0
+
+    @property
+    def files_per_sec(self) -> float:
+        return self.files / self.warm_seconds if self.warm_seconds else 0.0
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.bytes / 1e6 / self.warm_seconds if self.warm_seconds else 0.0
+
+    def to_json(self) -> Dict[str, float]:
+        return {
+            "cold_seconds": self.cold_seconds,
+            "warm_seconds": self.warm_seconds,
+            "files": self.files,
+            "bytes": self.bytes,
+            "files_per_sec": self.files_per_sec,
+            "mb_per_sec": self.mb_per_sec,
+        }
+
+
+def _line_pool(rng: random.Random, size: int = 512) -> List[bytes]:
+    """Source-like lines: indented words, some blank and whitespace-only."""
+    pool = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.1:
+            pool.append(b"\n")
+        elif roll < 0.15:
+            pool.append(b"    \n")
+        else:
+            indent = " " * (4 * rng.randrange(4))
+            words = " ".join(
+                "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9)))
+                for _ in range(rng.randint(1, 10))
+            )
+            pool.append(f"{indent}{words}\n".encode("ascii"))
+    return pool
+
+
+def _file_content(rng: random.Random, pool: List[bytes], size: int) -> bytes:
+    lines = []
+    total = 0
+    while total < size:
+        line = pool[rng.randrange(len(pool))]
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines)
+
+
+def _directories(rng: random.Random, shape: TreeShape) -> List[Path]:
+    """A random directory tree `shape.depth` levels deep."""
+    dirs = [Path("src")]
+    frontier = [Path("src")]
+    for level in range(shape.depth):
+        next_frontier = []
+        for parent in frontier:
+            for i in range(rng.randint(1, shape.fanout)):
+                child = parent / f"d{level}_{i}"
+                dirs.append(child)
+                next_frontier.append(child)
+        frontier = next_frontier
+    return dirs
+
+
+def build_synthetic_tree(root: Path, shape: TreeShape) -> None:
+    """Populate `root` (which should be empty) with a tree of the given shape."""
+    rng = random.Random(shape.seed)
+    pool = _line_pool(rng)
+    dirs = _directories(rng, shape)
+    extensions = list(shape.mix)
+    weights = [shape.mix[ext] for ext in extensions]
+    mu = math.log(max(1, shape.median_bytes))
+
+    for directory in dirs:
+        (root / directory).mkdir(parents=True, exist_ok=True)
+
+    for i in range(shape.files):
+        ext = rng.choices(extensions, weights)[0]
+        size = int(rng.lognormvariate(mu, shape.size_sigma))
+        path = root / rng.choice(dirs) / f"f{i}{ext}"
+        path.write_bytes(_file_content(rng, pool, size))
+
+    # Minified bundles: one enormous line each.
+    statement = b"var a=function(b){return b+1};"
+    for i in range(shape.minified_files):
+        path = root / rng.choice(dirs) / f"bundle{i}.min.js"
+        repeats = shape.minified_bytes // len(statement) + 1
+        path.write_bytes((statement * repeats)[:shape.minified_bytes])
+
+    # Deep trees under excluded directory names, which must never be read.
+    for i in range(shape.excluded_dirs):
+        excluded = rng.choice(dirs) / EXCLUDED_SAMPLE[i % len(EXCLUDED_SAMPLE)]
+        deep = excluded.joinpath(*(f"x{level}" for level in range(shape.excluded_depth)))
+        (root / deep).mkdir(parents=True, exist_ok=True)
+        for j in range(shape.excluded_files):
+            path = root / deep / f"dep{j}.js"
+            path.write_bytes(_file_content(rng, pool, shape.median_bytes))
+
+
+def evict_page_cache(root: Path) -> bool:
+    """
+    Ask the kernel to drop cached pages of every file under `root`.
+
+    Returns False when posix_fadvise is unavailable (e.g. macOS), in which
+    case "cold" runs are only cold with respect to the scanner's own caches.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                fd = os.open(os.path.join(dirpath, name), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fdatasync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+    return True
+
+
+def _time(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _measure(
+    fn: Callable[[], object],
+    repeat: int,
+    before_cold: Optional[Callable[[], object]] = None,
+) -> Tuple[float, float]:
+    """Return (cold, best warm) wall time of `fn`."""
+    if before_cold is not None:
+        before_cold()
+    cold = _time(fn)
+    warm = []
+    for _ in range(max(1, repeat)):
+        warm.append(_time(fn))
+    return cold, min(warm)
+
+
+def run_benchmarks(root: Path, work_dir: Path, repeat: int, jobs: int) -> Dict[str, Timing]:
+    """Time each scanner stage on the tree at `root`."""
+    evict = lambda: evict_page_cache(root)  # noqa: E731
+    results: Dict[str, Timing] = {}
+
+    sources = list(iter_source_files(root, backend="walk"))
+    source_bytes = sum(path.stat().st_size for path in sources)
+
+    cold, warm = _measure(
+        lambda: list(iter_source_files(root, backend="walk")), repeat, before_cold=evict
+    )
+    results["iter_source_files"] = Timing(cold, warm, files=len(sources))
+
+    def count_all() -> None:
+        for path in sources:
+            count_non_empty_lines(path)
+
+    cold, warm = _measure(count_all, repeat, before_cold=evict)
+    results["count_non_empty_lines"] = Timing(cold, warm, len(sources), source_bytes)
+
+    cold, warm = _measure(
+        lambda: gather_language_stats(root, jobs=jobs, backend="walk"),
+        repeat,
+        before_cold=evict,
+    )
+    results["gather_language_stats"] = Timing(cold, warm, len(sources), source_bytes)
+
+    cold, warm = _measure(
+        lambda: asyncio.run(gather_language_stats_async(root, backend="walk")),
+        repeat,
+        before_cold=evict,
+    )
+    results["gather_language_stats_async"] = Timing(cold, warm, len(sources), source_bytes)
+
+    # With the incremental scan cache: cold fills it, warm runs hit it.
+    cache_path = work_dir / "scan_cache.json"
+
+    def drop_cache() -> None:
+        evict()
+        if cache_path.exists():
+            cache_path.unlink()
+
+    cold, warm = _measure(
+        lambda: gather_language_stats(root, jobs=jobs, cache_path=cache_path, backend="walk"),
+        repeat,
+        before_cold=drop_cache,
+    )
+    results["gather_language_stats_cached"] = Timing(cold, warm, len(sources), source_bytes)
+
+    stats: Dict[str, LanguageStats] = gather_language_stats(root, jobs=jobs, backend="walk")
+    total_lines = sum(s.lines for s in stats.values())
+
+    def allocate() -> None:
+        for _ in range(ALLOCATE_LOOPS):
+            allocate_dummy_lines_per_language(stats, total_lines)
+
+    cold, warm = _measure(allocate, repeat)
+    results["allocate_dummy_lines_per_language"] = Timing(
+        cold / ALLOCATE_LOOPS, warm / ALLOCATE_LOOPS
+    )
+
+    # Dummy files sized like the tree itself. Cold writes every file; warm
+    # runs find identical content on disk and only hash it.
+    out_dir = work_dir / "generated"
+
+    def clear_output() -> None:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    cold, warm = _measure(
+        lambda: write_dummy_files(
+            stats, total_dummy_lines=total_lines, target_dir=out_dir, jobs=jobs
+        ),
+        repeat,
+        before_cold=clear_output,
+    )
+    written = list(out_dir.iterdir())
+    results["write_dummy_files"] = Timing(
+        cold, warm, len(written), sum(path.stat().st_size for path in written)
+    )
+    return results
+
+
+def _environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": str(os.cpu_count()),
+    }
+
+
+def print_results(results: Dict[str, Timing]) -> None:
+    print(f"{'Benchmark':36} {'Cold s':>10} {'Warm s':>10} {'Files/s':>11} {'MB/s':>9}")
+    print("-" * 80)
+    for name, timing in results.items():
+        print(
+            f"{name:36} {timing.cold_seconds:10.6f} {timing.warm_seconds:10.6f} "
+            f"{timing.files_per_sec:11.0f} {timing.mb_per_sec:9.1f}"
+        )
+
+
+def compare_baselines(
+    baseline: Dict[str, Dict[str, float]],
+    current: Dict[str, Dict[str, float]],
+    threshold: float,
+) -> List[str]:
+    """
+    Print a comparison table and return the regressed "benchmark.metric" keys.
+
+    A timing regresses when it is more than `threshold` (a fraction, 0.10 for
+    10%) slower than the baseline.
+    """
+    regressions = []
+    print(f"{'Benchmark':36} {'Metric':>13} {'Baseline':>10} {'Current':>10} {'Change':>8}")
+    print("-" * 81)
+    for name in sorted(set(baseline) & set(current)):
+        for metric in ("cold_seconds", "warm_seconds"):
+            old = baseline[name].get(metric)
+            new = current[name].get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1.0
+            flag = ""
+            if change > threshold:
+                regressions.append(f"{name}.{metric}")
+                flag = "  REGRESSION"
+            print(f"{name:36} {metric:>13} {old:10.6f} {new:10.6f} {change:+7.1%}{flag}")
+    for name in sorted(set(baseline) ^ set(current)):
+        print(f"{name:36} only in {'baseline' if name in baseline else 'current'}")
+    return regressions
+
+
+def _parse_mix(text: str) -> Dict[str, int]:
+    """Parse `py=5,ts=3` into {".py": 5, ".ts": 3}."""
+    mix = {}
+    for item in text.split(","):
+        ext, _, weight = item.partition("=")
+        ext = ext.strip()
+        mix[ext if ext.startswith(".") else "." + ext] = int(weight or 1)
+    return mix
+
+
+def _load(path: Path) -> Dict[str, Dict[str, float]]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if data.get("version") != BASELINE_VERSION:
+        raise SystemExit(f"{path}: unsupported baseline version {data.get('version')!r}")
+    return data["results"]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    defaults = TreeShape()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Build a synthetic tree and time the scanner on it.")
+    run.add_argument("--output", "-o", type=Path, help="Write the results to this JSON file.")
+    run.add_argument("--tree", type=Path, help="Benchmark (and keep) the tree in this "
+                     "directory, building it first if it is empty or missing.")
+    run.add_argument("--repeat", type=int, default=3, help="Warm runs per stage (default: 3).")
+    run.add_argument("--jobs", "-j", type=int, default=1,
+                     help="Worker processes for gather_language_stats (default: 1).")
+    run.add_argument("--files", type=int, default=defaults.files)
+    run.add_argument("--depth", type=int, default=defaults.depth)
+    run.add_argument("--fanout", type=int, default=defaults.fanout)
+    run.add_argument("--median-bytes", type=int, default=defaults.median_bytes)
+    run.add_argument("--size-sigma", type=float, default=defaults.size_sigma,
+                     help="Spread of the log-normal file size distribution.")
+    run.add_argument("--mix", type=_parse_mix, default=defaults.mix,
+                     help="Language mix as ext=weight pairs, e.g. 'py=5,ts=3,md=1'.")
+    run.add_argument("--minified-files", type=int, default=defaults.minified_files)
+    run.add_argument("--minified-bytes", type=int, default=defaults.minified_bytes)
+    run.add_argument("--excluded-dirs", type=int, default=defaults.excluded_dirs)
+    run.add_argument("--excluded-depth", type=int, default=defaults.excluded_depth)
+    run.add_argument("--excluded-files", type=int, default=defaults.excluded_files)
+    run.add_argument("--seed", type=int, default=defaults.seed)
+
+    compare = commands.add_parser("compare", help="Compare two result files.")
+    compare.add_argument("baseline", type=Path)
+    compare.add_argument("current", type=Path)
+    compare.add_argument("--threshold", type=float, default=0.10,
+                         help="Allowed slowdown as a fraction (default: 0.10).")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    if args.command == "compare":
+        regressions = compare_baselines(_load(args.baseline), _load(args.current), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}.")
+            return 1
+        return 0
+
+    shape = TreeShape(
+        files=args.files,
+        depth=args.depth,
+        fanout=args.fanout,
+        median_bytes=args.median_bytes,
+        size_sigma=args.size_sigma,
+        mix=args.mix,
+        minified_files=args.minified_files,
+        minified_bytes=args.minified_bytes,
+        excluded_dirs=args.excluded_dirs,
+        excluded_depth=args.excluded_depth,
+        excluded_files=args.excluded_files,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory(prefix="langbench-") as scratch:
+        work_dir = Path(scratch)
+        root = args.tree or work_dir / "tree"
+        if not root.exists() or not any(root.iterdir()):
+            root.mkdir(parents=True, exist_ok=True)
+            print(f"Building synthetic tree under {root} ...")
+            build_synthetic_tree(root, shape)
+        results = run_benchmarks(root, work_dir, args.repeat, args.jobs)
+
+    print_results(results)
+    if args.output:
+        payload = {
+            "version": BASELINE_VERSION,
+            "shape": asdict(shape),
+            "environment": _environment(),
+            "results": {name: timing.to_json() for name, timing in results.items()},
+        }
+        args.output.write_text(json.dumps(payload, indent=2) + "\n", encoding="utf-8")
+        print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Line counts keyed by file content, shared by every checkout on the machine.
+
+The mtime-based ScanCache only helps while a worktree stays put: switching
+branches or creating a fresh worktree changes every mtime, although most file
+contents are identical. `ContentCache` instead maps a content key to the
+(language, lines) result of measuring that content:
+
+* `git:<sha>` - the blob id from the git index, for tracked files whose stat
+  data still matches the index. No byte of the file has to be read on a hit.
+* `b2:<digest>` - a blake2b digest of the bytes, for everything else.
+
+Both keys also carry the language derived from the file name, since the same
+bytes can be sniffed differently under another name. A blob id describes the
+content git stores, which is not the checked-out content when clean/smudge
+filters (e.g. Git LFS) are in use; such files are still cached consistently,
+as every checkout with the same filters produces the same working file.
+
+The database lives in the per-user cache directory (see default_cache_path())
+and is safe to share between concurrent scans.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Bump whenever the way lines are counted changes, so stale counts are ignored.
+CONTENT_CACHE_VERSION = 1
+
+# blake2b digest size in bytes; 160 bits, like a SHA-1 blob id.
+CONTENT_DIGEST_SIZE = 20
+
+# Keys per SELECT when looking up many at once (below SQLite's variable limit).
+LOOKUP_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counts (
+    key TEXT PRIMARY KEY,
+    language TEXT,
+    lines INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# (language, lines) as measure_file() returns it.
+Measurement = Tuple[Optional[str], int]
+
+
+def default_cache_path() -> Path:
+    """The per-user database location, following each platform's convention."""
+    if sys.platform == "win32":
+        base = Path(os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local")
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    return base / "browseterm" / "language_detection" / "line_counts.db"
+
+
+def blob_key(hexsha: str, language: Optional[str]) -> str:
+    return f"git:{hexsha}:{language or ''}"
+
+
+def content_key(digest: bytes, language: Optional[str]) -> str:
+    return f"b2:{digest.hex()}:{language or ''}"
+
+
+def content_hasher() -> "hashlib.blake2b":
+    return hashlib.blake2b(digest_size=CONTENT_DIGEST_SIZE)
+
+
+class ContentCache:
+    """A line-count database; use as a context manager or call close()."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), timeout=30)
+        try:
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.executescript(SCHEMA)
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version != CONTENT_CACHE_VERSION:
+                with self._db:
+                    self._db.execute("DELETE FROM counts")
+                    self._db.execute(f"PRAGMA user_version = {CONTENT_CACHE_VERSION}")
+        except sqlite3.Error:
+            self._db.close()
+            raise
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "ContentCache":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def get(self, key: str) -> Optional[Measurement]:
+        row = self._db.execute(
+            "SELECT language, lines FROM counts WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Measurement]:
+        """The cached measurement of each known key; unknown keys are left out."""
+        found: Dict[str, Measurement] = {}
+        pending: List[str] = list(keys)
+        for start in range(0, len(pending), LOOKUP_BATCH_SIZE):
+            batch = pending[start:start + LOOKUP_BATCH_SIZE]
+            rows = self._db.execute(
+                "SELECT key, language, lines FROM counts WHERE key IN "
+                f"({', '.join('?' * len(batch))})",
+                batch,
+            )
+            for key, language, lines in rows:
+                found[key] = (language, lines)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, Optional[str], int]]) -> None:
+        """Store (key, language, lines) triples in one transaction."""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO counts (key, language, lines) VALUES (?, ?, ?)",
+                items,
+            )
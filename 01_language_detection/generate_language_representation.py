@@ -11,146 +11,2454 @@ The goal is to make it easy for GitHub's language statistics to reflect the
 actual mix of languages in the codebase, including this script itself.
 
 Usage:
-    python language_detection/generate_language_representation.py
+    python language_detection/generate_language_representation.py [--jobs N] [--no-cache] [--profile]
+    python language_detection/generate_language_representation.py --source snapshot.tar.gz
+
+To keep statistics warm between runs, see scan_daemon.py. To scan from
+another program, import this module and use Scanner; importing it has no
+side effects.
 
 The script is intentionally dependency-free (standard library only).
 """
 
-from __future__ import annotations
+from __future__ import annotations
+
+import argparse
+import asyncio
+import codecs
+import concurrent.futures
+import contextlib
+import cProfile
+import csv
+import functools
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import stat
+import statistics
+import string
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from itertools import chain
+from pathlib import Path
+from typing import (
+    AbstractSet,
+    BinaryIO,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from content_cache import (
+    ContentCache,
+    blob_key,
+    content_hasher,
+    content_key,
+    default_cache_path,
+)
+from git_attributes import AttributeMatcher
+from git_index import IndexEntry, find_git_dir, iter_tracked_files
+from git_objects import OBJ_BLOB, Commit, ObjectStore, iter_first_parent, resolve_ref
+from git_patterns import GitIgnore, is_ignored
+from inotify_ctypes import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_DONT_FOLLOW,
+    IN_EXCL_UNLINK,
+    IN_IGNORED,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_ONLYDIR,
+    IN_Q_OVERFLOW,
+    Inotify,
+    InotifyEvent,
+)
+from source_filters import (
+    DECISION_BYTES,
+    DECISION_COUNT,
+    DECISION_SKIP,
+    DEFAULT_MAX_FILE_BYTES,
+    SourceFilter,
+)
+from stats_store import FileRow, StatsStore
+
+
+# Root of the repository (this file lives in 01_language_detection/).
+# Derived from the module itself, so importing it from anywhere (a server, a
+# test process) finds the same paths as running the script.
+SCRIPT_PATH = Path(__file__).resolve()
+REPO_ROOT = SCRIPT_PATH.parents[1]
+
+# Where to put generated dummy files
+GENERATED_DIR = REPO_ROOT / "01_language_detection" / "generated"
+
+# Dummy files are named "<language slug><marker><extension>"; files in the
+# target directory with the marker that a run no longer produces are removed.
+DUMMY_FILE_MARKER = "_language_representation"
+
+# Where per-file scan results are persisted between runs (see ScanCache).
+SCAN_CACHE_PATH = REPO_ROOT / "01_language_detection" / ".cache" / "scan_cache.json"
+
+# Directories that should not be scanned for language statistics.
+EXCLUDE_DIR_NAMES = {
+    ".git",
+    ".idea",
+    ".vscode",
+    "__pycache__",
+    "node_modules",
+    ".venv",
+    "venv",
+    "env",
+    ".tox",
+    ".mypy_cache",
+    ".pytest_cache",
+    # Tool caches, including our own scan cache.
+    ".cache",
+    # We don't want previously generated dummy files to influence counts
+    # when re-running the script.
+    "generated",
+}
+
+
+# Map file extensions to a language label. This does not need to be perfect,
+# just close enough to what GitHub Linguist would infer.
+EXTENSION_TO_LANGUAGE: Mapping[str, str] = {
+    ".py": "Python",
+    ".js": "JavaScript",
+    ".jsx": "JavaScript",
+    ".ts": "TypeScript",
+    ".tsx": "TypeScript",
+    ".sh": "Shell",
+    ".bash": "Shell",
+    ".zsh": "Shell",
+    ".yml": "YAML",
+    ".yaml": "YAML",
+    ".json": "JSON",
+    ".md": "Markdown",
+    ".rst": "reStructuredText",
+    ".txt": "Text",
+    ".lock": "Text",
+    ".proto": "Protocol Buffers",
+    ".mk": "Makefile",
+    ".dockerfile": "Dockerfile",
+}
+
+# Files recognised by their exact name, regardless of extension.
+FILENAME_TO_LANGUAGE: Mapping[str, str] = {
+    "Makefile": "Makefile",
+    "makefile": "Makefile",
+    "GNUmakefile": "Makefile",
+    "Dockerfile": "Dockerfile",
+    "Containerfile": "Dockerfile",
+}
+
+# Shebang interpreters (without version suffix) and the language they imply.
+# Only consulted for files whose name doesn't already give a language.
+INTERPRETER_TO_LANGUAGE: Mapping[str, str] = {
+    "python": "Python",
+    "sh": "Shell",
+    "bash": "Shell",
+    "zsh": "Shell",
+    "dash": "Shell",
+    "ksh": "Shell",
+    "node": "JavaScript",
+    "nodejs": "JavaScript",
+    "make": "Makefile",
+}
+
+# The sniffing stage reads at most this much of each candidate file before
+# deciding whether it is worth a full read.
+SNIFF_BYTES = 4096
+
+# "Generated" markers are only looked for in the first few lines, like
+# Linguist does; further down they are usually code that mentions them.
+SNIFF_GENERATED_LINES = 5
+GENERATED_MARKERS = re.compile(
+    rb"@generated|do not edit|auto-?generated|code generated by",
+    re.IGNORECASE,
+)
+LFS_POINTER_PREFIX = b"version https://git-lfs.github.com/spec/"
+
+# Verdicts of sniff_header(). Only SNIFF_TEXT files are counted.
+SNIFF_TEXT = "text"
+SNIFF_BINARY = "binary"
+SNIFF_LFS_POINTER = "lfs-pointer"
+SNIFF_GENERATED = "generated"
+SNIFF_UNKNOWN = "unknown"
+
+# Dummy lines are assembled from a pool of line heads and a pool of line tails
+# (256 each, so one random byte picks an entry) and written in chunks of
+# DUMMY_CHUNK_LINES lines.
+DUMMY_POOL_SIZE = 256
+DUMMY_CHUNK_LINES = 1 << 16
+
+# Every dummy file starts with this many header lines (see
+# _dummy_file_chunks()), so a language gets either no dummy lines or at
+# least this many.
+DUMMY_HEADER_LINES = 4
+
+# Upper bound on the repository size solve_minimal_allocation() searches.
+MAX_SOLVER_TOTAL = 1 << 48
+
+# Below this many dummy lines (or bytes) in total, files are generated
+# in-process; a worker pool costs more to start than the generation itself.
+PARALLEL_DUMMY_LINES = 1 << 18
+PARALLEL_DUMMY_BYTES = 1 << 24
+
+# Dummy content per run without --target, in lines or (about the same size)
+# bytes.
+DEFAULT_DUMMY_AMOUNT = {"lines": 2000, "bytes": 80_000}
+
+# Block size used when reading files for line counting.
+COUNT_BLOCK_SIZE = 1 << 20
+
+# Watch mode: after the first event, wait for this much quiet before updating
+# so that e.g. a `git checkout` becomes a single batch, but never hold an
+# update back for longer than WATCH_MAX_DELAY_SECONDS.
+WATCH_DEBOUNCE_SECONDS = 0.25
+WATCH_MAX_DELAY_SECONDS = 2.0
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_CREATE
+    | IN_DELETE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_DELETE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+
+# Bump whenever the meaning of a cached entry changes so stale caches are
+# discarded instead of misread.
+SCAN_CACHE_VERSION = 3
+
+# Default SQLite database for `--db` (see stats_store.StatsStore).
+SCAN_DB_PATH = REPO_ROOT / "01_language_detection" / ".cache" / "scan_stats.db"
+
+# Number of files handed to a worker process at a time in parallel mode.
+# Large enough to amortise the pickling round-trip, small enough that the
+# pool stays busy on trees with a few very large files.
+PARALLEL_BATCH_SIZE = 256
+
+# estimate_language_stats(): files larger than SAMPLE_BLOCK_THRESHOLD are
+# estimated from SAMPLE_BLOCKS (doubling each round) random blocks of
+# SAMPLE_BLOCK_SIZE bytes, and every size stratum contributes at least
+# SAMPLE_MIN_PER_STRATUM files so its variance can be estimated.
+SAMPLE_BLOCK_SIZE = 1 << 16
+SAMPLE_BLOCK_THRESHOLD = 1 << 23
+SAMPLE_BLOCKS = 16
+SAMPLE_MIN_PER_STRATUM = 4
+
+# gather_language_stats_async(): files per queue item, and how many items each
+# queue holds. Together with the worker count these bound how many SourceFile
+# records are in memory at once, however large the tree.
+ASYNC_BATCH_SIZE = 64
+ASYNC_QUEUE_BATCHES = 8
+
+# What its measuring stage hands the aggregator per batch: the batch number,
+# (language, lines) and size of each file, and whether it was read (False for
+# files counted by bytes only).
+_MeasuredBatch = Tuple[int, List[Tuple[Optional[str], int]], List[int], List[bool]]
+
+# cgroup files describing the CPU quota of the current container. v2 exposes a
+# single "<quota> <period>" file, v1 splits it in two (and the controller
+# directory name differs between distributions).
+CGROUP_V2_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+CGROUP_V1_CPU_DIRS = (
+    Path("/sys/fs/cgroup/cpu"),
+    Path("/sys/fs/cgroup/cpu,cpuacct"),
+)
+
+
+@dataclass
+class LanguageStats:
+    language: str
+    lines: int = 0
+    files: int = 0
+    # Total size of the language's files, including empty ones not counted
+    # in `files`.
+    bytes: int = 0
+
+    @property
+    def percentage(self) -> float:
+        # To be set later once we know total lines
+        return 0.0
+
+
+class SourceFile(NamedTuple):
+    """
+    A file selected for scanning, as produced by the enumeration backends.
+
+    Kept deliberately small (a tuple of plain values) since large trees yield
+    hundreds of thousands of them; `relpath` is '/'-separated and relative to
+    the scan root. The stat fields come from the same stat() call the walk
+    made, so later stages don't need to stat the file again. `language` is
+    None for extensionless files that are left to the sniffing stage.
+    `blob` is the git blob id of files known to be unmodified since they were
+    added to the index (see content_cache).
+    """
+
+    relpath: str
+    language: Optional[str]
+    size: int
+    mtime_ns: int
+    inode: int
+    blob: Optional[str] = None
+
+    def path(self, root: Path) -> Path:
+        """Build the full Path; only done when a caller really needs one."""
+        return root / self.relpath
+
+
+def _name_suffix(name: str) -> str:
+    """Lower-cased extension of a file name, with pathlib's suffix rules."""
+    dot = name.rfind(".")
+    if dot <= 0 or dot == len(name) - 1:
+        return ""
+    return name[dot:].lower()
+
+
+class SourceSelection(NamedTuple):
+    """
+    Which files a scan looks at, and the language each name gives.
+
+    `extensions` maps lower-cased suffixes (".py") and `filenames` exact file
+    names to languages; directories named in `exclude_dir_names` are pruned.
+    The defaults are this module's tables.
+    """
+
+    exclude_dir_names: AbstractSet[str] = frozenset(EXCLUDE_DIR_NAMES)
+    extensions: Mapping[str, str] = EXTENSION_TO_LANGUAGE
+    filenames: Mapping[str, str] = FILENAME_TO_LANGUAGE
+
+    def language_for_name(self, name: str) -> Optional[str]:
+        """Return the language for a bare file name, or None if unknown."""
+        lang = self.filenames.get(name)
+        if lang is not None:
+            return lang
+        return self.extensions.get(_name_suffix(name))
+
+    def is_excluded(self, relpath: str) -> bool:
+        """True if any directory component of a '/'-separated path is excluded."""
+        return any(part in self.exclude_dir_names for part in relpath.split("/")[:-1])
+
+
+DEFAULT_SELECTION = SourceSelection()
+
+
+def language_for_name(name: str) -> str | None:
+    """Return the language for a bare file name, or None if unknown."""
+    return DEFAULT_SELECTION.language_for_name(name)
+
+
+def is_scan_candidate(name: str, language: str | None) -> bool:
+    """
+    Whether a file should reach the scanning stages at all.
+
+    Files with a known language always do; extensionless files do too, since
+    the sniffing stage may still recognise them from a shebang.
+    """
+    return language is not None or _name_suffix(name) == ""
+
+
+def detect_language(path: Path) -> str | None:
+    """Return the language name for a given file path, or None if unknown."""
+    return language_for_name(path.name)
+
+
+# .gitattributes attributes that GitHub Linguist reads: paths with any of the
+# first set are left out of the statistics, and linguist-language forces one.
+LINGUIST_EXCLUDING_ATTRIBUTES = (
+    "linguist-vendored",
+    "linguist-generated",
+    "linguist-documentation",
+)
+LINGUIST_LANGUAGE_ATTRIBUTE = "linguist-language"
+
+
+def _language_aliases() -> Dict[str, str]:
+    """Lower-cased names a linguist-language value may use for our languages."""
+    aliases: Dict[str, str] = {}
+    for ext, lang in EXTENSION_TO_LANGUAGE.items():
+        aliases[ext.lstrip(".")] = lang
+    aliases.update(INTERPRETER_TO_LANGUAGE)
+    for lang in chain(EXTENSION_TO_LANGUAGE.values(), FILENAME_TO_LANGUAGE.values()):
+        # Linguist spells multi-word names with dashes, e.g. "Protocol-Buffers".
+        aliases[lang.lower()] = lang
+        aliases[lang.lower().replace(" ", "-")] = lang
+    return aliases
+
+
+LANGUAGE_ALIASES: Mapping[str, str] = _language_aliases()
+
+
+class LinguistOverrides:
+    """
+    Linguist's .gitattributes overrides for the files of one worktree.
+
+    All attribute lines are compiled once, up front (see git_attributes), so
+    classifying a path is a few regex matches. A linguist-language naming a
+    language this script has no dummy-file support for is ignored, and the
+    file keeps the language its name gives it.
+    """
+
+    def __init__(self, attributes: AttributeMatcher) -> None:
+        self.attributes = attributes
+
+    @classmethod
+    def for_worktree(cls, root: Path) -> Optional["LinguistOverrides"]:
+        """The overrides of `root`, or None if no attributes file sets any."""
+        attributes = AttributeMatcher.for_worktree(
+            root, LINGUIST_EXCLUDING_ATTRIBUTES + (LINGUIST_LANGUAGE_ATTRIBUTE,)
+        )
+        return cls(attributes) if attributes else None
+
+    def classify(self, relpath: str, language: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """
+        (excluded, language) for a '/'-separated relpath whose name gives
+        `language`: whether Linguist leaves the file out of the statistics,
+        and the language it counts as.
+        """
+        for name in LINGUIST_EXCLUDING_ATTRIBUTES:
+            value = self.attributes.value(name, relpath)
+            # Like Linguist, any value but "false" sets a boolean attribute.
+            if value is True or (isinstance(value, str) and value != "false"):
+                return True, language
+        forced = self.attributes.value(LINGUIST_LANGUAGE_ATTRIBUTE, relpath)
+        if isinstance(forced, str):
+            language = LANGUAGE_ALIASES.get(forced.lower(), language)
+        return False, language
+
+
+# File enumeration backends accepted by iter_source_files().
+SOURCE_BACKENDS = ("auto", "git", "walk")
+
+# What languages are measured by: non-empty lines (read every file), or bytes
+# (GitHub Linguist's metric; taken from the stat data, no file is opened).
+METRICS = ("lines", "bytes")
+
+# Sources gather_language_stats() streams as archives instead of walking.
+# Every compression tarfile supports is accepted.
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ZIP_SUFFIXES = (".zip",)
+
+
+def _is_excluded(relpath: str) -> bool:
+    """True if any directory component of a '/'-separated path is excluded."""
+    return DEFAULT_SELECTION.is_excluded(relpath)
+
+
+def iter_walked_entries(
+    root: Path,
+    ignore: Optional[GitIgnore] = None,
+    start: str = "",
+    linguist: Optional[LinguistOverrides] = None,
+    selection: SourceSelection = DEFAULT_SELECTION,
+) -> Iterator[SourceFile]:
+    """
+    Walk the tree under root with os.scandir, skipping excluded directories.
+
+    Files are visited in the same order as os.walk (top-down, depth-first).
+    Languages are looked up on the raw entry name and the stat data comes from
+    the DirEntry, so no Path object is created per file.
+
+    With `ignore`, files and directories matched by .gitignore rules are
+    skipped too; ignored directories are never opened. `start` (a
+    '/'-terminated relpath) limits the walk to that subdirectory; yielded
+    paths stay relative to root. With `linguist`, files its attributes
+    exclude are skipped and forced languages replace the detected ones.
+    `selection` supplies the excluded directories and language tables.
+    """
+    exclude_dir_names = selection.exclude_dir_names
+    language_of = selection.language_for_name
+    root_str = os.fspath(root)
+    stack = [start]
+    while stack:
+        prefix = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root_str, prefix) if prefix else root_str)
+        except OSError:
+            continue
+        rules = ignore.rules_for(prefix) if ignore is not None else ()
+        subdirs: List[str] = []
+        with it:
+            for entry in it:
+                name = entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if name not in exclude_dir_names and not (
+                            rules and is_ignored(rules, prefix + name, True)
+                        ):
+                            subdirs.append(f"{prefix}{name}/")
+                        continue
+                    lang = language_of(name)
+                    if linguist is not None:
+                        excluded, lang = linguist.classify(prefix + name, lang)
+                        if excluded:
+                            continue
+                    # Skip files without a known language (and dangling or
+                    # directory symlinks).
+                    if not is_scan_candidate(name, lang) or not entry.is_file():
+                        continue
+                    if rules and is_ignored(rules, prefix + name, False):
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                yield SourceFile(prefix + name, lang, st.st_size, st.st_mtime_ns, st.st_ino)
+        stack.extend(reversed(subdirs))
+
+
+def iter_git_entries(
+    root: Path,
+    linguist: Optional[LinguistOverrides] = None,
+    selection: SourceSelection = DEFAULT_SELECTION,
+    entries: Optional[Iterable[IndexEntry]] = None,
+) -> Iterator[SourceFile]:
+    """
+    Yield the files tracked in root's git index (and its submodules' indexes).
+
+    This is what GitHub sees: untracked build output, virtualenvs and other
+    local clutter never show up, and no directory is traversed at all. Files
+    that are tracked but deleted from the working tree are skipped; files
+    whose stat data still matches the index carry their blob id. `linguist`
+    and `selection` apply as in iter_walked_entries(). `entries` are
+    iter_tracked_files(root), for callers that have already read them.
+    """
+    root_str = os.fspath(root)
+    if entries is None:
+        entries = iter_tracked_files(root)
+    for entry in entries:
+        if selection.is_excluded(entry.path):
+            continue
+        name = entry.path.rpartition("/")[2]
+        lang = selection.language_for_name(name)
+        if linguist is not None:
+            excluded, lang = linguist.classify(entry.path, lang)
+            if excluded:
+                continue
+        if not is_scan_candidate(name, lang):
+            continue
+        try:
+            st = os.stat(os.path.join(root_str, entry.path))
+        except OSError:
+            continue
+        blob = entry.hexsha if entry.stat_matches(st) else None
+        yield SourceFile(entry.path, lang, st.st_size, st.st_mtime_ns, st.st_ino, blob)
+
+
+def iter_source_entries(
+    root: Path,
+    backend: str = "auto",
+    linguist: bool = True,
+) -> Iterator[SourceFile]:
+    """
+    Yield a SourceFile for every file under root whose language we can detect.
+
+    `backend` selects how files are enumerated: "git" reads the git index,
+    "walk" traverses the working tree (honouring .gitignore files), and
+    "auto" uses the index when root is a git checkout and falls back to
+    walking otherwise.
+
+    Unless `linguist` is false, the linguist-* attributes of root's (and its
+    submodules') .gitattributes are honoured, see LinguistOverrides.
+    """
+    if backend not in SOURCE_BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}; expected one of {SOURCE_BACKENDS}")
+    overrides = LinguistOverrides.for_worktree(root) if linguist else None
+    if backend == "git" or (backend == "auto" and find_git_dir(root) is not None):
+        return iter_git_entries(root, overrides)
+    return iter_walked_entries(root, GitIgnore(root), linguist=overrides)
+
+
+def iter_source_files(root: Path, backend: str = "auto") -> Iterable[Path]:
+    """Yield the Path of every file iter_source_entries() selects."""
+    for source in iter_source_entries(root, backend):
+        yield source.path(root)
+
+
+class LineCounter:
+    """
+    Incremental non-empty line counter working on blocks of raw bytes.
+
+    Feed it consecutive blocks of a file; `finish()` then returns what
+    reading the file in text mode as UTF-8 (errors ignored) and counting the
+    lines that are not blank after str.strip() would give. Blocks are decoded
+    the way TextIOWrapper does it, with universal newlines, and each block is
+    split once with its blank lines counted by list.count() and map(isspace)
+    instead of a Python-level loop per line.
+    """
+
+    def __init__(self) -> None:
+        self.lines = 0
+        # Whether the unterminated last line of the previous block has content.
+        self._open = False
+        self._decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder("utf-8")(errors="ignore"), translate=True
+        )
+
+    def feed(self, block: bytes) -> None:
+        self._count(self._decoder.decode(bytes(block)))
+
+    def _count(self, text: str) -> None:
+        lines = text.split("\n")
+        # The unterminated last line is only counted once it is complete.
+        tail = lines.pop()
+        if lines:
+            self.lines += len(lines) - lines.count("") - sum(map(str.isspace, lines))
+            if self._open and (not lines[0] or lines[0].isspace()):
+                # The first line started in an earlier block with content.
+                self.lines += 1
+            self._open = False
+        self._open = self._open or (bool(tail) and not tail.isspace())
+
+    def finish(self) -> int:
+        """Return the final count (a trailing partial UTF-8 sequence is dropped)."""
+        self._count(self._decoder.decode(b"", final=True))
+        self._decoder.reset()
+        self.lines += self._open
+        self._open = False
+        return self.lines
+
+
+# One read buffer per thread, reused across files.
+_read_buffers = threading.local()
+
+
+def _read_buffer() -> bytearray:
+    buf = getattr(_read_buffers, "buf", None)
+    if buf is None:
+        buf = _read_buffers.buf = bytearray(COUNT_BLOCK_SIZE)
+    return buf
+
+
+def _interpreter_language(head: bytes) -> Optional[str]:
+    """Language implied by a `#!` line, e.g. `#!/usr/bin/env python3`."""
+    if not head.startswith(b"#!"):
+        return None
+    words = head[2:].split(b"\n", 1)[0].decode("latin-1").split()
+    if not words:
+        return None
+    program = os.path.basename(words[0])
+    if program == "env":
+        # Skip env's own options (e.g. `env -S bash -e`).
+        args = [word for word in words[1:] if not word.startswith("-")]
+        program = args[0] if args else ""
+    return INTERPRETER_TO_LANGUAGE.get(program.rstrip("0123456789."))
+
+
+def sniff_header(head: bytes, language: Optional[str]) -> Tuple[Optional[str], str]:
+    """
+    Classify a file from its first SNIFF_BYTES bytes.
+
+    Returns the (possibly newly detected) language and a verdict: SNIFF_TEXT
+    for files that should be counted, or SNIFF_BINARY, SNIFF_LFS_POINTER,
+    SNIFF_GENERATED or SNIFF_UNKNOWN (no language) for files to skip.
+    """
+    if b"\0" in head:
+        return None, SNIFF_BINARY
+    if head.startswith(LFS_POINTER_PREFIX):
+        return None, SNIFF_LFS_POINTER
+    if language is None:
+        language = _interpreter_language(head)
+        if language is None:
+            return None, SNIFF_UNKNOWN
+    first_lines = head.split(b"\n", SNIFF_GENERATED_LINES)[:SNIFF_GENERATED_LINES]
+    if GENERATED_MARKERS.search(b"\n".join(first_lines)):
+        return None, SNIFF_GENERATED
+    return language, SNIFF_TEXT
+
+
+def _feed_file(f, counter: LineCounter) -> int:
+    """Feed the rest of an open binary file to `counter` and return the count."""
+    buf = _read_buffer()
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            break
+        counter.feed(buf if n == len(buf) else buf[:n])
+    return counter.finish()
+
+
+def count_non_empty_lines(path: Union[Path, str]) -> int:
+    """
+    Count non-empty lines in a file, forgiving encoding issues.
+
+    Works on raw bytes in COUNT_BLOCK_SIZE blocks (see LineCounter) and gives
+    the same result as decoding the file as UTF-8 with errors ignored and
+    counting lines that are not blank after str.strip().
+    """
+    try:
+        with open(path, "rb", buffering=0) as f:
+            return _feed_file(f, LineCounter())
+    except OSError:
+        # If we can't read a file for some reason, just skip it.
+        return 0
+
+
+def measure_file(
+    path: Union[Path, str],
+    language: Optional[str],
+) -> Tuple[Optional[str], int]:
+    """
+    Sniff a file and, if it is countable text, count its non-empty lines.
+
+    Only the first SNIFF_BYTES are read before sniff_header() decides, so
+    binaries, LFS pointers and generated files never pay for a full read.
+    Returns (language, lines); the language is None for skipped files.
+    """
+    try:
+        with open(path, "rb", buffering=0) as f:
+            return _measure_open_file(f, language)
+    except OSError:
+        # If we can't read a file for some reason, just skip it.
+        return language, 0
+
+
+def _measure_open_file(f, language: Optional[str]) -> Tuple[Optional[str], int]:
+    """measure_file() on a binary file object positioned at its start."""
+    head = f.read(SNIFF_BYTES)
+    language, verdict = sniff_header(head, language)
+    if verdict != SNIFF_TEXT:
+        return None, 0
+    counter = LineCounter()
+    counter.feed(head)
+    return language, _feed_file(f, counter)
+
+
+def sniff_file(path: Union[Path, str], language: Optional[str]) -> Optional[str]:
+    """
+    The detection half of measure_file(): the language to count `path` as,
+    or None if sniff_header() rejects it.
+    """
+    try:
+        with open(path, "rb", buffering=0) as f:
+            head = f.read(SNIFF_BYTES)
+    except OSError:
+        return language
+    language, verdict = sniff_header(head, language)
+    return language if verdict == SNIFF_TEXT else None
+
+
+def measure_bytes(data: bytes, language: Optional[str]) -> Tuple[Optional[str], int]:
+    """measure_file() for content that is already in memory, e.g. a git blob."""
+    language, verdict = sniff_header(data[:SNIFF_BYTES], language)
+    if verdict != SNIFF_TEXT:
+        return None, 0
+    counter = LineCounter()
+    for start in range(0, len(data), COUNT_BLOCK_SIZE):
+        counter.feed(data[start:start + COUNT_BLOCK_SIZE])
+    return language, counter.finish()
+
+
+def _add_file_to_stats(
+    stats: Dict[str, LanguageStats],
+    lang: str,
+    file_lines: int,
+    file_bytes: int = 0,
+) -> None:
+    """
+    Account one file of `file_lines` non-empty lines and `file_bytes` bytes
+    to `lang` in `stats`.
+    """
+    if lang not in stats:
+        stats[lang] = LanguageStats(language=lang, lines=0, files=0)
+    stats[lang].bytes += file_bytes
+    # Empty files register the language but don't count as a file.
+    if file_lines == 0:
+        return
+    stats[lang].lines += file_lines
+    stats[lang].files += 1
+
+
+def _add_sized_file_to_stats(
+    stats: Dict[str, LanguageStats],
+    lang: str,
+    file_bytes: int,
+) -> None:
+    """_add_file_to_stats() for the bytes metric, where lines are not known."""
+    if lang not in stats:
+        stats[lang] = LanguageStats(language=lang, lines=0, files=0)
+    if file_bytes == 0:
+        return
+    stats[lang].files += 1
+    stats[lang].bytes += file_bytes
+
+
+def _measure_batch(
+    files: List[Tuple[str, Optional[str]]],
+) -> List[Tuple[Optional[str], int]]:
+    """Measure a batch of files. Runs in worker processes in parallel mode."""
+    return [measure_file(path, language) for path, language in files]
+
+
+def measure_file_by_content(
+    path: Union[Path, str],
+    language: Optional[str],
+    cache: ContentCache,
+) -> Tuple[Optional[str], int, Optional[str]]:
+    """
+    measure_file(), answered from `cache` when the same content (under the
+    same name-derived language) was measured before.
+
+    The file is hashed with blake2b; files up to COUNT_BLOCK_SIZE are read
+    once and measured from memory on a miss. Returns (language, lines, key),
+    where key is the content key to store the result under, or None on a hit.
+    """
+    try:
+        with open(path, "rb", buffering=0) as f:
+            data = f.read(COUNT_BLOCK_SIZE + 1)
+            hasher = content_hasher()
+            hasher.update(data)
+            small = len(data) <= COUNT_BLOCK_SIZE
+            if not small:
+                buf = _read_buffer()
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    hasher.update(buf if n == len(buf) else buf[:n])
+            key = content_key(hasher.digest(), language)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached[0], cached[1], None
+            if small:
+                return measure_bytes(data, language) + (key,)
+            f.seek(0)
+            return _measure_open_file(f, language) + (key,)
+    except OSError:
+        return language, 0, None
+
+
+def _measure_batch_by_content(
+    cache: ContentCache,
+    files: List[Tuple[str, Optional[str], Optional[str]]],
+) -> List[Tuple[Optional[str], int, Optional[str]]]:
+    """
+    Measure (path, language, blob key) triples that missed the cache lookup
+    by blob key; files without one go through measure_file_by_content().
+    Returns (language, lines, key to store or None) for each.
+    """
+    results: List[Tuple[Optional[str], int, Optional[str]]] = []
+    for path, language, key in files:
+        if key is None:
+            results.append(measure_file_by_content(path, language, cache))
+        else:
+            results.append(measure_file(path, language) + (key,))
+    return results
+
+
+# Content caches opened by worker processes, one per process and database.
+# The pid is part of the key so a forked child never reuses its parent's
+# SQLite connection.
+_worker_content_caches: Dict[Tuple[int, str], ContentCache] = {}
+
+
+def _measure_batch_in_worker(
+    cache_path: str,
+    files: List[Tuple[str, Optional[str], Optional[str]]],
+) -> List[Tuple[Optional[str], int, Optional[str]]]:
+    """_measure_batch_by_content() for a worker process."""
+    key = (os.getpid(), cache_path)
+    cache = _worker_content_caches.get(key)
+    if cache is None:
+        cache = _worker_content_caches[key] = ContentCache(Path(cache_path))
+    return _measure_batch_by_content(cache, files)
+
+
+def _count_batch(paths: List[str]) -> List[int]:
+    """Count a batch of files. Runs in worker processes in parallel mode."""
+    return [count_non_empty_lines(path) for path in paths]
+
+
+def _remove_file_from_stats(
+    stats: Dict[str, LanguageStats],
+    lang: str,
+    file_lines: int,
+    file_bytes: int = 0,
+) -> None:
+    """Undo a previous _add_file_to_stats() call for the same file."""
+    if lang not in stats:
+        return
+    stats[lang].bytes -= file_bytes
+    if file_lines == 0:
+        return
+    stats[lang].lines -= file_lines
+    stats[lang].files -= 1
+
+
+def _read_cgroup_cpu_quota() -> Optional[float]:
+    """
+    Return the CPU quota of the current cgroup as a number of CPUs.
+
+    Returns None when no quota is set or the cgroup files are unavailable
+    (e.g. when not running inside a container).
+    """
+    try:
+        quota, period = CGROUP_V2_CPU_MAX.read_text().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+
+    for cpu_dir in CGROUP_V1_CPU_DIRS:
+        try:
+            quota_us = int((cpu_dir / "cpu.cfs_quota_us").read_text())
+            period_us = int((cpu_dir / "cpu.cfs_period_us").read_text())
+        except (OSError, ValueError):
+            continue
+        # A quota of -1 means "unlimited".
+        if quota_us <= 0 or period_us <= 0:
+            return None
+        return quota_us / period_us
+    return None
+
+
+def default_jobs() -> int:
+    """
+    Pick a worker count for parallel scanning.
+
+    Inside a k3s pod `os.cpu_count()` reports the node's cores, not what the
+    pod may actually use, so the cgroup CPU quota takes precedence. Outside a
+    container we fall back to the CPUs this process is allowed to run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        available = len(os.sched_getaffinity(0))
+    else:
+        available = os.cpu_count() or 1
+
+    quota = _read_cgroup_cpu_quota()
+    if quota is not None:
+        available = min(available, int(quota))
+    return max(1, available)
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def _batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Split `items` into lists of at most `size` elements."""
+    batch: List[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def measure_files(
+    root: Path,
+    sources: List[SourceFile],
+    jobs: int = 1,
+    content_cache: Optional[ContentCache] = None,
+    pool: Optional[concurrent.futures.Executor] = None,
+) -> List[Tuple[Optional[str], int]]:
+    """
+    Return measure_file()'s (language, lines) for each source, in order.
+
+    With `jobs` > 1 the files are measured in batches by a pool of worker
+    processes; results are collected in submission order either way. A
+    `pool` given by the caller is used (and left running) instead of
+    starting one for this call.
+
+    With a `content_cache`, only content never measured before is counted
+    (see _measure_files_by_content()).
+    """
+    if content_cache is not None:
+        return _measure_files_by_content(root, sources, jobs, content_cache, pool)
+    root_str = os.fspath(root)
+    files = [(os.path.join(root_str, s.relpath), s.language) for s in sources]
+    return _map_batches(_measure_batch, files, jobs, pool)
+
+
+def _map_batches(
+    function: Callable[[List[T]], List[R]],
+    items: List[T],
+    jobs: int,
+    pool: Optional[concurrent.futures.Executor] = None,
+) -> List[R]:
+    """
+    Apply a batch `function` to `items` and return its results, in order.
+
+    With `jobs` > 1 and more than one PARALLEL_BATCH_SIZE batch of items, the
+    batches go to a pool of worker processes (see _process_pool()); otherwise
+    `function` runs on all the items in this process.
+    """
+    if jobs <= 1 or len(items) <= PARALLEL_BATCH_SIZE:
+        return function(items)
+
+    results: List[R] = []
+    with _process_pool(pool, jobs) as executor:
+        for batch_results in executor.map(function, _batched(items, PARALLEL_BATCH_SIZE)):
+            results.extend(batch_results)
+    return results
+
+
+def _process_pool(
+    pool: Optional[concurrent.futures.Executor],
+    jobs: int,
+) -> ContextManager[concurrent.futures.Executor]:
+    """The caller's `pool`, left open on exit, or a new one of `jobs` processes."""
+    if pool is not None:
+        return contextlib.nullcontext(pool)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+
+
+def _measure_files_by_content(
+    root: Path,
+    sources: List[SourceFile],
+    jobs: int,
+    cache: ContentCache,
+    pool: Optional[concurrent.futures.Executor] = None,
+) -> List[Tuple[Optional[str], int]]:
+    """
+    measure_files() through a ContentCache.
+
+    Files with a blob id are looked up here first and never opened on a hit;
+    the rest are hashed (and counted on a miss) by the workers. New results
+    are added to the cache in one transaction at the end.
+    """
+    root_str = os.fspath(root)
+    keys = [
+        blob_key(source.blob, source.language) if source.blob else None
+        for source in sources
+    ]
+    known = cache.get_many(key for key in keys if key is not None)
+
+    results: List[Tuple[Optional[str], int]] = [(None, 0)] * len(sources)
+    misses: List[int] = []
+    for index, key in enumerate(keys):
+        cached = known.get(key) if key is not None else None
+        if cached is not None:
+            results[index] = cached
+        else:
+            misses.append(index)
+
+    files = [
+        (os.path.join(root_str, sources[index].relpath), sources[index].language, keys[index])
+        for index in misses
+    ]
+    if jobs <= 1 or len(files) <= PARALLEL_BATCH_SIZE:
+        measured = _measure_batch_by_content(cache, files)
+    else:
+        worker = functools.partial(_measure_batch_in_worker, os.fspath(cache.path))
+        measured = _map_batches(worker, files, jobs, pool)
+
+    new: List[Tuple[str, Optional[str], int]] = []
+    for index, (lang, file_lines, key) in zip(misses, measured):
+        results[index] = (lang, file_lines)
+        if key is not None:
+            new.append((key, lang, file_lines))
+    cache.put_many(new)
+    return results
+
+
+def write_atomically(path: Path, chunks: Iterable[bytes]) -> None:
+    """
+    Write `chunks` to `path` via a temp file in the same directory + rename.
+
+    Readers never see a half-written file. The file keeps the permissions of
+    the one it replaces (0644 for new files) rather than mkstemp's 0600.
+    """
+    try:
+        mode = path.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+@dataclass
+class CachedFile:
+    """Scan result for one file, valid as long as its stat data is unchanged."""
+
+    size: int
+    mtime_ns: int
+    inode: int
+    # None if the sniffing stage rejected the file.
+    language: Optional[str]
+    lines: int
+    # The language the file was enumerated with (source.language), which a
+    # .gitattributes override can change without touching the file.
+    detected: Optional[str] = None
+
+    def matches(self, source: SourceFile) -> bool:
+        return (
+            self.size == source.size
+            and self.mtime_ns == source.mtime_ns
+            and self.inode == source.inode
+            and self.detected == source.language
+        )
+
+
+class ScanCache:
+    """
+    Per-file scan results persisted between runs.
+
+    Entries are keyed by the path relative to the scanned root and are only
+    trusted while the file's size, mtime and inode are unchanged. Like git's
+    index, an entry whose mtime is not older than the scan that recorded it is
+    "racily clean" (the file may have changed again within the same timestamp
+    tick) and is re-counted.
+
+    The cache records the root it was filled from: relpaths of another tree
+    mean nothing, so a cache loaded for a different root starts empty.
+    """
+
+    def __init__(
+        self,
+        entries: Optional[Dict[str, CachedFile]] = None,
+        scanned_at_ns: int = 0,
+        root: str = "",
+    ) -> None:
+        self.entries: Dict[str, CachedFile] = entries or {}
+        self.scanned_at_ns = scanned_at_ns
+        self.root = root
+
+    @classmethod
+    def load(cls, path: Path, root: Path) -> "ScanCache":
+        """
+        Load a cache file for scanning `root`; a missing, corrupt or outdated
+        cache, or one filled from another root, is empty.
+        """
+        empty = cls(root=os.fspath(root))
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != SCAN_CACHE_VERSION or data.get("root") != empty.root:
+                return empty
+            entries = {
+                key: CachedFile(*value) for key, value in data["files"].items()
+            }
+            return cls(entries, int(data["scanned_at_ns"]), empty.root)
+        except (OSError, ValueError, KeyError, TypeError):
+            return empty
+
+    def save(self, path: Path) -> None:
+        """Write the cache atomically (temp file + rename)."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": SCAN_CACHE_VERSION,
+            "root": self.root,
+            "scanned_at_ns": self.scanned_at_ns,
+            "files": {
+                key: [e.size, e.mtime_ns, e.inode, e.language, e.lines, e.detected]
+                for key, e in self.entries.items()
+            },
+        }
+        write_atomically(path, [json.dumps(data, separators=(",", ":")).encode("utf-8")])
+
+    def lookup(self, source: SourceFile) -> Optional[CachedFile]:
+        entry = self.entries.get(source.relpath)
+        if entry is None or not entry.matches(source):
+            return None
+        if entry.mtime_ns >= self.scanned_at_ns:
+            return None
+        return entry
+
+    def update(self, source: SourceFile, language: Optional[str], lines: int) -> None:
+        self.entries[source.relpath] = CachedFile(
+            size=source.size,
+            mtime_ns=source.mtime_ns,
+            inode=source.inode,
+            language=language,
+            lines=lines,
+            detected=source.language,
+        )
+
+    def prune(self, seen: Iterable[str]) -> int:
+        """Drop entries for files that were not seen; return how many."""
+        keep = set(seen)
+        stale = [key for key in self.entries if key not in keep]
+        for key in stale:
+            del self.entries[key]
+        return len(stale)
+
+
+@dataclass
+class PhaseStats:
+    """Resources used by one phase of a profiled run."""
+
+    name: str
+    wall_seconds: float
+    # User + system time, including worker processes that exited in the phase.
+    cpu_seconds: float
+    # Peak of memory allocated by Python during the phase (tracemalloc); does
+    # not include worker processes.
+    peak_bytes: int
+
+
+def _cpu_seconds() -> float:
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class PhaseProfiler:
+    """
+    Records wall time, CPU time and tracemalloc peak per named phase.
+
+    With `cprofile=True` each phase also runs under its own cProfile.Profile,
+    so the slowest one can be dumped afterwards (see dump_slowest()).
+    """
+
+    def __init__(self, cprofile: bool = False) -> None:
+        self.phases: List[PhaseStats] = []
+        self._cprofile = cprofile
+        self._profiles: Dict[str, cProfile.Profile] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        # Reset the peak so it reflects this phase only.
+        tracemalloc.clear_traces()
+        profile = cProfile.Profile() if self._cprofile else None
+        wall_start = time.perf_counter()
+        cpu_start = _cpu_seconds()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiles[name] = profile
+            wall = time.perf_counter() - wall_start
+            cpu = _cpu_seconds() - cpu_start
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            self.phases.append(PhaseStats(name, wall, cpu, peak))
+
+    def slowest(self) -> Optional[PhaseStats]:
+        return max(self.phases, key=lambda p: p.wall_seconds, default=None)
+
+    def dump_slowest(self, path: Path) -> Optional[PhaseStats]:
+        """Write the cProfile stats of the slowest phase to `path`."""
+        slowest = self.slowest()
+        if slowest is None or slowest.name not in self._profiles:
+            return None
+        self._profiles[slowest.name].dump_stats(os.fspath(path))
+        return slowest
+
+
+def _phase(profiler: Optional[PhaseProfiler], name: str) -> ContextManager[None]:
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name)
+
+
+def _measure_files_profiled(
+    root: Path,
+    sources: List[SourceFile],
+    jobs: int,
+    profiler: PhaseProfiler,
+) -> List[Tuple[Optional[str], int]]:
+    """
+    measure_files(), split into a "detect" and a "count" phase.
+
+    Profiled runs sniff every file first and count the survivors afterwards,
+    so the two phases can be timed separately. Results are identical; only the
+    small header read is repeated.
+    """
+    root_str = os.fspath(root)
+    paths = [os.path.join(root_str, s.relpath) for s in sources]
+    with profiler.phase("detect"):
+        languages = [sniff_file(path, s.language) for path, s in zip(paths, sources)]
+    with profiler.phase("count"):
+        text = [index for index, lang in enumerate(languages) if lang]
+        counts = _map_batches(_count_batch, [paths[index] for index in text], jobs)
+
+    results: List[Tuple[Optional[str], int]] = [(None, 0)] * len(sources)
+    for index, file_lines in zip(text, counts):
+        results[index] = (languages[index], file_lines)
+    return results
+
+
+def is_archive(path: Path) -> bool:
+    """Whether `path` names a tar or zip archive (by its suffix)."""
+    return path.name.lower().endswith(TAR_SUFFIXES + ZIP_SUFFIXES)
+
+
+def _archive_source(name: str, size: int, mtime_ns: int) -> Optional[SourceFile]:
+    """A SourceFile for an archive member, or None if it is not to be scanned."""
+    # "./src/x.py" and "/src/x.py" become "src/x.py".
+    relpath = "/".join(part for part in name.split("/") if part not in ("", "."))
+    if not relpath or _is_excluded(relpath):
+        return None
+    file_name = relpath.rpartition("/")[2]
+    lang = language_for_name(file_name)
+    if not is_scan_candidate(file_name, lang):
+        return None
+    return SourceFile(relpath, lang, size, mtime_ns, 0)
+
+
+def iter_archive_entries(archive: Path) -> Iterator[Tuple[SourceFile, BinaryIO]]:
+    """
+    Yield the scannable regular files of a tar or zip archive, in archive
+    order, each with a file object to read it from.
+
+    Nothing is extracted. Tar archives (compressed or not) are read as a
+    single forward stream, so a member's file object is only valid until the
+    next member is requested, and memory use does not grow with the archive.
+    Member paths are pruned with EXCLUDE_DIR_NAMES like a walk; symlinks,
+    links and encrypted zip members are skipped.
+    """
+    if archive.name.lower().endswith(ZIP_SUFFIXES):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or stat.S_ISLNK(info.external_attr >> 16):
+                    continue
+                if info.flag_bits & 0x1:
+                    continue
+                # Zip timestamps are local time with 2-second resolution.
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                source = _archive_source(
+                    info.filename, info.file_size, int(mtime) * 1_000_000_000
+                )
+                if source is None:
+                    continue
+                with zf.open(info) as f:
+                    yield source, f
+        return
+
+    with tarfile.open(archive, "r|*") as tf:
+        for member in tf:
+            if not member.isfile():
+                continue
+            source = _archive_source(member.name, member.size, int(member.mtime) * 1_000_000_000)
+            if source is None:
+                continue
+            f = tf.extractfile(member)
+            if f is not None:
+                yield source, f
+
+
+def measure_archive(
+    archive: Path,
+    source_filter: Optional[SourceFilter] = None,
+) -> Iterator[Tuple[SourceFile, Optional[str], int]]:
+    """
+    measure_file() for every member iter_archive_entries() selects, as
+    (source, language, lines); each member is streamed through the sniffer
+    and LineCounter in COUNT_BLOCK_SIZE blocks.
+
+    Members `source_filter` skips are left out, and members it counts by
+    bytes only are yielded with 0 lines without being read.
+    """
+    for source, f in iter_archive_entries(archive):
+        decision = DECISION_COUNT
+        if source_filter is not None:
+            decision = source_filter.classify(source.relpath, source.size)
+        if decision == DECISION_BYTES:
+            yield source, source.language, 0
+        elif decision == DECISION_COUNT:
+            language, file_lines = _measure_open_file(f, source.language)
+            yield source, language, file_lines
+
+
+def _gather_archive_stats(
+    archive: Path,
+    store: Optional[StatsStore] = None,
+    metric: str = "lines",
+    source_filter: Optional[SourceFilter] = None,
+) -> Dict[str, LanguageStats]:
+    """gather_language_stats() for an archive: one pass, aggregated as it streams."""
+    stats: Dict[str, LanguageStats] = {}
+    if metric == "bytes":
+        # Member contents are skipped over, never sniffed or counted.
+        for source, _f in iter_archive_entries(archive):
+            if source_filter is not None and (
+                source_filter.classify(source.relpath, source.size) == DECISION_SKIP
+            ):
+                continue
+            if source.language:
+                _add_sized_file_to_stats(stats, source.language, source.size)
+        return stats
+
+    def rows() -> Iterator[FileRow]:
+        for source, lang, file_lines in measure_archive(archive, source_filter):
+            if lang:
+                _add_file_to_stats(stats, lang, file_lines, source.size)
+                yield FileRow(source.relpath, lang, file_lines, source.size, source.mtime_ns)
+
+    if store is not None:
+        store.record_scan(archive, rows())
+    else:
+        for _ in rows():
+            pass
+    return stats
+
+
+def gather_language_stats(
+    root: Path,
+    jobs: Optional[int] = 1,
+    cache_path: Optional[Path] = None,
+    backend: str = "auto",
+    profiler: Optional[PhaseProfiler] = None,
+    store: Optional[StatsStore] = None,
+    content_cache: Optional[ContentCache] = None,
+    metric: str = "lines",
+    source_filter: Optional[SourceFilter] = None,
+) -> Dict[str, LanguageStats]:
+    """
+    Scan the repository and return a mapping of language -> stats.
+
+    With `jobs` > 1 files are counted by a pool of worker processes; counts
+    are aggregated in walk order, so the result is identical to a serial
+    scan. `jobs=None` picks `default_jobs()`.
+
+    With `cache_path`, per-file results are loaded from and saved back to a
+    ScanCache so that files whose stat data is unchanged are not read again.
+    Whatever that leaves is looked up by content in `content_cache`, so only
+    content no checkout has counted before is counted (not when profiling:
+    profiled runs always sniff and count every file).
+
+    `backend` is passed to iter_source_files() and picks between reading the
+    git index and walking the working tree.
+
+    With a `profiler`, the enumerate, detect and count phases are recorded
+    separately. With a `store`, one row per counted file is recorded there as
+    a new scan.
+
+    `root` may also be a .tar, .tar.gz or .zip archive (see is_archive()),
+    whose members are streamed and counted in a single serial pass; the
+    parallelism, caching and backend options don't apply to archives.
+
+    With `metric="bytes"`, stats are filled from the file sizes the
+    enumeration already has: no file is opened, so `lines` stay 0, files
+    count when they are not empty, and extensionless files (which only
+    sniffing could place) and generated or binary files are not told apart.
+    A `store` needs line counts and cannot be combined with it.
+
+    With a `source_filter`, files are classified by path and size before
+    anything is read: skipped files are left out, and files to count by
+    bytes only add to their language's bytes without being opened. What it
+    filtered is tallied in `source_filter.report`.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"unknown metric {metric!r}; expected one of {METRICS}")
+    if metric == "bytes" and store is not None:
+        raise ValueError("a StatsStore records line counts; it needs metric='lines'")
+    if is_archive(root) and root.is_file():
+        with _phase(profiler, "count"):
+            return _gather_archive_stats(root, store, metric, source_filter)
+
+    if jobs is None:
+        jobs = default_jobs()
+
+    measure = measure_files
+    if content_cache is not None:
+        measure = functools.partial(measure_files, content_cache=content_cache)
+    if profiler is not None:
+        measure = functools.partial(_measure_files_profiled, profiler=profiler)
+
+    with _phase(profiler, "enumerate"):
+        sources = list(iter_source_entries(root, backend))
+
+    bytes_only: List[SourceFile] = []
+    if source_filter is not None:
+        with _phase(profiler, "filter"):
+            sources, bytes_only = _prefilter_sources(source_filter, sources)
+
+    if metric == "bytes":
+        return _sized_stats(chain(sources, bytes_only))
+
+    if cache_path is None:
+        results = measure(root, sources, jobs)
+    else:
+        scan_started_ns = time.time_ns()
+        cache = ScanCache.load(cache_path, root)
+        results = _measure_files_cached(root, sources, cache, jobs, measure)
+        cache.prune(source.relpath for source in sources)
+        cache.scanned_at_ns = scan_started_ns
+        cache.save(cache_path)
+
+    if store is not None:
+        with _phase(profiler, "store"):
+            store.record_scan(
+                root,
+                (
+                    FileRow(source.relpath, lang, file_lines, source.size, source.mtime_ns)
+                    for source, (lang, file_lines) in chain(
+                        zip(sources, results),
+                        ((source, (source.language, 0)) for source in bytes_only),
+                    )
+                    if lang
+                ),
+            )
+
+    return _measured_stats(sources, results, bytes_only)
+
+
+def _sized_stats(sources: Iterable[SourceFile]) -> Dict[str, LanguageStats]:
+    """Stats by bytes from the sizes enumeration recorded; nothing is read."""
+    stats: Dict[str, LanguageStats] = {}
+    for source in sources:
+        if source.language:
+            _add_sized_file_to_stats(stats, source.language, source.size)
+    return stats
+
+
+def _measured_stats(
+    sources: List[SourceFile],
+    results: List[Tuple[Optional[str], int]],
+    bytes_only: List[SourceFile],
+) -> Dict[str, LanguageStats]:
+    """Aggregate measured results, plus files only counted by their bytes."""
+    stats: Dict[str, LanguageStats] = {}
+    for source, (lang, file_lines) in zip(sources, results):
+        if lang:
+            _add_file_to_stats(stats, lang, file_lines, source.size)
+    for source in bytes_only:
+        if source.language:
+            _add_file_to_stats(stats, source.language, 0, source.size)
+    return stats
+
+
+def _prefilter_sources(
+    source_filter: SourceFilter,
+    sources: List[SourceFile],
+) -> Tuple[List[SourceFile], List[SourceFile]]:
+    """Split sources into the ones to count and the ones to count by bytes only."""
+    counted: List[SourceFile] = []
+    bytes_only: List[SourceFile] = []
+    for source in sources:
+        decision = source_filter.classify(source.relpath, source.size)
+        if decision == DECISION_COUNT:
+            counted.append(source)
+        elif decision == DECISION_BYTES:
+            bytes_only.append(source)
+    return counted, bytes_only
+
+
+def load_language_stats(
+    store: StatsStore,
+    scan_id: Optional[int] = None,
+) -> Dict[str, LanguageStats]:
+    """
+    The stats gather_language_stats() returned for a recorded scan (the
+    latest by default), rebuilt from `store` without touching the files.
+    """
+    return {
+        totals.language: LanguageStats(
+            totals.language, totals.lines, totals.files, totals.bytes
+        )
+        for totals in store.language_totals(scan_id)
+    }
+
+
+@dataclass
+class LanguageEstimate:
+    """Estimated statistics of one language, with confidence interval margins."""
+
+    language: str
+    lines: float
+    # Half-width of the confidence interval on `lines`.
+    lines_margin: float
+    percentage: float
+    # Half-width of the confidence interval on `percentage`, in points.
+    percentage_margin: float
+
+
+@dataclass
+class ApproximateStats:
+    """Result of estimate_language_stats()."""
+
+    estimates: Dict[str, LanguageEstimate]
+    confidence: float
+    # Fraction of the files of each stratum sampled in the last round.
+    fraction: float
+    rounds: int
+    files_sampled: int
+    files_total: int
+    bytes_read: int
+    bytes_total: int
+
+    @property
+    def max_percentage_margin(self) -> float:
+        return max((e.percentage_margin for e in self.estimates.values()), default=0.0)
+
+
+class _SampledFile(NamedTuple):
+    """A measured sample: its language, (estimated) lines and their variance."""
+
+    language: Optional[str]
+    lines: float
+    # 0 for files counted in full; from the block sample otherwise.
+    variance: float
+    bytes_read: int
+
+
+def _size_class(size: int) -> int:
+    """Stratum of a file size: one per factor of 4, so similar sizes share one."""
+    return size.bit_length() // 2
+
+
+def measure_file_blocks(
+    path: Union[Path, str],
+    language: Optional[str],
+    blocks: int,
+    rng: random.Random,
+) -> _SampledFile:
+    """
+    Estimate a large file's non-empty lines from `blocks` random blocks of
+    SAMPLE_BLOCK_SIZE bytes, after sniffing its header like measure_file().
+
+    Only the complete lines inside each block are counted; lines per byte of
+    those spans are scaled to the file size (a ratio estimator), and the
+    variance comes from how much the blocks disagree. Files with no more
+    blocks than asked for are counted in full instead.
+    """
+    try:
+        with open(path, "rb", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            total_blocks = size // SAMPLE_BLOCK_SIZE
+            if blocks >= total_blocks:
+                language, file_lines = _measure_open_file(f, language)
+                return _SampledFile(language, file_lines, 0.0, size)
+
+            head = f.read(SNIFF_BYTES)
+            language, verdict = sniff_header(head, language)
+            if verdict != SNIFF_TEXT:
+                return _SampledFile(None, 0.0, 0.0, len(head))
+
+            counts: List[int] = []
+            spans: List[int] = []
+            for index in sorted(rng.sample(range(total_blocks), blocks)):
+                f.seek(index * SAMPLE_BLOCK_SIZE)
+                block = f.read(SAMPLE_BLOCK_SIZE)
+                # Drop the partial lines at both ends (the first block starts
+                # a line).
+                start = block.find(b"\n") + 1 if index else 0
+                end = block.rfind(b"\n") + 1
+                span = block[start:end] if end > start else b""
+                counter = LineCounter()
+                counter.feed(span)
+                counts.append(counter.finish())
+                spans.append(len(span))
+    except OSError:
+        return _SampledFile(language, 0.0, 0.0, 0)
+
+    bytes_read = len(head) + blocks * SAMPLE_BLOCK_SIZE
+    mean_span = sum(spans) / blocks
+    if mean_span == 0:
+        # Lines longer than a block; the sample says nothing.
+        return _SampledFile(language, count_non_empty_lines(path), 0.0, bytes_read + size)
+    ratio = sum(counts) / sum(spans)
+    residuals = [count - ratio * span for count, span in zip(counts, spans)]
+    variance = 0.0
+    if blocks > 1:
+        spread = sum(r * r for r in residuals) / (blocks - 1)
+        variance = (1 - blocks / total_blocks) * spread / (blocks * mean_span ** 2) * size ** 2
+    return _SampledFile(language, ratio * size, variance, bytes_read)
+
+
+def _estimate(
+    strata: Mapping[Tuple[Optional[str], int], Tuple[int, List[_SampledFile]]],
+    z: float,
+) -> Dict[str, LanguageEstimate]:
+    """
+    Stratified two-stage estimates from (population size, samples) per
+    stratum. Shares use the ratio estimator's linearized variance.
+    """
+    totals: Dict[str, float] = {}
+    for population, samples in strata.values():
+        weight = population / len(samples)
+        for sample in samples:
+            if sample.language:
+                totals[sample.language] = totals.get(sample.language, 0.0) + weight * sample.lines
+    grand_total = sum(totals.values())
+
+    def variance(values: List[float], within: float, population: int) -> float:
+        n = len(values)
+        result = population / n * within
+        if n > 1 and n < population:
+            mean = sum(values) / n
+            spread = sum((v - mean) ** 2 for v in values) / (n - 1)
+            result += population ** 2 * (1 - n / population) * spread / n
+        return result
+
+    estimates: Dict[str, LanguageEstimate] = {}
+    for lang, total in totals.items():
+        share = total / grand_total if grand_total else 0.0
+        total_variance = 0.0
+        share_variance = 0.0
+        for population, samples in strata.values():
+            own = [s.lines if s.language == lang else 0.0 for s in samples]
+            rest = [s.lines if s.language and s.language != lang else 0.0 for s in samples]
+            within_own = sum(s.variance for s in samples if s.language == lang)
+            within_rest = sum(s.variance for s in samples if s.language and s.language != lang)
+            total_variance += variance(own, within_own, population)
+            share_variance += variance(
+                [(1 - share) * o - share * r for o, r in zip(own, rest)],
+                (1 - share) ** 2 * within_own + share ** 2 * within_rest,
+                population,
+            )
+        share_margin = z * math.sqrt(share_variance) / grand_total if grand_total else 0.0
+        estimates[lang] = LanguageEstimate(
+            language=lang,
+            lines=total,
+            lines_margin=z * math.sqrt(total_variance),
+            percentage=share * 100.0,
+            percentage_margin=share_margin * 100.0,
+        )
+    return estimates
+
+
+def estimate_language_stats(
+    root: Path,
+    error_bound: float = 1.0,
+    fraction: float = 0.01,
+    confidence: float = 0.95,
+    backend: str = "auto",
+    jobs: int = 1,
+    seed: int = 0,
+    source_filter: Optional[SourceFilter] = None,
+) -> ApproximateStats:
+    """
+    Estimate per-language non-empty lines from a sample of the files.
+
+    Files are grouped into strata by language and size class (from the stat
+    data the enumeration already has), and `fraction` of every stratum (at
+    least SAMPLE_MIN_PER_STRATUM files) is measured. Files above
+    SAMPLE_BLOCK_THRESHOLD are themselves sampled in blocks (see
+    measure_file_blocks()). While the `confidence` interval of any language's
+    percentage is wider than ±`error_bound` points, the fraction and the
+    number of blocks per large file are doubled and the sample extended; at
+    worst every file ends up counted in full and the result is exact.
+
+    `source_filter` applies as in gather_language_stats(), before anything
+    is sampled. Files it counts by bytes only add no lines, so they are left
+    out of the sample too and never read.
+    """
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    rng = random.Random(seed)
+    root_str = os.fspath(root)
+
+    # Each stratum's files in a random order; a round samples a prefix.
+    population: Dict[Tuple[Optional[str], int], List[SourceFile]] = defaultdict(list)
+    bytes_total = 0
+    for source in iter_source_entries(root, backend):
+        if source_filter is not None and (
+            source_filter.classify(source.relpath, source.size) != DECISION_COUNT
+        ):
+            continue
+        population[(source.language, _size_class(source.size))].append(source)
+        bytes_total += source.size
+    for files in population.values():
+        rng.shuffle(files)
+
+    measured: Dict[str, _SampledFile] = {}
+    blocks = SAMPLE_BLOCKS
+    rounds = 0
+    bytes_read = 0
+    while True:
+        rounds += 1
+        wanted = {
+            key: files[:max(SAMPLE_MIN_PER_STRATUM, math.ceil(fraction * len(files)))]
+            for key, files in population.items()
+        }
+        small: List[SourceFile] = []
+        large: List[SourceFile] = []
+        for files in wanted.values():
+            for source in files:
+                previous = measured.get(source.relpath)
+                if previous is not None and previous.variance == 0:
+                    continue
+                if source.size > SAMPLE_BLOCK_THRESHOLD:
+                    # Re-sampled every round, with more blocks, until the
+                    # blocks cover it and it is counted in full.
+                    large.append(source)
+                else:
+                    small.append(source)
+
+        for source, (lang, file_lines) in zip(small, measure_files(root, small, jobs)):
+            measured[source.relpath] = _SampledFile(lang, file_lines, 0.0, source.size)
+            bytes_read += source.size
+        for source in large:
+            sample = measure_file_blocks(
+                os.path.join(root_str, source.relpath), source.language, blocks, rng
+            )
+            measured[source.relpath] = sample
+            bytes_read += sample.bytes_read
+
+        strata = {
+            key: (len(population[key]), [measured[source.relpath] for source in files])
+            for key, files in wanted.items()
+        }
+        result = ApproximateStats(
+            estimates=_estimate(strata, z),
+            confidence=confidence,
+            fraction=min(fraction, 1.0),
+            rounds=rounds,
+            files_sampled=sum(len(files) for files in wanted.values()),
+            files_total=sum(len(files) for files in population.values()),
+            bytes_read=bytes_read,
+            bytes_total=bytes_total,
+        )
+        # Once everything is counted in full the margins are 0, so this ends.
+        if result.max_percentage_margin <= error_bound:
+            return result
+        fraction *= 2
+        blocks *= 2
+
+
+@dataclass
+class CommitLanguageStats:
+    """Language statistics of the tree of one commit."""
+
+    sha: str
+    # Committer timestamp, seconds since the epoch.
+    timestamp: int
+    stats: Dict[str, LanguageStats]
+
+
+class HistoryScanner:
+    """
+    Language statistics of commits, read from the object store.
+
+    Each blob is measured once per language its name implies, and each tree's
+    totals are memoized by tree id, so a commit only costs work for the
+    subtrees it actually changed. Files are selected like the "git" backend
+    selects them; submodules are not descended into.
+    """
+
+    def __init__(self, store: ObjectStore) -> None:
+        self.store = store
+        # (blob id, language from the name) -> measure_bytes() result + size
+        self._blobs: Dict[Tuple[bytes, Optional[str]], Tuple[Optional[str], int, int]] = {}
+        # tree id -> language -> (lines, files, bytes)
+        self._trees: Dict[bytes, Dict[str, Tuple[int, int, int]]] = {}
+
+    def commit_stats(self, commit: Commit) -> Dict[str, LanguageStats]:
+        return {
+            lang: LanguageStats(lang, lines, files, size)
+            for lang, (lines, files, size) in self._tree_totals(commit.tree).items()
+        }
+
+    def _tree_totals(self, sha: bytes) -> Dict[str, Tuple[int, int, int]]:
+        totals = self._trees.get(sha)
+        if totals is not None:
+            return totals
+
+        totals = {}
+        for entry in self.store.tree(sha):
+            if entry.is_tree:
+                if entry.name in EXCLUDE_DIR_NAMES:
+                    continue
+                for lang, (lines, files, size) in self._tree_totals(entry.sha).items():
+                    old_lines, old_files, old_size = totals.get(lang, (0, 0, 0))
+                    totals[lang] = (old_lines + lines, old_files + files, old_size + size)
+            elif entry.is_blob:
+                lang = language_for_name(entry.name)
+                if not is_scan_candidate(entry.name, lang):
+                    continue
+                key = (entry.sha, lang)
+                result = self._blobs.get(key)
+                if result is None:
+                    data = self.store.read_typed(entry.sha, OBJ_BLOB)
+                    result = self._blobs[key] = measure_bytes(data, lang) + (len(data),)
+                lang, file_lines, size = result
+                if lang:
+                    old_lines, old_files, old_size = totals.get(lang, (0, 0, 0))
+                    totals[lang] = (
+                        old_lines + file_lines,
+                        old_files + (file_lines > 0),
+                        old_size + size,
+                    )
+        self._trees[sha] = totals
+        return totals
+
+
+def iter_language_history(
+    root: Path,
+    max_commits: Optional[int] = None,
+    ref: str = "HEAD",
+) -> Iterator[CommitLanguageStats]:
+    """
+    Yield the language statistics of `ref` and its first-parent ancestors,
+    newest first, without checking anything out.
+    """
+    git_dir = find_git_dir(root)
+    if git_dir is None:
+        raise ValueError(f"{root} is not a git checkout")
+    with ObjectStore(git_dir) as store:
+        scanner = HistoryScanner(store)
+        for commit in iter_first_parent(store, resolve_ref(git_dir, ref), max_commits):
+            yield CommitLanguageStats(
+                commit.sha.hex(), commit.timestamp, scanner.commit_stats(commit)
+            )
+
+
+def write_history_csv(
+    history: Iterable[CommitLanguageStats],
+    out: Optional[TextIO] = None,
+) -> None:
+    """Write one `commit,timestamp,language,lines,files,bytes` row per language and commit."""
+    writer = csv.writer(out or sys.stdout)
+    writer.writerow(["commit", "timestamp", "language", "lines", "files", "bytes"])
+    for entry in history:
+        for s in entry.stats.values():
+            writer.writerow([entry.sha, entry.timestamp, s.language, s.lines, s.files, s.bytes])
+
+
+async def gather_language_stats_async(
+    root: Path,
+    workers: Optional[int] = None,
+    backend: str = "auto",
+    executor: Optional[concurrent.futures.Executor] = None,
+    source_filter: Optional[SourceFilter] = None,
+) -> Dict[str, LanguageStats]:
+    """
+    gather_language_stats() for asyncio callers, as a three-stage pipeline.
+
+    A walker thread enumerates files into a bounded queue, `workers`
+    coroutines hand batches of them to `executor` (a thread pool by default,
+    so reads overlap with counting) and push the results into a second bounded
+    queue, and a single aggregator folds them into the stats. The event loop
+    is never blocked, and memory stays flat however large the tree is. The
+    result is identical to a serial gather_language_stats() call, with the
+    same `source_filter` applied by the walker.
+    """
+    if workers is None:
+        workers = default_jobs() + 4
+    loop = asyncio.get_running_loop()
+    # (batch number, files, whether each is read rather than counted by bytes).
+    sources: "asyncio.Queue[Optional[Tuple[int, List[SourceFile], List[bool]]]]" = (
+        asyncio.Queue(ASYNC_QUEUE_BATCHES)
+    )
+    results: "asyncio.Queue[Optional[_MeasuredBatch]]" = asyncio.Queue(ASYNC_QUEUE_BATCHES)
+    stop = threading.Event()
+    root_str = os.fspath(root)
+
+    def walk() -> None:
+        # Runs in its own thread; put() blocks it while the queue is full.
+        entries = iter_source_entries(root, backend)
+        for seq, batch in enumerate(_batched(entries, ASYNC_BATCH_SIZE)):
+            if stop.is_set():
+                return
+            kept: List[SourceFile] = []
+            read: List[bool] = []
+            for source in batch:
+                decision = DECISION_COUNT
+                if source_filter is not None:
+                    decision = source_filter.classify(source.relpath, source.size)
+                if decision != DECISION_SKIP:
+                    kept.append(source)
+                    read.append(decision == DECISION_COUNT)
+            asyncio.run_coroutine_threadsafe(sources.put((seq, kept, read)), loop).result()
+
+    async def produce() -> None:
+        walker = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="scan-walk")
+        try:
+            await loop.run_in_executor(walker, walk)
+        finally:
+            walker.shutdown(wait=False)
+            for _ in range(workers):
+                await sources.put(None)
+
+    async def measure(pool: concurrent.futures.Executor) -> None:
+        while True:
+            item = await sources.get()
+            if item is None:
+                break
+            seq, batch, read = item
+            files = [
+                (os.path.join(root_str, s.relpath), s.language)
+                for s, counted in zip(batch, read)
+                if counted
+            ]
+            counts = iter(await loop.run_in_executor(pool, _measure_batch, files))
+            # Files counted by bytes only are not read: their lines stay 0.
+            measured = [
+                next(counts) if counted else (s.language, 0) for s, counted in zip(batch, read)
+            ]
+            await results.put((seq, measured, [s.size for s in batch], read))
+
+    async def measure_all(pool: concurrent.futures.Executor) -> None:
+        try:
+            await asyncio.gather(*(measure(pool) for _ in range(workers)))
+        finally:
+            await results.put(None)
+
+    stats: Dict[str, LanguageStats] = {}
+    # Batches finish out of order; remember where each language first
+    # appeared in walk order so the result is ordered like a serial scan.
+    first_seen: Dict[str, Tuple[int, int, int]] = {}
+
+    async def aggregate() -> None:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            seq, measured, sizes, read = item
+            for position, ((lang, file_lines), size, counted) in enumerate(
+                zip(measured, sizes, read)
+            ):
+                if not lang:
+                    continue
+                # A serial scan aggregates files counted by bytes only last.
+                key = (0 if counted else 1, seq, position)
+                if lang not in first_seen or key < first_seen[lang]:
+                    first_seen[lang] = key
+                _add_file_to_stats(stats, lang, file_lines, size)
+
+    pool = executor or concurrent.futures.ThreadPoolExecutor(
+        workers, thread_name_prefix="scan-read"
+    )
+    tasks = [
+        asyncio.ensure_future(produce()),
+        asyncio.ensure_future(measure_all(pool)),
+        asyncio.ensure_future(aggregate()),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        # Unblock a walker thread waiting for room in the queue.
+        while not sources.empty():
+            sources.get_nowait()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if executor is None:
+            pool.shutdown(wait=False)
+
+    return {lang: stats[lang] for lang in sorted(stats, key=first_seen.__getitem__)}
+
+
+def _measure_files_cached(
+    root: Path,
+    sources: List[SourceFile],
+    cache: ScanCache,
+    jobs: int,
+    measure: Callable[
+        [Path, List[SourceFile], int], List[Tuple[Optional[str], int]]
+    ] = measure_files,
+) -> List[Tuple[Optional[str], int]]:
+    """
+    Resolve results from `cache`, measuring (and caching) only the misses.
+
+    Returns (language, lines) in the order of `sources`.
+    """
+    results: List[Tuple[Optional[str], int]] = [(None, 0)] * len(sources)
+    misses: List[int] = []
 
-import math
-import os
-import random
-import string
-import sys
-from collections import defaultdict
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Dict, Iterable, List, Mapping, Tuple
+    for index, source in enumerate(sources):
+        entry = cache.lookup(source)
+        if entry is not None:
+            results[index] = (entry.language, entry.lines)
+        else:
+            misses.append(index)
 
+    measured = measure(root, [sources[index] for index in misses], jobs)
+    for index, (lang, file_lines) in zip(misses, measured):
+        results[index] = (lang, file_lines)
+        cache.update(sources[index], lang, file_lines)
 
-# Root of the repository (this file lives in 01_language_detection/)
-# We use sys.argv[0] so the script can be run from the repo root:
-#   python 01_language_detection/generate_language_representation.py
-SCRIPT_PATH = Path(sys.argv[0]).resolve()
-REPO_ROOT = SCRIPT_PATH.parents[1]
+    return results
 
-# Where to put generated dummy files
-GENERATED_DIR = REPO_ROOT / "01_language_detection" / "generated"
 
-# Directories that should not be scanned for language statistics.
-EXCLUDE_DIR_NAMES = {
-    ".git",
-    ".idea",
-    ".vscode",
-    "__pycache__",
-    "node_modules",
-    ".venv",
-    "venv",
-    "env",
-    ".tox",
-    ".mypy_cache",
-    ".pytest_cache",
-    # We don't want previously generated dummy files to influence counts
-    # when re-running the script.
-    "generated",
-}
+class LiveLanguageStats:
+    """
+    Language statistics kept current from Linux inotify events.
 
+    `start()` scans the tree once and watches its directories.
+    `wait_for_changes()` then collects events, debounced into batches, and
+    re-measures only the files they name, swapping each file's old
+    contribution to `stats` for its new one.
 
-# Map file extensions to a language label. This does not need to be perfect,
-# just close enough to what GitHub Linguist would infer.
-EXTENSION_TO_LANGUAGE: Mapping[str, str] = {
-    ".py": "Python",
-    ".js": "JavaScript",
-    ".jsx": "JavaScript",
-    ".ts": "TypeScript",
-    ".tsx": "TypeScript",
-    ".sh": "Shell",
-    ".bash": "Shell",
-    ".zsh": "Shell",
-    ".yml": "YAML",
-    ".yaml": "YAML",
-    ".json": "JSON",
-    ".md": "Markdown",
-    ".rst": "reStructuredText",
-    ".txt": "Text",
-    ".lock": "Text",
-    ".proto": "Protocol Buffers",
-}
+    Files are selected like gather_language_stats() selects them for the
+    same `backend` and `source_filter`, so both report the same numbers.
+    With the git backend only files tracked in the index count, and only
+    their directories are watched. The index itself is watched too, so
+    `git add`, `git rm` and checkouts update the tracked set. Submodule
+    indexes are read on start and on rescan(), but not watched. Walking
+    counts untracked files too, unless .gitignore'd, and watches every
+    non-excluded directory.
+    """
 
+    def __init__(
+        self,
+        root: Path,
+        jobs: int = 1,
+        backend: str = "auto",
+        source_filter: Optional[SourceFilter] = None,
+    ) -> None:
+        if backend not in SOURCE_BACKENDS:
+            raise ValueError(f"unknown backend {backend!r}; expected one of {SOURCE_BACKENDS}")
+        self.root = root
+        self.jobs = jobs
+        self.source_filter = source_filter
+        self.stats: Dict[str, LanguageStats] = {}
+        # relpath -> (language, lines) as returned by measure_file().
+        self.files: Dict[str, Tuple[Optional[str], int]] = {}
+        # relpath -> the SourceFile measured, for the files in `files`.
+        self._sources: Dict[str, SourceFile] = {}
+        # Files per language including empty ones, so a language disappears
+        # from `stats` exactly when a fresh scan would no longer report it.
+        self._members: Dict[str, int] = defaultdict(int)
+        self._inotify = Inotify()
+        self._watches: Dict[int, str] = {}
+        self._git_dir = find_git_dir(root) if backend != "walk" else None
+        self._use_git = backend == "git" or self._git_dir is not None
+        # Paths the index tracks (git backend only) and the watch on the index.
+        self._tracked: Set[str] = set()
+        self._index_wd: Optional[int] = None
+        self._ignore = GitIgnore(root)
+        self._linguist = LinguistOverrides.for_worktree(root)
 
-@dataclass
-class LanguageStats:
-    language: str
-    lines: int = 0
-    files: int = 0
+    def start(self) -> None:
+        if not self._use_git:
+            self._add_tree("")
+            return
+        if self._git_dir is not None:
+            try:
+                self._index_wd = self._inotify.add_watch(
+                    os.fspath(self._git_dir), IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR
+                )
+            except OSError:
+                self._index_wd = None
+        self._sync_index()
 
-    @property
-    def percentage(self) -> float:
-        # To be set later once we know total lines
-        return 0.0
+    def close(self) -> None:
+        self._inotify.close()
 
+    def rescan(self) -> None:
+        """Start over, e.g. after the kernel's event queue overflowed."""
+        for wd in list(self._watches):
+            self._inotify.rm_watch(wd)
+        if self._index_wd is not None:
+            self._inotify.rm_watch(self._index_wd)
+            self._index_wd = None
+        self._watches.clear()
+        self.files.clear()
+        self._sources.clear()
+        self.stats.clear()
+        self._members.clear()
+        self._tracked = set()
+        self._ignore = GitIgnore(self.root)
+        self._linguist = LinguistOverrides.for_worktree(self.root)
+        self.start()
 
-def detect_language(path: Path) -> str | None:
-    """Return the language name for a given file path, or None if unknown."""
-    return EXTENSION_TO_LANGUAGE.get(path.suffix.lower())
-
-
-def iter_source_files(root: Path) -> Iterable[Path]:
-    """Yield all files under root, excluding certain directories."""
-    for dirpath, dirnames, filenames in os.walk(root):
-        # Prune excluded directories in-place
-        dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIR_NAMES]
-        for name in filenames:
-            path = Path(dirpath) / name
-            # Skip files without a known language
-            if detect_language(path) is None:
+    def wait_for_changes(self, timeout: Optional[float] = None) -> int:
+        """
+        Block until files change (or `timeout` expires) and apply them.
+
+        Returns how many files were re-measured, 0 on timeout.
+        """
+        events = self.collect_events(timeout)
+        return self.apply_events(events) if events else 0
+
+    def collect_events(self, timeout: Optional[float] = None) -> List[InotifyEvent]:
+        """
+        The waiting half of wait_for_changes(): block until events arrive (or
+        `timeout` expires) and return them, debounced into one batch, without
+        touching `stats`.
+        """
+        events = self._inotify.read_events(timeout)
+        if not events:
+            return events
+        deadline = time.monotonic() + WATCH_MAX_DELAY_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            more = self._inotify.read_events(min(WATCH_DEBOUNCE_SECONDS, remaining))
+            if not more:
+                break
+            events.extend(more)
+        return events
+
+    def apply_events(self, events: List[InotifyEvent]) -> int:
+        """Re-measure what `events` touched; returns how many files that was."""
+        touched: Dict[str, None] = {}
+        created_dirs: List[str] = []
+        removed_dirs: List[str] = []
+        index_changed = False
+
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                self.rescan()
+                return len(self.files)
+            if event.wd == self._index_wd and self._index_wd is not None:
+                if event.mask & IN_IGNORED:
+                    self._index_wd = None
+                # git writes index.lock, then renames it over the index.
+                index_changed = index_changed or event.name == "index"
+                continue
+            if event.mask & IN_IGNORED:
+                self._watches.pop(event.wd, None)
                 continue
-            yield path
+            prefix = self._watches.get(event.wd)
+            if prefix is None or not event.name:
+                continue
+            if not event.is_dir:
+                if event.name in (".gitignore", ".gitattributes"):
+                    # Rules changed under us; re-deriving what they now
+                    # include or exclude is not worth it.
+                    self.rescan()
+                    return len(self.files)
+                touched[prefix + event.name] = None
+            elif event.name in EXCLUDE_DIR_NAMES or (
+                not self._use_git and self._ignore.is_ignored(prefix + event.name, is_dir=True)
+            ):
+                continue
+            elif event.mask & (IN_CREATE | IN_MOVED_TO):
+                created_dirs.append(f"{prefix}{event.name}/")
+            elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+                removed_dirs.append(f"{prefix}{event.name}/")
 
+        for dir_prefix in removed_dirs:
+            self._forget_tree(dir_prefix)
+        updated = 0
+        if index_changed:
+            synced = self._sync_index()
+            updated += len(synced)
+            for relpath in synced:
+                touched.pop(relpath, None)
+        if self._use_git:
+            for dir_prefix in created_dirs:
+                # A tracked directory came back, e.g. in a checkout.
+                self._watch_tracked_dirs()
+                touched.update(
+                    (relpath, None) for relpath in self._tracked if relpath.startswith(dir_prefix)
+                )
+        else:
+            updated += sum(self._add_tree(dir_prefix) for dir_prefix in created_dirs)
+        return updated + self._update_files(list(touched))
 
-def count_non_empty_lines(path: Path) -> int:
-    """Count non-empty lines in a text file, forgiving encoding issues."""
-    lines = 0
-    try:
-        with path.open("r", encoding="utf-8", errors="ignore") as f:
-            for line in f:
-                if line.strip():
-                    lines += 1
-    except OSError:
-        # If we can't read a file for some reason, just skip it.
-        return 0
-    return lines
+    def subtree_stats(self, prefix: str) -> Dict[str, LanguageStats]:
+        """Stats of the files under `prefix` ('/'-terminated, "" for all)."""
+        if not prefix:
+            return {lang: replace(s) for lang, s in self.stats.items()}
+        stats: Dict[str, LanguageStats] = {}
+        for relpath, (lang, file_lines) in self.files.items():
+            if lang and relpath.startswith(prefix):
+                _add_file_to_stats(stats, lang, file_lines, self._sources[relpath].size)
+        return stats
 
+    def _set_result(
+        self,
+        relpath: str,
+        result: Optional[Tuple[Optional[str], int]],
+        source: Optional[SourceFile] = None,
+    ) -> None:
+        old = self.files.pop(relpath, None)
+        old_source = self._sources.pop(relpath, None)
+        if old is not None and old[0]:
+            old_size = old_source.size if old_source is not None else 0
+            _remove_file_from_stats(self.stats, old[0], old[1], old_size)
+            self._members[old[0]] -= 1
+            if not self._members[old[0]]:
+                del self.stats[old[0]]
+        if result is not None and source is not None:
+            self.files[relpath] = result
+            self._sources[relpath] = source
+            if result[0]:
+                _add_file_to_stats(self.stats, result[0], result[1], source.size)
+                self._members[result[0]] += 1
 
-def gather_language_stats(root: Path) -> Dict[str, LanguageStats]:
-    """Scan the repository and return a mapping of language -> stats."""
-    stats: Dict[str, LanguageStats] = {}
+    def _measure(self, sources: List[SourceFile]) -> None:
+        """Apply `source_filter` to `sources` and measure what it lets through."""
+        counted: List[SourceFile] = []
+        for source in sources:
+            matched = None
+            if self.source_filter is not None:
+                matched = self.source_filter.rule_for(source.relpath, source.size)
+            if matched is None or matched[1] == DECISION_COUNT:
+                counted.append(source)
+            elif matched[1] == DECISION_BYTES:
+                self._set_result(source.relpath, (source.language, 0), source)
+            else:
+                self._set_result(source.relpath, None)
+        for source, result in zip(counted, measure_files(self.root, counted, self.jobs)):
+            self._set_result(source.relpath, result, source)
 
-    for path in iter_source_files(root):
-        lang = detect_language(path)
-        if not lang:
-            continue
-        if lang not in stats:
-            stats[lang] = LanguageStats(language=lang, lines=0, files=0)
-        file_lines = count_non_empty_lines(path)
-        if file_lines == 0:
-            continue
-        stats[lang].lines += file_lines
-        stats[lang].files += 1
+    def _sync_index(self) -> List[str]:
+        """
+        Bring the tracked set up to date with the index: forget files that are
+        no longer tracked and measure those that are new or changed. Returns
+        the relpaths it updated.
+        """
+        entries = list(iter_tracked_files(self.root))
+        self._tracked = {entry.path for entry in entries}
+        self._watch_tracked_dirs()
+        gone = [relpath for relpath in self.files if relpath not in self._tracked]
+        for relpath in gone:
+            self._set_result(relpath, None)
 
-    return stats
+        changed: List[SourceFile] = []
+        current: Set[str] = set()
+        for source in iter_git_entries(self.root, self._linguist, entries=entries):
+            current.add(source.relpath)
+            known = self._sources.get(source.relpath)
+            if known is None or known[1:5] != source[1:5]:
+                changed.append(source)
+        # Tracked, but deleted or no longer countable (e.g. a new override).
+        dropped = [relpath for relpath in self.files if relpath not in current]
+        for relpath in dropped:
+            self._set_result(relpath, None)
+        self._measure(changed)
+        return gone + dropped + [source.relpath for source in changed]
+
+    def _watch_tracked_dirs(self) -> None:
+        """Watch every directory that holds a tracked file, and its parents."""
+        watched = set(self._watches.values())
+        wanted = {""}
+        for relpath in self._tracked:
+            parts = relpath.split("/")[:-1]
+            for depth in range(1, len(parts) + 1):
+                wanted.add("/".join(parts[:depth]) + "/")
+        root_str = os.fspath(self.root)
+        for prefix in sorted(wanted - watched):
+            if _is_excluded(prefix):
+                continue
+            try:
+                wd = self._inotify.add_watch(
+                    os.path.join(root_str, prefix) if prefix else root_str, WATCH_MASK
+                )
+            except OSError:
+                continue
+            self._watches[wd] = prefix
+
+    def _add_tree(self, prefix: str) -> int:
+        """Watch the directories under `prefix` and measure their files."""
+        top = self.root / prefix if prefix else self.root
+        for dirpath, dirnames, _filenames in os.walk(top):
+            rel = os.path.relpath(dirpath, self.root)
+            rel = "" if rel == "." else rel.replace(os.sep, "/") + "/"
+            rules = self._ignore.rules_for(rel)
+            dirnames[:] = [
+                d for d in dirnames
+                if d not in EXCLUDE_DIR_NAMES and not is_ignored(rules, rel + d, True)
+            ]
+            try:
+                wd = self._inotify.add_watch(dirpath, WATCH_MASK)
+            except OSError:
+                continue
+            self._watches[wd] = rel
+
+        # Watches go in first so nothing that changes during the scan is lost.
+        sources = list(
+            iter_walked_entries(self.root, self._ignore, start=prefix, linguist=self._linguist)
+        )
+        self._measure(sources)
+        return len(sources)
+
+    def _forget_tree(self, prefix: str) -> None:
+        for relpath in [p for p in self.files if p.startswith(prefix)]:
+            self._set_result(relpath, None)
+        for wd, watched in list(self._watches.items()):
+            if watched.startswith(prefix):
+                self._inotify.rm_watch(wd)
+                del self._watches[wd]
+
+    def _update_files(self, relpaths: List[str]) -> int:
+        sources: List[SourceFile] = []
+        root_str = os.fspath(self.root)
+        for relpath in relpaths:
+            name = relpath.rpartition("/")[2]
+            lang = language_for_name(name)
+            excluded = False
+            if self._linguist is not None:
+                excluded, lang = self._linguist.classify(relpath, lang)
+            if self._use_git:
+                excluded = excluded or relpath not in self._tracked or _is_excluded(relpath)
+            else:
+                excluded = excluded or self._ignore.is_ignored(relpath)
+            try:
+                st = os.stat(os.path.join(root_str, relpath))
+            except OSError:
+                st = None
+            if (
+                excluded
+                or st is None
+                or not stat.S_ISREG(st.st_mode)
+                or not is_scan_candidate(name, lang)
+            ):
+                # Deleted, replaced by something else, or never countable.
+                self._set_result(relpath, None)
+                continue
+            sources.append(SourceFile(relpath, lang, st.st_size, st.st_mtime_ns, st.st_ino))
+        self._measure(sources)
+        return len(relpaths)
 
 
-def choose_dummy_extension_per_language() -> Dict[str, str]:
+def watch_language_stats(
+    root: Path,
+    jobs: int = 1,
+    backend: str = "auto",
+    source_filter: Optional[SourceFilter] = None,
+) -> None:
+    """Print the language summary, then reprint it whenever files change."""
+    live = LiveLanguageStats(root, jobs=jobs, backend=backend, source_filter=source_filter)
+    try:
+        live.start()
+        print_summary(live.stats)
+        print("\nWatching for changes (Ctrl-C to stop)...")
+        while True:
+            changed = live.wait_for_changes()
+            if changed:
+                print(f"\n{changed} file(s) changed:")
+                print_summary(live.stats)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        live.close()
+
+
+def choose_dummy_extension_per_language(
+    extensions: Mapping[str, str] = EXTENSION_TO_LANGUAGE,
+) -> Dict[str, str]:
     """
     For each language, choose a representative extension to use for dummy files.
 
     If multiple extensions map to the same language, we pick the first one
-    encountered in EXTENSION_TO_LANGUAGE.
+    encountered in `extensions`.
     """
     mapping: Dict[str, str] = {}
-    for ext, lang in EXTENSION_TO_LANGUAGE.items():
+    for ext, lang in extensions.items():
         mapping.setdefault(lang, ext)
     return mapping
 
@@ -168,6 +2476,8 @@ def comment_prefix_for_extension(ext: str) -> str:
         ".rst",
         ".txt",
         ".proto",
+        ".mk",
+        ".dockerfile",
     }
     if ext in hash_comment_exts:
         return "#"
@@ -175,28 +2485,84 @@ def comment_prefix_for_extension(ext: str) -> str:
     return "//"
 
 
-def generate_random_words(n: int) -> str:
+def generate_random_words(n: int, rng: Optional[random.Random] = None) -> str:
     """Generate a simple string of n lowercase random 'words'."""
+    source = rng if rng is not None else random
     words: List[str] = []
     for _ in range(n):
-        length = random.randint(3, 8)
-        word = "".join(random.choices(string.ascii_lowercase, k=length))
+        length = source.randint(3, 8)
+        word = "".join(source.choices(string.ascii_lowercase, k=length))
         words.append(word)
     return " ".join(words)
 
 
+class DummyLineGenerator:
+    """
+    Bulk generator of random dummy comment lines for one language.
+
+    Each line is a random head ("<prefix> <lang> dummy line: " plus 1-4
+    words) followed by a random tail (2-4 words), so lines keep the 3-8 random
+    words they always had. Both pools are built once; after that a whole chunk
+    of lines costs one getrandbits() call and a C-level join, instead of
+    several RNG calls and string joins per line. Output depends only on the
+    RNG state, so a fixed seed gives identical files run to run.
+    """
+
+    def __init__(self, rng: random.Random, comment_prefix: str, lang: str) -> None:
+        self._rng = rng
+        lead = f"{comment_prefix} {lang} dummy line: "
+        self._heads = [
+            f"{lead}{generate_random_words(rng.randint(1, 4), rng)} ".encode("utf-8")
+            for _ in range(DUMMY_POOL_SIZE)
+        ]
+        self._tails = [
+            f"{generate_random_words(rng.randint(2, 4), rng)}\n".encode("utf-8")
+            for _ in range(DUMMY_POOL_SIZE)
+        ]
+
+    def chunks(self, num_lines: int) -> Iterator[bytes]:
+        """Yield `num_lines` lines as a few large bytes chunks."""
+        while num_lines > 0:
+            n = min(num_lines, DUMMY_CHUNK_LINES)
+            picks = self._rng.getrandbits(16 * n).to_bytes(2 * n, "little")
+            heads = map(self._heads.__getitem__, picks[0::2])
+            tails = map(self._tails.__getitem__, picks[1::2])
+            yield b"".join(chain.from_iterable(zip(heads, tails)))
+            num_lines -= n
+
+    def sized_chunks(self, num_bytes: int) -> Iterator[bytes]:
+        """
+        Yield whole lines totalling at most `num_bytes`, and less only by
+        the part of a line that would not fit.
+        """
+        line_bytes = (sum(map(len, self._heads)) + sum(map(len, self._tails))) / DUMMY_POOL_SIZE
+        while num_bytes > 0:
+            # Aim slightly past the end so the last chunk is usually the one cut.
+            n = min(DUMMY_CHUNK_LINES, int(num_bytes / line_bytes) + 1)
+            chunk = next(self.chunks(n))
+            if len(chunk) > num_bytes:
+                yield chunk[:chunk.rfind(b"\n", 0, num_bytes) + 1]
+                return
+            yield chunk
+            num_bytes -= len(chunk)
+
+
 def allocate_dummy_lines_per_language(
     stats: Mapping[str, LanguageStats],
     total_dummy_lines: int,
+    metric: str = "lines",
 ) -> Dict[str, int]:
     """
     Decide how many dummy lines to create per language.
 
     We allocate lines proportional to the existing line counts so that,
     when the dummy files are added, the overall language distribution
-    remains (approximately) the same.
+    remains (approximately) the same. With `metric="bytes"` the allocation is
+    in bytes, proportional to the existing byte counts.
     """
-    line_counts = {lang: s.lines for lang, s in stats.items() if s.lines > 0}
+    line_counts = {
+        lang: getattr(s, metric) for lang, s in stats.items() if getattr(s, metric) > 0
+    }
     total_lines = sum(line_counts.values())
     if total_lines == 0 or total_dummy_lines <= 0:
         return {lang: 0 for lang in stats.keys()}
@@ -236,93 +2602,987 @@ def allocate_dummy_lines_per_language(
     return int_allocations
 
 
+@dataclass
+class SolvedAllocation:
+    """Result of solve_minimal_allocation()."""
+
+    # Dummy lines (or bytes) per language, 0 or at least a file header each.
+    amounts: Dict[str, int]
+    # Largest deviation of any language's share from its target, as a
+    # fraction (0.01 = one percentage point), once the dummy files are added.
+    error: float
+    # Lines (or bytes) in the repository plus the dummy ones.
+    total: int
+
+    @property
+    def dummy_total(self) -> int:
+        return sum(self.amounts.values())
+
+
+def _allocation_for_total(
+    counts: Mapping[str, int],
+    shares: Mapping[str, float],
+    tolerance: float,
+    total: int,
+    minimum: Mapping[str, int],
+) -> Optional[Dict[str, int]]:
+    """
+    Dummy lines per language that make the repository exactly `total` lines
+    with every share within `tolerance` of its target, or None if there are
+    none. A language gets either no dummy lines or at least its `minimum`.
+    """
+    low: Dict[str, int] = {}
+    high: Dict[str, int] = {}
+    for lang, count in counts.items():
+        # The epsilons keep float noise from moving a bound across an integer.
+        lo = max(0, math.ceil((shares[lang] - tolerance) * total - 1e-9) - count)
+        hi = math.floor((shares[lang] + tolerance) * total + 1e-9) - count
+        if hi < lo:
+            return None
+        if 0 < lo < minimum[lang]:
+            lo = minimum[lang]
+        elif lo == 0 and hi < minimum[lang]:
+            # Too little room for even a header: this language gets nothing.
+            hi = 0
+        if hi < lo:
+            return None
+        low[lang], high[lang] = lo, hi
+
+    extra = total - sum(counts.values()) - sum(low.values())
+    if extra < 0:
+        return None
+
+    # Hand out the rest to the languages furthest below their target share.
+    lines = dict(low)
+    behind = sorted(
+        counts,
+        key=lambda lang: shares[lang] * total - counts[lang] - low[lang],
+        reverse=True,
+    )
+    for lang in behind:
+        if extra == 0:
+            break
+        give = min(extra, high[lang] - lines[lang])
+        if lines[lang] == 0 and give < minimum[lang]:
+            continue
+        lines[lang] += give
+        extra -= give
+    return lines if extra == 0 else None
+
+
+def _fits_unrounded(
+    counts: Mapping[str, int],
+    shares: Mapping[str, float],
+    tolerance: float,
+    total: int,
+) -> bool:
+    """
+    Whether `total` would work if dummy lines could be fractional. Unlike
+    _allocation_for_total() this is monotone in `total`, and it is necessary
+    for it: no smaller total can work.
+    """
+    needed = 0.0
+    for lang, count in counts.items():
+        if count > (shares[lang] + tolerance) * total + 1e-9:
+            return False
+        needed += max(0.0, (shares[lang] - tolerance) * total - count)
+    return needed <= total - sum(counts.values()) + 1e-9
+
+
+def solve_minimal_allocation(
+    stats: Mapping[str, LanguageStats],
+    target: Mapping[str, float],
+    tolerance: float,
+    metric: str = "lines",
+) -> SolvedAllocation:
+    """
+    Find the fewest dummy lines that bring the repository within `tolerance`
+    of a `target` distribution (bytes instead of lines with `metric="bytes"`).
+
+    `target` maps languages to weights (normalized to shares summing to 1);
+    languages in `stats` without a weight have a target share of 0, and
+    languages only in `target` start from 0 lines. `tolerance` is the largest
+    allowed deviation of any share, as a fraction (0.01 = one percentage
+    point).
+
+    Dummy lines can only add to a language, so the question is the smallest
+    repository total T at which every language fits: each one then needs
+    between ceil((share - tolerance) * T) and floor((share + tolerance) * T)
+    lines, and the dummy lines must add up to T minus the existing lines.
+    Rounding and the minimum size of a dummy file make that test non-monotone
+    in T, so the smallest T passing its unrounded (monotone) version is found
+    by doubling and bisection, and T is then stepped up from there to the
+    first total that works with whole lines.
+    """
+    if tolerance <= 0:
+        raise ValueError("tolerance must be positive")
+    weight = sum(target.values())
+    if weight <= 0 or any(value < 0 for value in target.values()):
+        raise ValueError("target weights must be non-negative and not all zero")
+
+    counts = {lang: getattr(s, metric) for lang, s in stats.items()}
+    for lang in target:
+        counts.setdefault(lang, 0)
+    shares = {lang: target.get(lang, 0.0) / weight for lang in counts}
+    minimum = {lang: dummy_file_minimum(lang, metric) for lang in counts}
+    existing = sum(counts.values())
+
+    def fits(total: int) -> bool:
+        return _fits_unrounded(counts, shares, tolerance, total)
+
+    # An empty repository trivially "fits" at 0 lines; search from 1 up.
+    total = max(existing, 1)
+    if not fits(total):
+        low, high = total, 2 * total
+        while not fits(high):
+            if high > MAX_SOLVER_TOTAL:
+                raise ValueError("no allocation reaches the target within the tolerance")
+            low, high = high, 2 * high
+        while high - low > 1:
+            middle = (low + high) // 2
+            if fits(middle):
+                high = middle
+            else:
+                low = middle
+        total = high
+
+    lines = _allocation_for_total(counts, shares, tolerance, total, minimum)
+    while lines is None:
+        if total > MAX_SOLVER_TOTAL:
+            raise ValueError("no allocation reaches the target within the tolerance")
+        total += 1
+        lines = _allocation_for_total(counts, shares, tolerance, total, minimum)
+
+    error = max(
+        (abs((counts[lang] + lines[lang]) / total - shares[lang]) for lang in counts),
+        default=0.0,
+    )
+    return SolvedAllocation(lines, error, total)
+
+
+@dataclass
+class WriteReport:
+    """How many dummy files write_dummy_files() rewrote, left untouched or removed."""
+
+    written: int = 0
+    skipped: int = 0
+    removed: int = 0
+    # Size of all the dummy files, whether rewritten or not.
+    bytes: int = 0
+
+
+def _dummy_file_header(
+    comment_prefix: str,
+    lang: str,
+    total_amount: int,
+    metric: str = "lines",
+) -> bytes:
+    """The DUMMY_HEADER_LINES lines every dummy file starts with."""
+    header_lines = [
+        f"{comment_prefix} File used for language distribution visualization for {lang}.\n",
+        f"{comment_prefix} This repository includes multiple languages; this file\n",
+        f"{comment_prefix} contributes {lang} lines so that language statistics remain representative.\n",
+        f"{comment_prefix} Total dummy {metric} requested in this file group: {total_amount}\n",
+    ]
+    return "".join(header_lines).encode("utf-8")
+
+
+def dummy_file_minimum(lang: str, metric: str = "lines") -> int:
+    """
+    The smallest amount of `metric` a dummy file for `lang` can have: its
+    header, however large the requested total is.
+    """
+    if metric == "lines":
+        return DUMMY_HEADER_LINES
+    ext = choose_dummy_extension_per_language().get(lang, ".txt")
+    return len(_dummy_file_header(comment_prefix_for_extension(ext), lang, 10**19, metric))
+
+
+def _dummy_file_chunks(
+    rng: random.Random,
+    comment_prefix: str,
+    lang: str,
+    amount: int,
+    total_amount: int,
+    metric: str = "lines",
+) -> Iterator[bytes]:
+    """
+    Yield the full content of one dummy file, header first: `amount` lines,
+    or with `metric="bytes"` at most `amount` bytes (short by less than a
+    line).
+    """
+    header = _dummy_file_header(comment_prefix, lang, total_amount, metric)
+    yield header
+
+    # We keep the content trivial but slightly varied.
+    generator = DummyLineGenerator(rng, comment_prefix, lang)
+    if metric == "bytes":
+        yield from generator.sized_chunks(amount - len(header))
+    else:
+        yield from generator.chunks(amount - DUMMY_HEADER_LINES)
+
+
+def language_slug(lang: str) -> str:
+    """File-name-safe form of a language name ("C++" -> "c"), never empty."""
+    return "".join(c.lower() if c.isalnum() else "_" for c in lang).strip("_") or "unknown"
+
+
+def language_seed(seed: int, slug: str) -> int:
+    """
+    Seed of one language's RNG stream, derived from the global seed and the
+    language slug only, so adding or removing other languages never changes
+    a language's content.
+    """
+    digest = hashlib.blake2b(f"{seed}:{slug}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class DummyFileJob(NamedTuple):
+    """Everything needed to produce one dummy file, picklable for workers."""
+
+    target: str
+    lang: str
+    comment_prefix: str
+    # Lines (or bytes, see `metric`) in this file, and in all of them.
+    amount: int
+    total_amount: int
+    seed: int
+    metric: str = "lines"
+
+    def chunks(self) -> Iterator[bytes]:
+        """The file content; every call yields the same bytes."""
+        return _dummy_file_chunks(
+            random.Random(self.seed),
+            self.comment_prefix,
+            self.lang,
+            self.amount,
+            self.total_amount,
+            self.metric,
+        )
+
+
+def _write_dummy_file(job: DummyFileJob) -> Tuple[bool, int]:
+    """
+    Write one dummy file unless it already has the right content; return
+    whether it was written and its size. Runs in worker processes in
+    parallel mode.
+    """
+    # Hash the would-be content first; regenerating it from the seed is
+    # cheaper than keeping large files in memory.
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in job.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    target = Path(job.target)
+    if _file_digest(target, size) == digest.digest():
+        return False, size
+    write_atomically(target, job.chunks())
+    return True, size
+
+
+def _file_digest(path: Path, expected_size: int) -> Optional[bytes]:
+    """SHA-256 of a file, or None if it is missing or not `expected_size` long."""
+    try:
+        with path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size != expected_size:
+                return None
+            digest = hashlib.sha256()
+            for block in iter(lambda: f.read(COUNT_BLOCK_SIZE), b""):
+                digest.update(block)
+            return digest.digest()
+    except OSError:
+        return None
+
+
 def write_dummy_files(
     stats: Mapping[str, LanguageStats],
     total_dummy_lines: int = 2000,
-) -> None:
+    seed: int = 42,
+    target_dir: Optional[Path] = None,
+    lines_per_language: Optional[Mapping[str, int]] = None,
+    jobs: int = 1,
+    metric: str = "lines",
+    extensions: Mapping[str, str] = EXTENSION_TO_LANGUAGE,
+) -> WriteReport:
     """
-    Generate dummy files under language_detection/generated/ for each language.
+    Generate dummy files under `target_dir` (language_detection/generated/ by
+    default) for each language.
 
     Each language gets some number of lines proportional to its current share
-    of the codebase. Lines are simple random comment lines.
-    """
-    if not stats:
-        print("No language statistics found; nothing to generate.")
-        return
+    of the codebase. Lines are simple random comment lines produced by
+    DummyLineGenerator, from an RNG stream of the language's own (see
+    language_seed()): the same `seed` always yields the same files, and a
+    language's content does not depend on which other languages exist.
+
+    Content is hashed while it is generated and compared with the file on
+    disk; a file is only rewritten (atomically) when it would change.
+
+    `lines_per_language` overrides allocate_dummy_lines_per_language() and
+    may name languages that are not in `stats` yet. With `jobs` > 1 and at
+    least PARALLEL_DUMMY_LINES lines in total, files are generated
+    concurrently by a pool of worker processes.
+
+    With `metric="bytes"`, `total_dummy_lines` and `lines_per_language` are
+    byte counts, the allocation follows the byte distribution, and each file
+    is cut to its byte budget at a line boundary.
 
-    GENERATED_DIR.mkdir(parents=True, exist_ok=True)
+    Each file gets the first extension `extensions` maps its language to and
+    is named after the language alone, so its name is as stable as its
+    content. Dummy files in `target_dir` (names with DUMMY_FILE_MARKER) that
+    this call does not produce, e.g. of a language that has disappeared, are
+    removed. Nothing is written (and the report is empty) without any statistics.
+    """
+    report = WriteReport()
+    if not stats and not lines_per_language:
+        return report
 
-    lang_to_ext = choose_dummy_extension_per_language()
-    lang_to_lines = allocate_dummy_lines_per_language(stats, total_dummy_lines)
+    if target_dir is None:
+        target_dir = GENERATED_DIR
+    target_dir.mkdir(parents=True, exist_ok=True)
 
-    random.seed(42)  # Deterministic "random" content for reproducibility
+    lang_to_ext = choose_dummy_extension_per_language(extensions)
+    lang_to_lines = lines_per_language
+    if lang_to_lines is None:
+        lang_to_lines = allocate_dummy_lines_per_language(stats, total_dummy_lines, metric)
 
-    for index, (lang, lang_stats) in enumerate(sorted(stats.items()), start=1):
-        num_lines = lang_to_lines.get(lang, 0)
-        if num_lines <= 0:
+    file_jobs: List[DummyFileJob] = []
+    for lang in sorted(set(stats) | set(lang_to_lines)):
+        amount = lang_to_lines.get(lang, 0)
+        if amount <= 0:
             continue
 
         ext = lang_to_ext.get(lang, ".txt")
-        comment_prefix = comment_prefix_for_extension(ext)
-
-        slug = "".join(
-            c.lower() if c.isalnum() else "_" for c in lang
-        ).strip("_") or "unknown"
-        filename = f"{index:02d}_{slug}_language_representation{ext}"
-        target = GENERATED_DIR / filename
-
-        with target.open("w", encoding="utf-8") as f:
-            header_lines = [
-                f"{comment_prefix} File used for language distribution visualization for {lang}.\n",
-                f"{comment_prefix} This repository includes multiple languages; this file\n",
-                f"{comment_prefix} contributes {lang} lines so that language statistics remain representative.\n",
-                f"{comment_prefix} Total dummy lines requested in this file group: {total_dummy_lines}\n",
-            ]
-            for hl in header_lines:
-                f.write(hl)
+        slug = language_slug(lang)
+        filename = f"{slug}{DUMMY_FILE_MARKER}{ext}"
+        file_jobs.append(
+            DummyFileJob(
+                target=os.fspath(target_dir / filename),
+                lang=lang,
+                comment_prefix=comment_prefix_for_extension(ext),
+                amount=amount,
+                total_amount=total_dummy_lines,
+                seed=language_seed(seed, slug),
+                metric=metric,
+            )
+        )
+
+    total_amount = sum(job.amount for job in file_jobs)
+    parallel_threshold = PARALLEL_DUMMY_LINES if metric == "lines" else PARALLEL_DUMMY_BYTES
+    if jobs <= 1 or len(file_jobs) <= 1 or total_amount < parallel_threshold:
+        results = [_write_dummy_file(job) for job in file_jobs]
+    else:
+        # Largest files first, so a big one doesn't start last and hold up the pool.
+        ordered = sorted(file_jobs, key=lambda job: job.amount, reverse=True)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(jobs, len(ordered))
+        ) as pool:
+            results = list(pool.map(_write_dummy_file, ordered))
+
+    for written, size in results:
+        if written:
+            report.written += 1
+        else:
+            report.skipped += 1
+        report.bytes += size
+
+    produced = {os.path.basename(job.target) for job in file_jobs}
+    for path in target_dir.glob(f"*{DUMMY_FILE_MARKER}.*"):
+        if path.name not in produced and path.is_file():
+            path.unlink()
+            report.removed += 1
+    return report
+
+
+class Scanner:
+    """
+    Scan one tree repeatedly, in-process: the API for long-lived callers.
+
+    The command line's one-shot runs go through gather_language_stats()
+    instead, which also reads archives, records scans in a StatsStore and
+    profiles its phases; both select and measure files the same way.
+
+    Everything a scan depends on is explicit: the directory `root`, the
+    excluded directory names and the language tables (a SourceSelection).
+    Nothing module-level is modified and the working directory is left
+    alone, so scanners for different trees can live in one process.
+
+    State that is expensive to build is kept between calls: the compiled
+    .gitignore and .gitattributes matchers, a ScanCache of per-file results
+    (loaded from and saved to `cache_path` if given, in memory otherwise)
+    and, with `jobs` > 1, the worker pool. A repeated scan() of the same
+    tree therefore only reads the files whose stat data changed. Matchers
+    are compiled once; call reload() after editing .gitignore or
+    .gitattributes files. Use as a context manager or call close().
+
+    `source_filter` and `content_cache` are used as in
+    gather_language_stats(); the filter's report covers the latest scan.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        exclude_dir_names: Iterable[str] = EXCLUDE_DIR_NAMES,
+        extensions: Mapping[str, str] = EXTENSION_TO_LANGUAGE,
+        filenames: Mapping[str, str] = FILENAME_TO_LANGUAGE,
+        backend: str = "auto",
+        jobs: Optional[int] = 1,
+        metric: str = "lines",
+        linguist: bool = True,
+        source_filter: Optional[SourceFilter] = None,
+        content_cache: Optional[ContentCache] = None,
+        cache_path: Optional[Path] = None,
+    ) -> None:
+        if backend not in SOURCE_BACKENDS:
+            raise ValueError(f"unknown backend {backend!r}; expected one of {SOURCE_BACKENDS}")
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric!r}; expected one of {METRICS}")
+        self.root = root
+        self.selection = SourceSelection(frozenset(exclude_dir_names), extensions, filenames)
+        self.use_git = backend == "git" or (backend == "auto" and find_git_dir(root) is not None)
+        self.jobs = default_jobs() if jobs is None else jobs
+        self.metric = metric
+        self.linguist = linguist
+        self.source_filter = source_filter
+        self.content_cache = content_cache
+        self.cache_path = cache_path
+        if cache_path is not None:
+            self.cache = ScanCache.load(cache_path, root)
+        else:
+            self.cache = ScanCache(root=os.fspath(root))
+        # Stats of the latest scan(), None before the first.
+        self.stats: Optional[Dict[str, LanguageStats]] = None
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.reload()
+
+    def reload(self) -> None:
+        """Recompile the .gitignore and .gitattributes matchers."""
+        self._ignore = None if self.use_git else GitIgnore(self.root)
+        self._linguist = LinguistOverrides.for_worktree(self.root) if self.linguist else None
+
+    def close(self) -> None:
+        """Stop the worker pool, if one was started."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
 
-            remaining = max(0, num_lines - len(header_lines))
-            for _ in range(remaining):
-                # We keep the content trivial but slightly varied.
-                word_count = random.randint(3, 8)
-                words = generate_random_words(word_count)
-                line = f"{comment_prefix} {lang} dummy line: {words}\n"
-                f.write(line)
+    def __enter__(self) -> "Scanner":
+        return self
 
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
 
-def print_summary(stats: Mapping[str, LanguageStats]) -> None:
-    """Pretty-print a summary of language statistics."""
+    def sources(self) -> Iterator[SourceFile]:
+        """Enumerate the files a scan would measure."""
+        if self.use_git:
+            return iter_git_entries(self.root, self._linguist, self.selection)
+        return iter_walked_entries(
+            self.root, self._ignore, linguist=self._linguist, selection=self.selection
+        )
+
+    def _measure(
+        self, root: Path, sources: List[SourceFile], jobs: int
+    ) -> List[Tuple[Optional[str], int]]:
+        if jobs > 1 and len(sources) > PARALLEL_BATCH_SIZE and self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        return measure_files(root, sources, jobs, self.content_cache, self._pool)
+
+    def scan(self) -> Dict[str, LanguageStats]:
+        """Scan the tree and return (and keep, as `stats`) language -> stats."""
+        started_ns = time.time_ns()
+        sources = list(self.sources())
+        bytes_only: List[SourceFile] = []
+        if self.source_filter is not None:
+            self.source_filter.report.clear()
+            sources, bytes_only = _prefilter_sources(self.source_filter, sources)
+
+        if self.metric == "bytes":
+            self.stats = _sized_stats(chain(sources, bytes_only))
+            return self.stats
+
+        results = _measure_files_cached(self.root, sources, self.cache, self.jobs, self._measure)
+        self.cache.prune(source.relpath for source in sources)
+        self.cache.scanned_at_ns = started_ns
+        if self.cache_path is not None:
+            self.cache.save(self.cache_path)
+        self.stats = _measured_stats(sources, results, bytes_only)
+        return self.stats
+
+    def _allocation(
+        self,
+        total: Optional[int],
+        target: Optional[Mapping[str, float]],
+        tolerance: float,
+    ) -> Tuple[int, Dict[str, int]]:
+        stats = self.stats if self.stats is not None else self.scan()
+        if target is not None:
+            solved = solve_minimal_allocation(stats, target, tolerance, self.metric)
+            return solved.dummy_total, solved.amounts
+        if total is None:
+            total = DEFAULT_DUMMY_AMOUNT[self.metric]
+        return total, allocate_dummy_lines_per_language(stats, total, self.metric)
+
+    def allocate(
+        self,
+        total: Optional[int] = None,
+        target: Optional[Mapping[str, float]] = None,
+        tolerance: float = 0.01,
+    ) -> Dict[str, int]:
+        """
+        Dummy lines (or bytes) per language for the latest scan (scanning
+        first if there was none): `total` spread like the current
+        distribution (DEFAULT_DUMMY_AMOUNT by default), or the fewest that
+        bring it within `tolerance` (a fraction) of a `target` distribution.
+        """
+        return self._allocation(total, target, tolerance)[1]
+
+    def generate(
+        self,
+        target_dir: Path,
+        total: Optional[int] = None,
+        target: Optional[Mapping[str, float]] = None,
+        tolerance: float = 0.01,
+        seed: int = 42,
+    ) -> WriteReport:
+        """Write the dummy files allocate() describes under `target_dir`."""
+        amount, amounts = self._allocation(total, target, tolerance)
+        return write_dummy_files(
+            self.stats or {},
+            total_dummy_lines=amount,
+            seed=seed,
+            target_dir=target_dir,
+            lines_per_language=amounts,
+            jobs=self.jobs,
+            metric=self.metric,
+            extensions=self.selection.extensions,
+        )
+
+
+def print_summary(stats: Mapping[str, LanguageStats], metric: str = "lines") -> None:
+    """Pretty-print a summary of language statistics, ranked by `metric`."""
     if not stats:
         print("No languages detected.")
         return
 
-    total_lines = sum(s.lines for s in stats.values())
+    total = sum(getattr(s, metric) for s in stats.values())
+
+    unit = "non-empty line" if metric == "lines" else "bytes"
+    print(f"Language statistics (by {unit}):")
+    print("-" * 60)
+    print(f"{'Language':20} {metric.capitalize():>10} {'Files':>10} {'Percent':>10}")
+    print("-" * 60)
+    ranked = sorted(stats.items(), key=lambda item: getattr(item[1], metric), reverse=True)
+    for lang, s in ranked:
+        amount = getattr(s, metric)
+        percent = (amount / total * 100.0) if total else 0.0
+        print(f"{lang:20} {amount:10d} {s.files:10d} {percent:9.2f}%")
+    print("-" * 60)
+    print(f"{'TOTAL':20} {total:10d}")
+
+
+def print_estimates(approx: ApproximateStats) -> None:
+    """Pretty-print estimate_language_stats() results with their margins."""
+    print(
+        f"Estimated language statistics (by non-empty line, "
+        f"{approx.confidence * 100:g}% confidence):"
+    )
+    print("-" * 72)
+    print(f"{'Language':20} {'Lines':>12} {'+/-':>10} {'Percent':>10} {'+/-':>10}")
+    print("-" * 72)
+    ranked = sorted(approx.estimates.values(), key=lambda e: e.lines, reverse=True)
+    for e in ranked:
+        print(
+            f"{e.language:20} {e.lines:12.0f} {e.lines_margin:10.0f} "
+            f"{e.percentage:9.2f}% {e.percentage_margin:9.2f}%"
+        )
+    print("-" * 72)
+    print(
+        f"Sampled {approx.files_sampled} of {approx.files_total} files "
+        f"({approx.bytes_read} of {approx.bytes_total} bytes read) in {approx.rounds} round(s)."
+    )
+
+
+def print_filter_report(source_filter: SourceFilter) -> None:
+    """Print what each pre-filter rule kept from being counted."""
+    if not source_filter.report:
+        return
+    print("Filtered before reading:")
+    for name, tally in sorted(
+        source_filter.report.items(), key=lambda item: item[1].bytes, reverse=True
+    ):
+        print(f"  {name:18} {tally.files:8d} files {tally.bytes:14d} bytes")
+
 
-    print("Language statistics (by non-empty line):")
+def print_profile(profiler: PhaseProfiler) -> None:
+    """Pretty-print the per-phase resource usage of a profiled run."""
+    print("Profile (per phase):")
     print("-" * 60)
-    print(f"{'Language':20} {'Lines':>10} {'Files':>10} {'Percent':>10}")
+    print(f"{'Phase':20} {'Wall s':>10} {'CPU s':>10} {'Peak MiB':>10}")
     print("-" * 60)
-    for lang, s in sorted(stats.items(), key=lambda item: item[1].lines, reverse=True):
-        percent = (s.lines / total_lines * 100.0) if total_lines else 0.0
-        print(f"{lang:20} {s.lines:10d} {s.files:10d} {percent:9.2f}%")
+    for p in profiler.phases:
+        print(
+            f"{p.name:20} {p.wall_seconds:10.3f} {p.cpu_seconds:10.3f} "
+            f"{p.peak_bytes / (1 << 20):10.1f}"
+        )
     print("-" * 60)
-    print(f"{'TOTAL':20} {total_lines:10d}")
+    total_wall = sum(p.wall_seconds for p in profiler.phases)
+    total_cpu = sum(p.cpu_seconds for p in profiler.phases)
+    print(f"{'TOTAL':20} {total_wall:10.3f} {total_cpu:10.3f}")
+
+
+def parse_target_distribution(spec: str) -> Dict[str, float]:
+    """
+    Parse a `--target` value like "Python=60,TypeScript=30,Shell=10" into
+    language weights; languages must be ones the scanner knows.
+    """
+    known = set(EXTENSION_TO_LANGUAGE.values()) | set(FILENAME_TO_LANGUAGE.values())
+    target: Dict[str, float] = {}
+    for item in spec.split(","):
+        lang, sep, value = item.rpartition("=")
+        lang = lang.strip()
+        try:
+            weight = float(value)
+        except ValueError:
+            weight = -1.0
+        if not sep or weight < 0 or not math.isfinite(weight):
+            raise argparse.ArgumentTypeError(f"expected LANGUAGE=WEIGHT, got {item!r}")
+        if lang not in known:
+            raise argparse.ArgumentTypeError(f"unknown language {lang!r}")
+        target[lang] = weight
+    if not sum(target.values()) > 0:
+        raise argparse.ArgumentTypeError("target weights are all zero")
+    return target
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compute language statistics and generate representative dummy files.",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="Number of worker processes used to count files "
+        "(default: derived from the container CPU quota).",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=SOURCE_BACKENDS,
+        default="auto",
+        help="How to enumerate files: from the git index, by walking the tree, "
+        "or 'auto' (git index when available).",
+    )
+    parser.add_argument(
+        "--metric",
+        choices=METRICS,
+        default="lines",
+        help="Measure languages by non-empty lines (reads every file) or by "
+        "bytes, GitHub's metric (from stat data only); dummy files are "
+        "allocated in the same unit.",
+    )
+    parser.add_argument(
+        "--max-file-size",
+        type=int,
+        default=DEFAULT_MAX_FILE_BYTES,
+        metavar="BYTES",
+        help="Count larger files by their bytes only, without reading them; "
+        f"0 disables the cap (default: {DEFAULT_MAX_FILE_BYTES}).",
+    )
+    parser.add_argument(
+        "--no-filter",
+        action="store_true",
+        help="Count vendored code, build output, minified bundles, lockfiles "
+        "and oversized files like any other file.",
+    )
+    parser.add_argument(
+        "--source",
+        type=Path,
+        metavar="PATH",
+        help="Directory or .tar/.tar.gz/.zip archive to scan instead of the "
+        "repository; archives are streamed, not extracted. Its statistics are "
+        "only printed: no dummy files are generated unless --target-dir is given.",
+    )
+    parser.add_argument(
+        "--target-dir",
+        type=Path,
+        metavar="DIR",
+        help=f"Where to write the dummy files (default: {GENERATED_DIR}, and only "
+        "when the repository itself is scanned).",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep the statistics live: scan once, then re-count changed files "
+        "(and follow the git index) as inotify reports them. Linux only.",
+    )
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        help=f"Incremental scan cache file (default: {SCAN_CACHE_PATH} when the "
+        "repository itself is scanned, none for another --source).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-read every file instead of using the incremental scan cache.",
+    )
+    parser.add_argument(
+        "--content-cache",
+        type=Path,
+        default=default_cache_path(),
+        metavar="PATH",
+        help="Line counts keyed by file content, shared by all checkouts and "
+        f"worktrees (default: {default_cache_path()}).",
+    )
+    parser.add_argument(
+        "--no-content-cache",
+        dest="content_cache",
+        action="store_const",
+        const=None,
+        help="Count every file the scan cache misses, even if the same "
+        "content was counted before.",
+    )
+    parser.add_argument(
+        "--target",
+        type=parse_target_distribution,
+        metavar="LANG=WEIGHT,...",
+        help="Instead of spreading a fixed number of dummy lines, add the "
+        "fewest lines that bring the repository within --tolerance of this "
+        "distribution (weights are normalized; unlisted languages target 0).",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.0,
+        metavar="PERCENT",
+        help="Allowed deviation per language for --target, in percentage "
+        "points (default: 1.0).",
+    )
+    parser.add_argument(
+        "--approximate",
+        type=float,
+        metavar="POINTS",
+        help="Only print estimated statistics from a sample of the files, "
+        "growing the sample until every percentage's 95%% confidence "
+        "interval is within +/-POINTS.",
+    )
+    parser.add_argument(
+        "--sample-fraction",
+        type=float,
+        default=0.01,
+        metavar="F",
+        help="Fraction of the files of each language and size class sampled "
+        "in the first round of --approximate (default: 0.01).",
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        metavar="N",
+        help="Instead of scanning the working tree, print the statistics of "
+        "the last N first-parent commits of HEAD as CSV, read straight from "
+        "the git object store (a shallow clone stops at its depth).",
+    )
+    parser.add_argument(
+        "--db",
+        type=Path,
+        nargs="?",
+        const=SCAN_DB_PATH,
+        metavar="PATH",
+        help="Also record per-file results in a SQLite database "
+        f"(default: {SCAN_DB_PATH}); query it with stats_store.py.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Report wall time, CPU time and tracemalloc peak per phase "
+        "(enumerate, detect, count, [store,] summarize, allocate, generate). Files are "
+        "sniffed and counted in separate passes, and tracemalloc slows the "
+        "run down, so absolute timings are higher than an unprofiled run's.",
+    )
+    parser.add_argument(
+        "--profile-dump",
+        type=Path,
+        metavar="FILE",
+        help="With --profile, also write cProfile stats of the slowest phase "
+        "to FILE (read it with pstats or snakeviz).",
+    )
+    args = parser.parse_args(argv)
+    if args.profile_dump is not None:
+        args.profile = True
+    if args.profile and args.watch:
+        parser.error("--profile cannot be combined with --watch")
+    if args.metric == "bytes" and (args.watch or args.db is not None):
+        parser.error("--metric bytes cannot be combined with --watch or --db")
+    if args.approximate is not None:
+        if args.approximate < 0 or not 0 < args.sample_fraction <= 1:
+            parser.error("--approximate needs POINTS >= 0 and 0 < --sample-fraction <= 1")
+        if args.watch or args.metric == "bytes":
+            parser.error("--approximate cannot be combined with --watch or --metric bytes")
+        if args.source is not None and is_archive(args.source):
+            parser.error("--approximate needs a directory, not an archive")
+    if args.tolerance <= 0:
+        parser.error("--tolerance must be positive")
+    if args.source is not None and is_archive(args.source):
+        if args.watch or args.history is not None:
+            parser.error("--watch and --history need a directory, not an archive")
+    return args
 
 
-def main() -> None:
-    # Ensure the working directory is the repo root (one level above this script),
-    # so any relative paths behave as if the script was run from the root.
-    os.chdir(REPO_ROOT)
+def _generate(
+    args: argparse.Namespace,
+    stats: Dict[str, LanguageStats],
+    target_dir: Path,
+    profiler: Optional[PhaseProfiler],
+) -> None:
+    """Allocate and write the dummy files the command line asked for."""
+    unit = args.metric
+    if args.target is not None:
+        with _phase(profiler, "allocate"):
+            solved = solve_minimal_allocation(
+                stats, args.target, args.tolerance / 100, args.metric
+            )
+        total_dummy_lines = solved.dummy_total
+        lines_per_language = solved.amounts
+        print(
+            f"\nGenerating {total_dummy_lines} dummy {unit} to reach the target "
+            f"distribution (largest deviation {solved.error * 100:.2f} points)..."
+        )
+    else:
+        # You can tune this if you want more/less synthetic content.
+        total_dummy_lines = DEFAULT_DUMMY_AMOUNT[args.metric]
+        print(f"\nGenerating approximately {total_dummy_lines} dummy {unit} across languages...")
+        with _phase(profiler, "allocate"):
+            lines_per_language = allocate_dummy_lines_per_language(
+                stats, total_dummy_lines, args.metric
+            )
+    if not stats and not lines_per_language:
+        print("No language statistics found; nothing to generate.")
+        return
+    with _phase(profiler, "generate"):
+        report = write_dummy_files(
+            stats,
+            total_dummy_lines=total_dummy_lines,
+            lines_per_language=lines_per_language,
+            jobs=args.jobs or default_jobs(),
+            metric=args.metric,
+            target_dir=target_dir,
+        )
+    print(
+        f"Dummy files under {target_dir}: "
+        f"{report.written} written, {report.skipped} unchanged, {report.removed} removed, "
+        f"{report.bytes} bytes"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # --source and --target-dir are relative to where we were started; the
+    # other paths are relative to the repo root, wherever the script is run from.
+    source = args.source.resolve() if args.source is not None else REPO_ROOT
+    if args.target_dir is not None:
+        args.target_dir = args.target_dir.resolve()
+    for name in ("cache", "content_cache", "db", "profile_dump"):
+        path = getattr(args, name)
+        if path is not None:
+            setattr(args, name, REPO_ROOT / path)
+    if args.no_cache:
+        args.cache = None
+    elif args.cache is None and source == REPO_ROOT:
+        # Another tree's entries would evict this repository's.
+        args.cache = SCAN_CACHE_PATH
+
+    if args.history is not None:
+        write_history_csv(iter_language_history(source, max_commits=args.history))
+        return
+
+    source_filter = None
+    if not args.no_filter:
+        source_filter = SourceFilter(max_file_bytes=args.max_file_size)
+
+    if args.approximate is not None:
+        print(f"Sampling repository under: {source}")
+        print_estimates(
+            estimate_language_stats(
+                source,
+                error_bound=args.approximate,
+                fraction=args.sample_fraction,
+                backend=args.backend,
+                jobs=args.jobs or default_jobs(),
+                source_filter=source_filter,
+            )
+        )
+        if source_filter is not None:
+            print_filter_report(source_filter)
+        return
+
+    if is_archive(source):
+        print(f"Scanning archive: {source}")
+    else:
+        print(f"Scanning repository under: {source}")
+    if args.watch:
+        watch_language_stats(
+            source,
+            jobs=args.jobs or default_jobs(),
+            backend=args.backend,
+            source_filter=source_filter,
+        )
+        return
+
+    profiler = PhaseProfiler(cprofile=args.profile_dump is not None) if args.profile else None
+
+    store = None
+    if args.db is not None:
+        args.db.parent.mkdir(parents=True, exist_ok=True)
+        store = StatsStore(args.db)
+    content_cache = None
+    if args.content_cache is not None:
+        try:
+            content_cache = ContentCache(args.content_cache)
+        except (OSError, sqlite3.Error) as exc:
+            # The cache is an optimisation; a read-only home must not stop the scan.
+            print(f"Not using content cache {args.content_cache}: {exc}", file=sys.stderr)
+    try:
+        stats = gather_language_stats(
+            source,
+            jobs=args.jobs,
+            cache_path=args.cache,
+            backend=args.backend,
+            profiler=profiler,
+            store=store,
+            content_cache=content_cache,
+            metric=args.metric,
+            source_filter=source_filter,
+        )
+    finally:
+        if store is not None:
+            store.close()
+        if content_cache is not None:
+            content_cache.close()
+    with _phase(profiler, "summarize"):
+        print_summary(stats, args.metric)
+        if source_filter is not None:
+            print_filter_report(source_filter)
 
-    print(f"Scanning repository under: {REPO_ROOT}")
-    stats = gather_language_stats(REPO_ROOT)
-    print_summary(stats)
+    target_dir = args.target_dir
+    if target_dir is None and source == REPO_ROOT:
+        target_dir = GENERATED_DIR
+    if target_dir is not None:
+        _generate(args, stats, target_dir, profiler)
+    else:
+        # Another tree's mix must not overwrite this repository's dummy files.
+        print("\nNot generating dummy files for another tree; pass --target-dir to do so.")
 
-    # You can tune this if you want more/less synthetic content.
-    total_dummy_lines = 2000
-    print(f"\nGenerating approximately {total_dummy_lines} dummy lines across languages...")
-    write_dummy_files(stats, total_dummy_lines=total_dummy_lines)
-    print(f"Dummy files written under: {GENERATED_DIR}")
+    if profiler is not None:
+        print()
+        print_profile(profiler)
+        if args.profile_dump is not None:
+            slowest = profiler.dump_slowest(args.profile_dump)
+            if slowest is not None:
+                print(
+                    f"cProfile stats of the slowest phase ({slowest.name}) "
+                    f"written to {args.profile_dump}"
+                )
 
 
 if __name__ == "__main__":
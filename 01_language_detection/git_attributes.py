@@ -0,0 +1,160 @@
+"""
+Git's attributes files (gitattributes(5)), reduced to what the scanner needs.
+
+An `AttributeMatcher` answers "what value does attribute X have for this
+path?" for a fixed set of attribute names. Every line of every attributes
+file that assigns one of them is compiled, relative to its file's directory,
+into a single regex per attribute, so lookups cost one regex match whatever
+the number of files and lines, and nothing is compiled per path.
+
+Only the files git reads for a worktree's top-level directories are loaded
+(see `for_worktree()`): the root's `.gitattributes`, those at the root of
+each checked-out submodule, and `$GIT_DIR/info/attributes`. Not supported:
+`.gitattributes` files in other subdirectories, `core.attributesFile`, macro
+attributes (`[attr]` lines) and patterns that only match directories.
+"""
+
+from __future__ import annotations
+
+import codecs
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
+
+from git_index import find_git_dir, read_gitmodules
+from git_patterns import translate
+
+# An attribute's state for a path: True (set), False (unset, "-attr"), its
+# value ("attr=value"), or None (unspecified, or reset with "!attr").
+AttributeValue = Union[bool, str, None]
+
+# A C-style quoted pattern at the start of a line, as git writes paths with
+# special characters.
+_QUOTED_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+def _unquote(quoted: str) -> str:
+    """Decode the backslash escapes of a quoted pattern (octal bytes included)."""
+    raw = codecs.escape_decode(quoted.encode("utf-8", errors="surrogateescape"))[0]
+    return raw.decode("utf-8", errors="surrogateescape")
+
+
+def parse_line(line: str) -> Optional[Tuple[str, List[Tuple[str, AttributeValue]]]]:
+    """
+    Split one attributes line into its pattern and (name, value) assignments.
+
+    Returns None for blank lines, comments, macro definitions and lines git
+    itself ignores (negated patterns).
+    """
+    line = line.strip()
+    if not line or line.startswith("#") or line.startswith("[attr]"):
+        return None
+    if line.startswith('"'):
+        m = _QUOTED_PATTERN.match(line)
+        if m is None:
+            return None
+        pattern, rest = _unquote(m.group(1)), line[m.end():]
+    else:
+        pattern, _, rest = line.replace("\t", " ").partition(" ")
+    if not pattern or pattern.startswith("!"):
+        return None
+
+    assignments: List[Tuple[str, AttributeValue]] = []
+    for word in rest.split():
+        if word.startswith("-"):
+            assignments.append((word[1:], False))
+        elif word.startswith("!"):
+            assignments.append((word[1:], None))
+        else:
+            name, sep, value = word.partition("=")
+            assignments.append((name, value if sep else True))
+    return pattern, assignments
+
+
+class AttributeMatcher:
+    """
+    The values of the attributes `names` for any path, see the module docstring.
+
+    `files` are (base, lines) pairs in increasing order of precedence, `base`
+    being the '/'-terminated directory the lines apply to ("" for the root).
+    As in git, the last line that mentions an attribute and matches a path
+    decides its value.
+    """
+
+    def __init__(
+        self,
+        names: Iterable[str],
+        files: Iterable[Tuple[str, Iterable[str]]] = (),
+    ) -> None:
+        self.names = tuple(names)
+        self._values: List[AttributeValue] = []
+        alternatives: Dict[str, List[str]] = {name: [] for name in self.names}
+        for base, lines in files:
+            for line in lines:
+                parsed = parse_line(line)
+                if parsed is None:
+                    continue
+                pattern, assignments = parsed
+                # "dir/" only matches directories, and only files are looked up.
+                if pattern.endswith("/"):
+                    continue
+                regex: Optional[str] = None
+                for name, value in assignments:
+                    if name not in alternatives:
+                        continue
+                    if regex is None:
+                        regex = re.escape(base) + translate(pattern)
+                    alternatives[name].append(f"(?P<v{len(self._values)}>{regex})")
+                    self._values.append(value)
+
+        # Alternatives in reverse, so the first one that matches is the last line.
+        self._regexes: Dict[str, Pattern[str]] = {
+            name: re.compile("(?:" + "|".join(reversed(alts)) + r")\Z", re.DOTALL)
+            for name, alts in alternatives.items()
+            if alts
+        }
+
+    def __bool__(self) -> bool:
+        return bool(self._regexes)
+
+    def value(self, name: str, relpath: str) -> AttributeValue:
+        """The value of attribute `name` for a '/'-separated relpath."""
+        regex = self._regexes.get(name)
+        if regex is None:
+            return None
+        m = regex.match(relpath)
+        if m is None:
+            return None
+        return self._values[int(m.lastgroup[1:])]
+
+    @classmethod
+    def for_worktree(cls, root: Path, names: Iterable[str]) -> "AttributeMatcher":
+        """Load the attributes files of `root` and its submodules (see above)."""
+        files = list(_worktree_attribute_files(root, ""))
+        git_dir = find_git_dir(root)
+        if git_dir is not None:
+            lines = _read_lines(git_dir / "info" / "attributes")
+            if lines:
+                files.append(("", lines))
+        return cls(names, files)
+
+
+def _read_lines(path: Path) -> List[str]:
+    try:
+        return path.read_text(encoding="utf-8", errors="surrogateescape").splitlines()
+    except OSError:
+        return []
+
+
+def _worktree_attribute_files(
+    worktree: Path,
+    prefix: str,
+) -> Iterator[Tuple[str, List[str]]]:
+    """(base, lines) of `worktree`'s .gitattributes, then its submodules'."""
+    lines = _read_lines(worktree / ".gitattributes")
+    if lines:
+        yield prefix, lines
+    for path in sorted(read_gitmodules(worktree)):
+        submodule = worktree / path
+        if find_git_dir(submodule) is not None:
+            yield from _worktree_attribute_files(submodule, f"{prefix}{path}/")
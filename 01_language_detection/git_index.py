@@ -0,0 +1,298 @@
+"""
+Minimal, dependency-free reader for git's index file (`.git/index`).
+
+The language scanner uses it to enumerate tracked files (including those of
+checked-out submodules) without walking the working tree. Only the parts of
+the format needed for that are decoded: the entry table of index versions 2,
+3 and 4. Extensions (cache tree, untracked cache, ...) are ignored.
+
+Format reference: Documentation/gitformat-index.txt in the git sources.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+INDEX_SIGNATURE = b"DIRC"
+
+# Entry header: ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size, then
+# the object name and a 16-bit flags word.
+_ENTRY_STAT = struct.Struct(">10I")
+_FLAGS = struct.Struct(">H")
+
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE_MASK = 0x3000
+FLAG_NAME_MASK = 0x0FFF
+EXTENDED_FLAG_SKIP_WORKTREE = 0x4000
+EXTENDED_FLAG_INTENT_TO_ADD = 0x2000
+
+MODE_TYPE_MASK = 0o170000
+MODE_REGULAR = 0o100000
+MODE_SYMLINK = 0o120000
+MODE_GITLINK = 0o160000
+
+
+class GitIndexError(ValueError):
+    """Raised when an index file cannot be parsed."""
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    """One stage-0 entry of the index, with the stat data git cached for it."""
+
+    path: str
+    mode: int
+    size: int
+    mtime_ns: int
+    ctime_ns: int
+    ino: int
+    sha: bytes
+    # The file was modified no earlier than the index was written, so equal
+    # stat data does not prove the content is unchanged ("racily clean").
+    racy: bool = False
+
+    @property
+    def hexsha(self) -> str:
+        return self.sha.hex()
+
+    @property
+    def is_gitlink(self) -> bool:
+        return self.mode & MODE_TYPE_MASK == MODE_GITLINK
+
+    @property
+    def is_regular(self) -> bool:
+        return self.mode & MODE_TYPE_MASK == MODE_REGULAR
+
+    def stat_matches(self, st: os.stat_result) -> bool:
+        """
+        Whether the working file's stat data `st` still matches the entry, so
+        its content is the indexed blob without re-hashing it. Racily clean
+        entries never match. The index keeps only the low 32 bits of sizes,
+        inodes and seconds, so only those are compared.
+        """
+        if self.racy:
+            return False
+        seconds, nanoseconds = divmod(st.st_mtime_ns, 1_000_000_000)
+        return (
+            self.size == st.st_size & 0xFFFFFFFF
+            and self.mtime_ns == (seconds & 0xFFFFFFFF) * 1_000_000_000 + nanoseconds
+            # Some platforms (and core.checkStat=minimal) record no inode.
+            and (not self.ino or self.ino == st.st_ino & 0xFFFFFFFF)
+        )
+
+
+def find_git_dir(worktree: Path) -> Optional[Path]:
+    """
+    Return the git directory of `worktree`, or None if it is not a checkout.
+
+    Handles both a plain `.git` directory and the `gitdir: <path>` file that
+    submodules and linked worktrees use.
+    """
+    dot_git = worktree / ".git"
+    if dot_git.is_dir():
+        return dot_git
+    try:
+        content = dot_git.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    if not content.startswith("gitdir:"):
+        return None
+    git_dir = Path(content[len("gitdir:"):].strip())
+    if not git_dir.is_absolute():
+        git_dir = worktree / git_dir
+    return git_dir if git_dir.is_dir() else None
+
+
+def common_dir(git_dir: Path) -> Path:
+    """Linked worktrees keep their config in the main repository's git dir."""
+    try:
+        common = (git_dir / "commondir").read_text(encoding="utf-8").strip()
+    except OSError:
+        return git_dir
+    path = Path(common)
+    return path if path.is_absolute() else git_dir / path
+
+
+def object_hash_size(git_dir: Path) -> int:
+    """Return the object name length in bytes (20 for SHA-1, 32 for SHA-256)."""
+    try:
+        config = (common_dir(git_dir) / "config").read_text(encoding="utf-8")
+    except OSError:
+        return 20
+    if re.search(r"^\s*objectformat\s*=\s*sha256\s*$", config, re.IGNORECASE | re.MULTILINE):
+        return 32
+    return 20
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Decode the offset varint used for v4 path prefix compression."""
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        value += 1
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+    return value, pos
+
+
+def parse_index(
+    data: bytes,
+    hash_size: int = 20,
+    index_mtime_ns: Optional[int] = None,
+) -> List[IndexEntry]:
+    """
+    Parse the raw bytes of an index file into its stage-0 entries.
+
+    With the index file's `index_mtime_ns`, entries are flagged `racy` the way
+    git decides it: when their mtime is not older than the index itself.
+    """
+    if len(data) < 12 or data[:4] != INDEX_SIGNATURE:
+        raise GitIndexError("not a git index file")
+    version, count = struct.unpack_from(">II", data, 4)
+    if version not in (2, 3, 4):
+        raise GitIndexError(f"unsupported index version {version}")
+
+    entries: List[IndexEntry] = []
+    pos = 12
+    previous_path = b""
+
+    for _ in range(count):
+        start = pos
+        (
+            ctime_s, ctime_ns, mtime_s, mtime_ns, _dev, ino, mode, _uid, _gid, size,
+        ) = _ENTRY_STAT.unpack_from(data, pos)
+        pos += _ENTRY_STAT.size
+        sha = data[pos:pos + hash_size]
+        pos += hash_size
+        (flags,) = _FLAGS.unpack_from(data, pos)
+        pos += _FLAGS.size
+
+        extended_flags = 0
+        if flags & FLAG_EXTENDED:
+            if version < 3:
+                raise GitIndexError("extended flag set in a version 2 index")
+            (extended_flags,) = _FLAGS.unpack_from(data, pos)
+            pos += _FLAGS.size
+
+        if version == 4:
+            strip, pos = _read_varint(data, pos)
+            end = data.index(b"\0", pos)
+            raw_path = previous_path[:len(previous_path) - strip] + data[pos:end]
+            pos = end + 1
+        else:
+            name_length = flags & FLAG_NAME_MASK
+            if name_length < FLAG_NAME_MASK:
+                end = pos + name_length
+            else:
+                end = data.index(b"\0", pos)
+            raw_path = data[pos:end]
+            # Entries are NUL-padded to a multiple of 8 bytes (1-8 NULs).
+            entry_length = (end - start + 8) & ~7
+            pos = start + entry_length
+        previous_path = raw_path
+
+        if pos > len(data):
+            raise GitIndexError("truncated index entry")
+        if flags & FLAG_STAGE_MASK:
+            # Unmerged entry; stage 0 is absent during a conflict, so keep the
+            # "ours" side (stage 2) as the best guess of what is checked out.
+            if flags & FLAG_STAGE_MASK != 0x2000:
+                continue
+        if extended_flags & (EXTENDED_FLAG_SKIP_WORKTREE | EXTENDED_FLAG_INTENT_TO_ADD):
+            continue
+
+        entry_mtime_ns = mtime_s * 1_000_000_000 + mtime_ns
+        entries.append(
+            IndexEntry(
+                path=raw_path.decode("utf-8", errors="surrogateescape"),
+                mode=mode,
+                size=size,
+                mtime_ns=entry_mtime_ns,
+                ctime_ns=ctime_s * 1_000_000_000 + ctime_ns,
+                ino=ino,
+                sha=sha,
+                racy=index_mtime_ns is not None and entry_mtime_ns >= index_mtime_ns,
+            )
+        )
+    return entries
+
+
+def read_index(git_dir: Path) -> List[IndexEntry]:
+    """Read `<git_dir>/index`. A repository without an index has no entries."""
+    try:
+        with (git_dir / "index").open("rb") as f:
+            index_mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    return parse_index(data, object_hash_size(git_dir), index_mtime_ns)
+
+
+def read_gitmodules(worktree: Path) -> Dict[str, str]:
+    """Return a mapping of submodule path -> submodule name from `.gitmodules`."""
+    try:
+        text = (worktree / ".gitmodules").read_text(encoding="utf-8")
+    except OSError:
+        return {}
+
+    modules: Dict[str, str] = {}
+    name: Optional[str] = None
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        section = re.match(r'\[submodule\s+"(.+)"\]$', line)
+        if section:
+            name = section.group(1)
+            continue
+        if line.startswith("["):
+            name = None
+            continue
+        key, sep, value = line.partition("=")
+        if name is not None and sep and key.strip() == "path":
+            modules[value.strip().strip("/")] = name
+    return modules
+
+
+def iter_tracked_files(
+    worktree: Path,
+    recurse_submodules: bool = True,
+    _prefix: str = "",
+) -> Iterator[IndexEntry]:
+    """
+    Yield the regular files tracked in `worktree`'s index.
+
+    Paths are relative to the outermost worktree. Submodules listed in
+    `.gitmodules` are descended into when they are checked out; symlinks and
+    uninitialised submodules are skipped.
+    """
+    git_dir = find_git_dir(worktree)
+    if git_dir is None:
+        return
+
+    submodules = read_gitmodules(worktree) if recurse_submodules else {}
+    for entry in read_index(git_dir):
+        if entry.is_regular:
+            if _prefix:
+                entry = IndexEntry(
+                    path=_prefix + entry.path,
+                    mode=entry.mode,
+                    size=entry.size,
+                    mtime_ns=entry.mtime_ns,
+                    ctime_ns=entry.ctime_ns,
+                    ino=entry.ino,
+                    sha=entry.sha,
+                    racy=entry.racy,
+                )
+            yield entry
+        elif entry.is_gitlink and entry.path in submodules:
+            yield from iter_tracked_files(
+                worktree / entry.path,
+                recurse_submodules=True,
+                _prefix=f"{_prefix}{entry.path}/",
+            )
@@ -0,0 +1,450 @@
+"""
+Read-only access to a git object database, in pure Python.
+
+Objects are looked up in loose files (`objects/ab/cdef...`), in pack files
+(version 2 `.idx` index, deltified objects of either kind) and in alternates.
+That is enough to walk commits and trees and read blobs without checking
+anything out, which is what the scanner's history mode needs.
+
+Format reference: Documentation/gitformat-pack.txt in the git sources.
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import FrozenSet, Iterator, List, Optional, Tuple
+
+from git_index import common_dir, object_hash_size
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {b"commit": OBJ_COMMIT, b"tree": OBJ_TREE, b"blob": OBJ_BLOB, b"tag": OBJ_TAG}
+
+IDX_SIGNATURE = b"\377tOc"
+
+# Bytes of delta bases kept decompressed; history walks resolve the same
+# chains over and over, so this saves most of the inflate and patch work.
+DELTA_BASE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Compressed bytes handed to zlib at a time when inflating a packed object.
+_INFLATE_CHUNK = 64 * 1024
+
+MODE_TREE = 0o040000
+MODE_GITLINK = 0o160000
+MODE_SYMLINK = 0o120000
+
+
+class GitObjectError(ValueError):
+    """Raised for missing or malformed objects."""
+
+
+@dataclass(frozen=True)
+class TreeEntry:
+    mode: int
+    name: str
+    sha: bytes
+
+    @property
+    def is_tree(self) -> bool:
+        return self.mode == MODE_TREE
+
+    @property
+    def is_blob(self) -> bool:
+        return self.mode & 0o170000 == 0o100000
+
+
+@dataclass(frozen=True)
+class Commit:
+    sha: bytes
+    tree: bytes
+    parents: Tuple[bytes, ...]
+    # Committer timestamp, seconds since the epoch.
+    timestamp: int
+
+
+def _apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Rebuild an object from its delta base and a git delta."""
+    pos = 0
+
+    def varint() -> int:
+        nonlocal pos
+        value = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    if varint() != len(base):
+        raise GitObjectError("delta base size mismatch")
+    target_size = varint()
+    out = bytearray()
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # Copy from base: offset and size bytes are present per flag bit.
+            offset = size = 0
+            for bit in range(4):
+                if op & (1 << bit):
+                    offset |= delta[pos] << (8 * bit)
+                    pos += 1
+            for bit in range(3):
+                if op & (0x10 << bit):
+                    size |= delta[pos] << (8 * bit)
+                    pos += 1
+            out += base[offset:offset + (size or 0x10000)]
+        elif op:
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise GitObjectError("invalid delta opcode 0")
+    if len(out) != target_size:
+        raise GitObjectError("delta result size mismatch")
+    return bytes(out)
+
+
+class PackFile:
+    """One `.pack` with its version 2 `.idx`, memory-mapped."""
+
+    def __init__(self, idx_path: Path, hash_size: int = 20) -> None:
+        self.hash_size = hash_size
+        with idx_path.open("rb") as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._idx[:4] != IDX_SIGNATURE or struct.unpack_from(">I", self._idx, 4)[0] != 2:
+            raise GitObjectError(f"{idx_path}: unsupported pack index version")
+        self._fanout = struct.unpack_from(">256I", self._idx, 8)
+        self.count = self._fanout[255]
+        self._names = 8 + 256 * 4
+        self._offsets = self._names + self.count * (hash_size + 4)
+        self._large_offsets = self._offsets + self.count * 4
+        with idx_path.with_suffix(".pack").open("rb") as f:
+            self._pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        self._idx.close()
+        self._pack.close()
+
+    def _name(self, index: int) -> bytes:
+        start = self._names + index * self.hash_size
+        return self._idx[start:start + self.hash_size]
+
+    def find(self, sha: bytes) -> Optional[int]:
+        """Offset of `sha` in the pack, or None if it is not in this pack."""
+        lo = self._fanout[sha[0] - 1] if sha[0] else 0
+        hi = self._fanout[sha[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = self._name(mid)
+            if name < sha:
+                lo = mid + 1
+            elif name > sha:
+                hi = mid
+            else:
+                (offset,) = struct.unpack_from(">I", self._idx, self._offsets + mid * 4)
+                if offset & 0x80000000:
+                    index = offset & 0x7FFFFFFF
+                    (offset,) = struct.unpack_from(
+                        ">Q", self._idx, self._large_offsets + index * 8
+                    )
+                return offset
+        return None
+
+    def __iter__(self) -> Iterator[bytes]:
+        for index in range(self.count):
+            yield self._name(index)
+
+    def header(self, offset: int) -> Tuple[int, int, int]:
+        """Return (type, inflated size, offset of the data) of an entry."""
+        pack = self._pack
+        byte = pack[offset]
+        obj_type = (byte >> 4) & 7
+        size = byte & 0x0F
+        shift = 4
+        offset += 1
+        while byte & 0x80:
+            byte = pack[offset]
+            offset += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+        return obj_type, size, offset
+
+    def inflate(self, offset: int, size: int) -> bytes:
+        d = zlib.decompressobj()
+        chunks: List[bytes] = []
+        pack = self._pack
+        while not d.eof:
+            chunk = pack[offset:offset + _INFLATE_CHUNK]
+            if not chunk:
+                raise GitObjectError("truncated pack entry")
+            chunks.append(d.decompress(chunk))
+            offset += _INFLATE_CHUNK
+        data = b"".join(chunks)
+        if len(data) != size:
+            raise GitObjectError("pack entry size mismatch")
+        return data
+
+    def ofs_delta_base(self, offset: int) -> Tuple[int, int]:
+        """Decode an OFS_DELTA base reference: (distance back to the base, data offset)."""
+        pack = self._pack
+        byte = pack[offset]
+        offset += 1
+        distance = byte & 0x7F
+        while byte & 0x80:
+            byte = pack[offset]
+            offset += 1
+            distance = ((distance + 1) << 7) | (byte & 0x7F)
+        return distance, offset
+
+    def ref_delta_base(self, offset: int) -> Tuple[bytes, int]:
+        return self._pack[offset:offset + self.hash_size], offset + self.hash_size
+
+
+class ObjectStore:
+    """
+    The object database of a repository (loose objects, packs, alternates).
+
+    Use as a context manager or call close() to release the pack mappings.
+    """
+
+    def __init__(self, git_dir: Path) -> None:
+        self.git_dir = git_dir
+        self.hash_size = object_hash_size(git_dir)
+        self._object_dirs: List[Path] = []
+        self._packs: List[PackFile] = []
+        self._add_object_dir(common_dir(git_dir) / "objects")
+        # Commits whose parents a shallow clone does not have.
+        self.shallow = read_shallow(git_dir)
+        self._base_cache: "OrderedDict[Tuple[int, int], Tuple[int, bytes]]" = OrderedDict()
+        self._base_cache_bytes = 0
+
+    def _add_object_dir(self, objects: Path, depth: int = 0) -> None:
+        if objects in self._object_dirs or depth > 5:
+            return
+        self._object_dirs.append(objects)
+        for idx_path in sorted((objects / "pack").glob("*.idx")):
+            if idx_path.with_suffix(".pack").exists():
+                self._packs.append(PackFile(idx_path, self.hash_size))
+        try:
+            alternates = (objects / "info" / "alternates").read_text(encoding="utf-8")
+        except OSError:
+            return
+        for line in alternates.splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                path = Path(line)
+                self._add_object_dir(path if path.is_absolute() else objects / path, depth + 1)
+
+    def close(self) -> None:
+        for pack in self._packs:
+            pack.close()
+        self._packs.clear()
+
+    def __enter__(self) -> "ObjectStore":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def read(self, sha: bytes) -> Tuple[int, bytes]:
+        """Return (type, content) of an object given its binary name."""
+        for pack_index, pack in enumerate(self._packs):
+            offset = pack.find(sha)
+            if offset is not None:
+                return self._read_packed(pack_index, offset)
+        hexsha = sha.hex()
+        for objects in self._object_dirs:
+            try:
+                raw = (objects / hexsha[:2] / hexsha[2:]).read_bytes()
+            except FileNotFoundError:
+                continue
+            data = zlib.decompress(raw)
+            header, _, body = data.partition(b"\0")
+            type_name, _, size = header.partition(b" ")
+            if type_name not in TYPE_NAMES or int(size) != len(body):
+                raise GitObjectError(f"malformed loose object {hexsha}")
+            return TYPE_NAMES[type_name], body
+        raise GitObjectError(f"object {hexsha} not found")
+
+    def _read_packed(self, pack_index: int, offset: int) -> Tuple[int, bytes]:
+        key = (pack_index, offset)
+        cached = self._base_cache.get(key)
+        if cached is not None:
+            self._base_cache.move_to_end(key)
+            return cached
+
+        pack = self._packs[pack_index]
+        obj_type, size, data_offset = pack.header(offset)
+        if obj_type == OBJ_OFS_DELTA:
+            distance, data_offset = pack.ofs_delta_base(data_offset)
+            obj_type, base = self._read_packed(pack_index, offset - distance)
+            result = (obj_type, _apply_delta(base, pack.inflate(data_offset, size)))
+        elif obj_type == OBJ_REF_DELTA:
+            base_sha, data_offset = pack.ref_delta_base(data_offset)
+            obj_type, base = self.read(base_sha)
+            result = (obj_type, _apply_delta(base, pack.inflate(data_offset, size)))
+        else:
+            result = (obj_type, pack.inflate(data_offset, size))
+
+        if len(result[1]) <= DELTA_BASE_CACHE_BYTES // 16:
+            self._base_cache[key] = result
+            self._base_cache_bytes += len(result[1])
+            while self._base_cache_bytes > DELTA_BASE_CACHE_BYTES:
+                _, (_, evicted) = self._base_cache.popitem(last=False)
+                self._base_cache_bytes -= len(evicted)
+        return result
+
+    def peel(self, sha: bytes) -> bytes:
+        """Follow annotated tags to the object they point at."""
+        for _ in range(10):
+            obj_type, data = self.read(sha)
+            if obj_type != OBJ_TAG:
+                return sha
+            # "object <hex>\ntype ...\n"
+            target = data[len(b"object "):len(b"object ") + 2 * self.hash_size]
+            sha = bytes.fromhex(target.decode())
+        raise GitObjectError("tag chain too long")
+
+    def read_typed(self, sha: bytes, expected: int) -> bytes:
+        obj_type, data = self.read(sha)
+        if obj_type == OBJ_TAG and expected != OBJ_TAG:
+            obj_type, data = self.read(self.peel(sha))
+        if obj_type != expected:
+            raise GitObjectError(f"object {sha.hex()} has type {obj_type}, expected {expected}")
+        return data
+
+    def commit(self, sha: bytes) -> Commit:
+        sha = self.peel(sha)
+        data = self.read_typed(sha, OBJ_COMMIT)
+        header = data.split(b"\n\n", 1)[0]
+        tree = b""
+        parents: List[bytes] = []
+        timestamp = 0
+        for line in header.split(b"\n"):
+            key, _, value = line.partition(b" ")
+            if key == b"tree":
+                tree = bytes.fromhex(value.decode())
+            elif key == b"parent":
+                parents.append(bytes.fromhex(value.decode()))
+            elif key == b"committer":
+                # "Name <email> 1700000000 +0100"
+                timestamp = int(value.rsplit(b" ", 2)[1])
+        return Commit(sha, tree, tuple(parents), timestamp)
+
+    def tree(self, sha: bytes) -> List[TreeEntry]:
+        data = self.read_typed(sha, OBJ_TREE)
+        entries: List[TreeEntry] = []
+        pos = 0
+        while pos < len(data):
+            space = data.index(b" ", pos)
+            nul = data.index(b"\0", space)
+            mode = int(data[pos:space], 8)
+            name = data[space + 1:nul].decode("utf-8", errors="surrogateescape")
+            sha_end = nul + 1 + self.hash_size
+            entries.append(TreeEntry(mode, name, data[nul + 1:sha_end]))
+            pos = sha_end
+        return entries
+
+
+# How a short ref name is expanded, in git's order (see gitrevisions(7)).
+_REF_RULES = ("{}", "refs/{}", "refs/tags/{}", "refs/heads/{}", "refs/remotes/{}",
+              "refs/remotes/{}/HEAD")
+
+
+def read_shallow(git_dir: Path) -> FrozenSet[bytes]:
+    """The commits `$GIT_DIR/shallow` lists; empty unless the clone is shallow."""
+    try:
+        lines = (common_dir(git_dir) / "shallow").read_text(encoding="utf-8").split()
+    except OSError:
+        return frozenset()
+    return frozenset(bytes.fromhex(line) for line in lines if _is_hex_name(line))
+
+
+def _is_hex_name(ref: str) -> bool:
+    return len(ref) in (40, 64) and all(c in "0123456789abcdef" for c in ref)
+
+
+def _read_ref(git_dir: Path, common: Path, ref: str) -> Optional[str]:
+    """The raw value of a loose or packed ref, or None if it does not exist."""
+    for base in (git_dir, common):
+        try:
+            return (base / ref).read_text(encoding="utf-8").strip()
+        except OSError:
+            continue
+    return _packed_ref(common, ref)
+
+
+def resolve_ref(git_dir: Path, ref: str = "HEAD") -> bytes:
+    """
+    Resolve a full object name, or a (possibly short or symbolic) ref name, to
+    a binary object name.
+    """
+    if _is_hex_name(ref):
+        return bytes.fromhex(ref)
+    common = common_dir(git_dir)
+    for rule in _REF_RULES:
+        value = _read_ref(git_dir, common, rule.format(ref))
+        if value is not None:
+            break
+    else:
+        raise GitObjectError(f"cannot resolve ref {ref!r}")
+
+    for _ in range(10):
+        if not value.startswith("ref:"):
+            if not _is_hex_name(value):
+                raise GitObjectError(f"malformed ref value {value!r}")
+            return bytes.fromhex(value)
+        target = value[len("ref:"):].strip()
+        value = _read_ref(git_dir, common, target)
+        if value is None:
+            raise GitObjectError(f"{ref!r} points to missing ref {target!r}")
+    raise GitObjectError(f"symbolic ref loop at {ref!r}")
+
+
+def _packed_ref(common: Path, ref: str) -> Optional[str]:
+    try:
+        lines = (common / "packed-refs").read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        if line.startswith(("#", "^")):
+            continue
+        sha, _, name = line.partition(" ")
+        if name == ref:
+            return sha
+    return None
+
+
+def iter_first_parent(
+    store: ObjectStore,
+    head: bytes,
+    limit: Optional[int] = None,
+) -> Iterator[Commit]:
+    """
+    Yield commits from `head` back along first parents, newest first.
+
+    In a shallow clone the walk ends at the shallow boundary, whose parents
+    were never fetched, so fewer than `limit` commits may come out.
+    """
+    sha: Optional[bytes] = head
+    seen = 0
+    while sha is not None and (limit is None or seen < limit):
+        commit = store.commit(sha)
+        yield commit
+        seen += 1
+        if sha in store.shallow:
+            break
+        sha = commit.parents[0] if commit.parents else None
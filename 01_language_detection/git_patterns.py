@@ -0,0 +1,303 @@
+"""
+Git's path pattern syntax (gitignore(5) / wildmatch), compiled to regexes.
+
+`PatternList` holds the patterns of one file (a `.gitignore`, or
+`.git/info/exclude`) relative to the directory they apply to, and answers
+"what does the last matching pattern say about this path?" with a single
+regex search. `GitIgnore` resolves the stack of pattern lists that applies to
+each directory of a worktree, loading every `.gitignore` at most once.
+
+Not supported: `core.excludesFile` (per-user, not part of the repository) and
+`core.ignoreCase`.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from git_index import find_git_dir
+
+# POSIX character classes usable inside a bracket expression, as regex set bodies.
+_POSIX_CLASSES = {
+    "alnum": "a-zA-Z0-9",
+    "alpha": "a-zA-Z",
+    "blank": " \\t",
+    "cntrl": "\\x00-\\x1f\\x7f",
+    "digit": "0-9",
+    "graph": "!-~",
+    "lower": "a-z",
+    "print": " -~",
+    "punct": "!-/:-@\\[-`{-~",
+    "space": " \\t\\n\\r\\f\\v",
+    "upper": "A-Z",
+    "xdigit": "0-9A-Fa-f",
+}
+
+
+def _translate_bracket(pattern: str, pos: int) -> Tuple[Optional[str], int]:
+    """
+    Translate the bracket expression starting at pattern[pos] == "[".
+
+    Returns (regex, position after the closing "]"), or (None, pos) when the
+    bracket is unterminated and "[" must be taken literally.
+    """
+    i = pos + 1
+    negate = i < len(pattern) and pattern[i] in "!^"
+    if negate:
+        i += 1
+    parts: List[str] = []
+    first = True
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "]" and not first:
+            body = "".join(parts)
+            # A bracket never matches the path separator.
+            return (f"[^/{body}]" if negate else f"(?!/)[{body}]"), i + 1
+        first = False
+        if c == "[" and pattern.startswith("[:", i):
+            end = pattern.find(":]", i + 2)
+            if end != -1 and pattern[i + 2:end] in _POSIX_CLASSES:
+                parts.append(_POSIX_CLASSES[pattern[i + 2:end]])
+                i = end + 2
+                continue
+        if c == "\\" and i + 1 < len(pattern):
+            i += 1
+            c = pattern[i]
+        if c == "-" and parts and i + 1 < len(pattern) and pattern[i + 1] != "]":
+            parts.append("-")
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return None, pos
+
+
+def _translate_segment(segment: str) -> str:
+    """Translate one '/'-free piece of a pattern."""
+    out: List[str] = []
+    i = 0
+    while i < len(segment):
+        c = segment[i]
+        if c == "*":
+            while i + 1 < len(segment) and segment[i + 1] == "*":
+                i += 1
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            bracket, end = _translate_bracket(segment, i)
+            if bracket is not None:
+                out.append(bracket)
+                i = end
+                continue
+            out.append(re.escape(c))
+        elif c == "\\" and i + 1 < len(segment):
+            i += 1
+            out.append(re.escape(segment[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def _translate_path(pattern: str) -> str:
+    """Translate a '/'-separated pattern, giving "**" segments their meaning."""
+    segments = pattern.split("/")
+    out: List[str] = []
+    for index, segment in enumerate(segments):
+        last = index == len(segments) - 1
+        if len(segment) >= 2 and segment.strip("*") == "":
+            # "x/**" matches everything inside x; "**/" any leading dirs.
+            out.append(".*" if last else "(?:.*/)?")
+            continue
+        out.append(_translate_segment(segment))
+        if not last:
+            out.append("/")
+    return "".join(out)
+
+
+# Literal prefix of an anchored pattern directly followed by a "**" that ends
+# its segment, e.g. "foo**" or "foo**/bar".
+_PREFIX_STARSTAR = re.compile(r"([^*?\[\\]*[^*?\[\\/])\*\*+(?=/|\Z)")
+
+
+def translate(pattern: str) -> str:
+    """
+    Translate the body of a gitignore pattern (without a leading "!" or a
+    trailing "/") to a regex matching paths relative to the pattern's base.
+
+    A pattern with a "/" anywhere but at the end is anchored to the base;
+    otherwise it may match at any depth. "**" spans directories when it is a
+    whole segment (`**/x`, `x/**`, `x/**/y`).
+    """
+    anchored = "/" in pattern
+    if pattern.startswith("/"):
+        pattern = pattern[1:]
+    if not anchored:
+        return "(?:.*/)?" + _translate_path(pattern)
+
+    # git compares the literal prefix of an anchored pattern separately and
+    # wildmatches only the rest, so a "**" right after it counts as leading
+    # and crosses directories: "/foo**" matches "foobar/baz".
+    m = _PREFIX_STARSTAR.match(pattern)
+    if m is not None:
+        rest = pattern[m.end():]
+        tail = "(?:.*/)?" + _translate_path(rest[1:]) if rest else ".*"
+        return re.escape(m.group(1)) + tail
+    return _translate_path(pattern)
+
+
+class PatternList:
+    """
+    The patterns of one ignore file, compiled for last-match-wins lookups.
+
+    Patterns are combined into one alternation in reverse order, so the first
+    alternative that matches is the last pattern in the file; its group name
+    tells whether it was a negated one. Directory-only patterns ("foo/") go
+    only into the regex used for directories.
+    """
+
+    def __init__(self, lines: Iterable[str], base: str = "") -> None:
+        # '/'-terminated directory the patterns are relative to ("" = root).
+        self.base = base
+        self._negated: List[bool] = []
+        file_alternatives: List[str] = []
+        dir_alternatives: List[str] = []
+
+        for line in lines:
+            parsed = self._parse_line(line)
+            if parsed is None:
+                continue
+            body, negated, dir_only = parsed
+            group = f"(?P<p{len(self._negated)}>{translate(body)})"
+            self._negated.append(negated)
+            dir_alternatives.append(group)
+            if not dir_only:
+                file_alternatives.append(group)
+
+        self._file_re = self._compile(file_alternatives)
+        self._dir_re = self._compile(dir_alternatives)
+
+    @staticmethod
+    def _parse_line(line: str) -> Optional[Tuple[str, bool, bool]]:
+        """Return (pattern body, negated, directory only), or None to skip."""
+        line = line.rstrip("\n").rstrip("\r")
+        # Trailing spaces are ignored unless escaped with a backslash.
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped += " "
+        line = stripped
+        if not line or line.startswith("#"):
+            return None
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith(("\\!", "\\#")):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        if dir_only:
+            line = line[:-1]
+        if not line:
+            return None
+        return line, negated, dir_only
+
+    @staticmethod
+    def _compile(alternatives: List[str]) -> Optional[Pattern[str]]:
+        if not alternatives:
+            return None
+        return re.compile("(?:" + "|".join(reversed(alternatives)) + r")\Z", re.DOTALL)
+
+    def __bool__(self) -> bool:
+        return bool(self._negated)
+
+    def match(self, relpath: str, is_dir: bool) -> Optional[bool]:
+        """
+        Whether `relpath` (relative to the worktree root, without a trailing
+        "/") is ignored according to this list; None if no pattern matches.
+        """
+        regex = self._dir_re if is_dir else self._file_re
+        if regex is None or not relpath.startswith(self.base):
+            return None
+        m = regex.match(relpath, len(self.base))
+        if m is None:
+            return None
+        return not self._negated[int(m.lastgroup[1:])]
+
+    @classmethod
+    def from_file(cls, path: Path, base: str = "") -> Optional["PatternList"]:
+        """Load an ignore file; None if it is missing or has no patterns."""
+        try:
+            text = path.read_text(encoding="utf-8", errors="surrogateescape")
+        except OSError:
+            return None
+        patterns = cls(text.splitlines(), base)
+        return patterns or None
+
+
+# Pattern lists that apply in a directory, most specific first.
+Rules = Tuple[PatternList, ...]
+
+
+def is_ignored(rules: Rules, relpath: str, is_dir: bool) -> bool:
+    """Decide one path against `rules`; the most specific matching list wins."""
+    for patterns in rules:
+        verdict = patterns.match(relpath, is_dir)
+        if verdict is not None:
+            return verdict
+    return False
+
+
+class GitIgnore:
+    """
+    The ignore rules of a worktree rooted at `root`.
+
+    Each directory's rules are its own `.gitignore` followed by its parent's
+    rules; a directory containing `.git` (the root, or a submodule) starts a
+    new stack ending in that repository's `info/exclude`. Rules from above
+    `root` are not consulted.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._root_str = os.fspath(root)
+        self._rules: Dict[str, Rules] = {}
+
+    def rules_for(self, prefix: str) -> Rules:
+        """Rules for the directory `prefix` ("" or a '/'-terminated relpath)."""
+        rules = self._rules.get(prefix)
+        if rules is not None:
+            return rules
+
+        directory = Path(os.path.join(self._root_str, prefix)) if prefix else self.root
+        own = PatternList.from_file(directory / ".gitignore", prefix)
+        if not prefix or os.path.lexists(directory / ".git"):
+            inherited: Rules = ()
+            git_dir = find_git_dir(directory)
+            if git_dir is not None:
+                exclude = PatternList.from_file(git_dir / "info" / "exclude", prefix)
+                if exclude is not None:
+                    inherited = (exclude,)
+        else:
+            parent = prefix[:-1].rpartition("/")[0]
+            inherited = self.rules_for(parent + "/" if parent else "")
+
+        rules = (own,) + inherited if own is not None else inherited
+        self._rules[prefix] = rules
+        return rules
+
+    def is_ignored(self, relpath: str, is_dir: bool = False) -> bool:
+        """
+        Whether `relpath` is ignored, itself or because a parent directory
+        is (git cannot re-include anything below an ignored directory).
+        """
+        parts = relpath.split("/")
+        prefix = ""
+        for index, part in enumerate(parts):
+            last = index == len(parts) - 1
+            path = prefix + part
+            if is_ignored(self.rules_for(prefix), path, is_dir or not last):
+                return True
+            prefix = path + "/"
+        return False
@@ -0,0 +1,383 @@
+"""
+Long-running scan daemon, and its client, speaking JSON over a Unix socket.
+
+`serve` scans the tree once with LiveLanguageStats, selecting files as the
+scanner's command line does (the git index and its source filter), then keeps
+every file's result and the per-language totals in memory, re-measuring files
+as inotify reports changes. Make targets, editor plugins and hooks ask it
+instead of rescanning cold:
+
+    python scan_daemon.py serve &
+    python scan_daemon.py stats
+    python scan_daemon.py stats 02_cluster_infra/
+    python scan_daemon.py regenerate
+
+The protocol is one JSON object per line in each direction; a connection may
+send any number of requests. Requests:
+
+    {"op": "ping"}
+    {"op": "stats", "subtree": "dir/"}       subtree is optional
+    {"op": "regenerate", "total": 2000}      total is optional
+
+Every response has "ok"; failed requests carry an "error" message instead of
+a result. Stats are sent as {"languages": [{"language", "lines", "files",
+"bytes"}, ...], "files": <files tracked>}. Linux only, like --watch.
+
+The client half only needs the standard library and does not import the
+scanner, so asking a running daemon costs milliseconds.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_SOCKET_PATH = Path(__file__).resolve().parent / ".cache" / "scan_daemon.sock"
+
+# How long the watcher blocks for events before checking for shutdown.
+WATCH_POLL_SECONDS = 0.5
+
+# Longest request line the daemon reads; requests are tiny.
+MAX_REQUEST_BYTES = 1 << 16
+
+# Seconds a client waits for an answer; regenerating can take a while.
+CLIENT_TIMEOUT_SECONDS = 300.0
+
+
+class DaemonError(RuntimeError):
+    """Raised by the client when the daemon rejects a request or is unreachable."""
+
+
+class ScanDaemon:
+    """
+    The daemon's state: live statistics of `root` and the locks guarding them.
+
+    One thread applies inotify events; connection threads read under the
+    same lock, so an answer never mixes results from before and after a batch
+    of changes. Dummy files are regenerated from a snapshot, outside the lock.
+
+    Like the scanner's command line, the daemon only writes into the
+    repository's generated/ when it scans the repository itself; for any
+    other `root`, `regenerate` needs an explicit `target_dir`.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        jobs: int = 1,
+        target_dir: Optional[Path] = None,
+        backend: str = "auto",
+        max_file_bytes: Optional[int] = None,
+        filtered: bool = True,
+    ) -> None:
+        # Imported here so that the client never pays for the scanner's import.
+        import generate_language_representation as scanner
+        from source_filters import DEFAULT_MAX_FILE_BYTES, SourceFilter
+
+        self._scanner = scanner
+        self.root = root
+        if target_dir is None and root == scanner.REPO_ROOT:
+            target_dir = scanner.GENERATED_DIR
+        self.target_dir = target_dir
+        self.jobs = jobs
+        source_filter = None
+        if filtered:
+            if max_file_bytes is None:
+                max_file_bytes = DEFAULT_MAX_FILE_BYTES
+            source_filter = SourceFilter(max_file_bytes=max_file_bytes)
+        self.live = scanner.LiveLanguageStats(
+            root, jobs=jobs, backend=backend, source_filter=source_filter
+        )
+        self._lock = threading.Lock()
+        self._generate_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Scan the tree and start following changes."""
+        with self._lock:
+            self.live.start()
+        self._watcher = threading.Thread(target=self._watch, name="scan-watcher", daemon=True)
+        self._watcher.start()
+
+    def close(self) -> None:
+        self._stopping.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        self.live.close()
+
+    def _watch(self) -> None:
+        while not self._stopping.is_set():
+            events = self.live.collect_events(WATCH_POLL_SECONDS)
+            if events:
+                with self._lock:
+                    self.live.apply_events(events)
+
+    def handle(self, request: Any) -> Dict[str, Any]:
+        """Answer one decoded request."""
+        if not isinstance(request, dict):
+            raise ValueError("a request must be a JSON object")
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True}
+        if op == "stats":
+            return {"ok": True, **self._stats(request.get("subtree") or "")}
+        if op == "regenerate":
+            return {"ok": True, **self._regenerate(request.get("total"))}
+        raise ValueError(f"unknown op {op!r}")
+
+    def _stats(self, subtree: str) -> Dict[str, Any]:
+        if not isinstance(subtree, str):
+            raise ValueError("subtree must be a string")
+        prefix = subtree.strip("/")
+        prefix = prefix + "/" if prefix else ""
+        with self._lock:
+            stats = self.live.subtree_stats(prefix)
+            tracked = len(self.live.files)
+        return {
+            "languages": [
+                {"language": s.language, "lines": s.lines, "files": s.files, "bytes": s.bytes}
+                for s in stats.values()
+            ],
+            "files": tracked,
+        }
+
+    def _regenerate(self, total: Any) -> Dict[str, Any]:
+        scanner = self._scanner
+        if total is None:
+            total = scanner.DEFAULT_DUMMY_AMOUNT["lines"]
+        if not isinstance(total, int) or isinstance(total, bool) or total < 0:
+            raise ValueError("total must be a non-negative integer")
+        if self.target_dir is None:
+            # Another tree's mix must not overwrite this repository's dummy files.
+            raise ValueError(f"{self.root} is not the repository; serve it with --target-dir")
+        with self._lock:
+            stats = self.live.subtree_stats("")
+        with self._generate_lock:
+            report = scanner.write_dummy_files(
+                stats, total_dummy_lines=total, target_dir=self.target_dir, jobs=self.jobs
+            )
+        return {
+            "written": report.written,
+            "unchanged": report.skipped,
+            "removed": report.removed,
+            "bytes": report.bytes,
+        }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "_DaemonServer"
+
+    def handle(self) -> None:
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_BYTES)
+            if not line:
+                return
+            try:
+                response = self.server.daemon.handle(json.loads(line))
+            except Exception as exc:
+                # Whatever went wrong is reported to the client, not fatal.
+                response = {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, daemon: ScanDaemon) -> None:
+        self.daemon = daemon
+        super().__init__(os.fspath(path), _RequestHandler)
+
+
+def _claim_socket(path: Path) -> None:
+    """Remove a stale socket file, refusing if a daemon still answers on it."""
+    if not os.path.exists(path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(os.fspath(path))
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+    else:
+        raise DaemonError(f"a daemon is already listening on {path}")
+    finally:
+        probe.close()
+
+
+def serve(
+    root: Path,
+    socket_path: Path = DEFAULT_SOCKET_PATH,
+    jobs: int = 1,
+    target_dir: Optional[Path] = None,
+    backend: str = "auto",
+    max_file_bytes: Optional[int] = None,
+    filtered: bool = True,
+) -> None:
+    """Run the daemon until it gets SIGINT or SIGTERM."""
+    _claim_socket(socket_path)
+    daemon = ScanDaemon(
+        root,
+        jobs=jobs,
+        target_dir=target_dir,
+        backend=backend,
+        max_file_bytes=max_file_bytes,
+        filtered=filtered,
+    )
+    daemon.start()
+    stop = threading.Event()
+    # Signals only ask for a stop, so a second one arriving during cleanup
+    # cannot interrupt it and leave the socket file behind.
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stop.set())
+    try:
+        with _DaemonServer(socket_path, daemon) as server:
+            server_thread = threading.Thread(target=server.serve_forever, name="scan-server")
+            server_thread.start()
+            print(f"Serving {root} on {socket_path}", flush=True)
+            try:
+                while not stop.wait(WATCH_POLL_SECONDS):
+                    pass
+            finally:
+                server.shutdown()
+                server_thread.join()
+    finally:
+        daemon.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+
+
+def request(payload: Dict[str, Any], socket_path: Path = DEFAULT_SOCKET_PATH) -> Dict[str, Any]:
+    """Send one request to the daemon and return its (successful) response."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(CLIENT_TIMEOUT_SECONDS)
+            conn.connect(os.fspath(socket_path))
+            conn.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+            with conn.makefile("rb") as f:
+                line = f.readline()
+    except OSError as exc:
+        raise DaemonError(f"cannot reach the daemon on {socket_path}: {exc}") from exc
+    if not line:
+        raise DaemonError("the daemon closed the connection without answering")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise DaemonError(response.get("error", "request failed"))
+    return response
+
+
+def _print_stats(languages: List[Dict[str, Any]]) -> None:
+    """The table print_summary() prints, from a stats response."""
+    if not languages:
+        print("No languages detected.")
+        return
+    total = sum(entry["lines"] for entry in languages)
+    print("Language statistics (by non-empty line):")
+    print("-" * 60)
+    print(f"{'Language':20} {'Lines':>10} {'Files':>10} {'Percent':>10}")
+    print("-" * 60)
+    for entry in sorted(languages, key=lambda entry: entry["lines"], reverse=True):
+        percent = (entry["lines"] / total * 100.0) if total else 0.0
+        print(f"{entry['language']:20} {entry['lines']:10d} {entry['files']:10d} {percent:9.2f}%")
+    print("-" * 60)
+    print(f"{'TOTAL':20} {total:10d}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve or query live language statistics.")
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        default=DEFAULT_SOCKET_PATH,
+        help=f"Unix socket path (default: {DEFAULT_SOCKET_PATH}).",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = sub.add_parser("serve", help="Run the daemon in the foreground.")
+    serve_parser.add_argument(
+        "--root",
+        type=Path,
+        default=Path(__file__).resolve().parents[1],
+        help="Tree to scan (default: the repository).",
+    )
+    serve_parser.add_argument("--jobs", "-j", type=int, default=1)
+    serve_parser.add_argument(
+        "--target-dir",
+        type=Path,
+        help="Where `regenerate` writes dummy files (default: the scanner's generated/, "
+        "and only when --root is the repository; otherwise regenerate is refused).",
+    )
+    serve_parser.add_argument(
+        "--backend",
+        choices=("auto", "git", "walk"),
+        default="auto",
+        help="How files are selected, as in the scanner (default: auto).",
+    )
+    serve_parser.add_argument(
+        "--max-file-size",
+        type=int,
+        metavar="BYTES",
+        help="Count larger files by their bytes only, as in the scanner.",
+    )
+    serve_parser.add_argument(
+        "--no-filter",
+        action="store_true",
+        help="Count vendored code, build output and oversized files too.",
+    )
+
+    stats_parser = sub.add_parser("stats", help="Print the current statistics.")
+    stats_parser.add_argument("subtree", nargs="?", default="")
+    stats_parser.add_argument("--json", action="store_true", help="Print the raw response.")
+
+    regen_parser = sub.add_parser("regenerate", help="Rewrite the dummy files.")
+    regen_parser.add_argument("--total", type=int, help="Dummy lines to spread.")
+
+    sub.add_parser("ping", help="Exit 0 if the daemon answers.")
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "serve":
+            serve(
+                args.root.resolve(),
+                args.socket,
+                args.jobs,
+                args.target_dir,
+                backend=args.backend,
+                max_file_bytes=args.max_file_size,
+                filtered=not args.no_filter,
+            )
+        elif args.command == "stats":
+            response = request({"op": "stats", "subtree": args.subtree}, args.socket)
+            if args.json:
+                print(json.dumps(response))
+            else:
+                _print_stats(response["languages"])
+        elif args.command == "regenerate":
+            payload: Dict[str, Any] = {"op": "regenerate"}
+            if args.total is not None:
+                payload["total"] = args.total
+            response = request(payload, args.socket)
+            print(
+                f"Dummy files: {response['written']} written, "
+                f"{response['unchanged']} unchanged, {response['removed']} removed, "
+                f"{response['bytes']} bytes"
+            )
+        else:
+            request({"op": "ping"}, args.socket)
+    except DaemonError as exc:
+        sys.exit(f"error: {exc}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Pre-filter deciding, from a file's path and size alone, how a scan treats it.
+
+Vendored dependencies, build output, minified bundles and lockfiles are not
+code anybody wrote here, and huge data fixtures are mostly expensive to read;
+GitHub Linguist leaves the former out of its statistics too. A
+`SourceFilter` matches every path against a compiled set of such rules
+(git wildmatch patterns, see git_patterns) plus a size cap, and says whether
+to count the file, count only its bytes, or skip it, before anything is read.
+It keeps a per-rule tally of what it filtered out.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, NamedTuple, Optional, Pattern, Tuple
+
+from git_patterns import translate
+
+# What to do with a file.
+DECISION_COUNT = "count"
+# Don't read it: it adds to its language's bytes, but not to lines or files.
+DECISION_BYTES = "bytes"
+DECISION_SKIP = "skip"
+
+# Files larger than this are counted by bytes only (0 = no cap).
+DEFAULT_MAX_FILE_BYTES = 16 * 1024 * 1024
+
+# Rule name reported for files over the size cap.
+SIZE_CAP_RULE = "size-cap"
+
+
+class FilterRule(NamedTuple):
+    """Patterns (gitignore syntax, relative to the scan root) and their decision."""
+
+    name: str
+    patterns: Tuple[str, ...]
+    decision: str
+
+
+DEFAULT_RULES: Tuple[FilterRule, ...] = (
+    FilterRule(
+        "vendored",
+        (
+            "**/vendor/**",
+            "**/vendors/**",
+            "**/third_party/**",
+            "**/third-party/**",
+            "**/bower_components/**",
+            "**/Godeps/_workspace/**",
+        ),
+        DECISION_SKIP,
+    ),
+    FilterRule(
+        "build-output",
+        ("**/dist/**", "**/site-packages/**", "**/_build/**"),
+        DECISION_SKIP,
+    ),
+    FilterRule(
+        "minified",
+        ("*.min.js", "*.min.css", "*-min.js", "*.bundle.js", "*.js.map", "*.css.map"),
+        DECISION_SKIP,
+    ),
+    FilterRule(
+        "lockfile",
+        (
+            "package-lock.json",
+            "npm-shrinkwrap.json",
+            "yarn.lock",
+            "pnpm-lock.yaml",
+            "poetry.lock",
+            "Pipfile.lock",
+            "Cargo.lock",
+            "Gemfile.lock",
+            "composer.lock",
+            "go.sum",
+            "*.lock",
+        ),
+        DECISION_SKIP,
+    ),
+)
+
+
+@dataclass
+class RuleTally:
+    """Files and bytes one rule kept from being counted."""
+
+    files: int = 0
+    bytes: int = 0
+
+
+class SourceFilter:
+    """
+    Classifies files by path and size; see the module docstring.
+
+    All patterns are compiled into one regex with a named group per rule, so
+    a path costs a single match whatever the number of rules. The first rule
+    (in `rules` order) that matches decides; the size cap only applies to
+    files no rule matched.
+    """
+
+    def __init__(
+        self,
+        rules: Iterable[FilterRule] = DEFAULT_RULES,
+        max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+    ) -> None:
+        self.rules: List[FilterRule] = list(rules)
+        self.max_file_bytes = max_file_bytes
+        self.report: Dict[str, RuleTally] = {}
+        alternatives = [
+            f"(?P<r{index}>{'|'.join(translate(pattern) for pattern in rule.patterns)})"
+            for index, rule in enumerate(self.rules)
+            if rule.patterns
+        ]
+        self._regex: Optional[Pattern[str]] = None
+        if alternatives:
+            self._regex = re.compile("(?:" + "|".join(alternatives) + r")\Z", re.DOTALL)
+
+    def rule_for(self, relpath: str, size: int) -> Optional[Tuple[str, str]]:
+        """(rule name, decision) for a '/'-separated relpath, or None to count it."""
+        if self._regex is not None:
+            m = self._regex.match(relpath)
+            if m is not None:
+                rule = self.rules[int(m.lastgroup[1:])]
+                return rule.name, rule.decision
+        if self.max_file_bytes and size > self.max_file_bytes:
+            return SIZE_CAP_RULE, DECISION_BYTES
+        return None
+
+    def classify(self, relpath: str, size: int) -> str:
+        """The decision for one file, tallied in `report` unless it is counted."""
+        matched = self.rule_for(relpath, size)
+        if matched is None:
+            return DECISION_COUNT
+        name, decision = matched
+        if decision != DECISION_COUNT:
+            tally = self.report.setdefault(name, RuleTally())
+            tally.files += 1
+            tally.bytes += size
+        return decision
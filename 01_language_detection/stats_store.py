@@ -0,0 +1,292 @@
+"""
+SQLite store of per-file scan results.
+
+Every scan recorded with `StatsStore.record_scan()` gets a row in `scans` and
+one row per countable file in `files` (path, directory, language, lines, bytes,
+mtime). Per-language totals, per-directory breakdowns and "largest files"
+reports are then single indexed queries, with no filesystem access at all.
+
+Only finished scans are visible to queries, so an interrupted scan never
+shows up half-written; older scans beyond `keep_scans` are deleted.
+
+    python stats_store.py scan_stats.db languages
+    python stats_store.py scan_stats.db directories --language YAML
+    python stats_store.py scan_stats.db largest --language Shell
+"""
+
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# Rows per INSERT transaction while a scan is being recorded.
+STORE_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    started_ns INTEGER NOT NULL,
+    finished_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    scan_id INTEGER NOT NULL REFERENCES scans(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    language TEXT NOT NULL,
+    lines INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    UNIQUE (scan_id, path)
+);
+CREATE INDEX IF NOT EXISTS files_language ON files (scan_id, language);
+CREATE INDEX IF NOT EXISTS files_dir ON files (scan_id, dir);
+"""
+
+
+class FileRow(NamedTuple):
+    """One file of a scan, as stored."""
+
+    path: str
+    language: str
+    lines: int
+    bytes: int
+    mtime_ns: int
+
+
+class LanguageTotals(NamedTuple):
+    """Aggregated counts for one language (files counts non-empty ones only)."""
+
+    language: str
+    lines: int
+    files: int
+    bytes: int
+
+
+def _dir_of(path: str) -> str:
+    return path.rpartition("/")[0]
+
+
+def _prefix_range(prefix: str) -> Tuple[str, str]:
+    """Bounds of the dir values strictly below `prefix` ("a/b" -> "a/b/".."a/b0")."""
+    # "0" is the character after "/".
+    return prefix + "/", prefix + "0"
+
+
+class StatsStore:
+    """A scan results database; use as a context manager or call close()."""
+
+    def __init__(self, path: Path, keep_scans: int = 3) -> None:
+        self.path = path
+        self.keep_scans = keep_scans
+        self._db = sqlite3.connect(str(path))
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "StatsStore":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def record_scan(self, root: Path, rows: Iterable[FileRow]) -> int:
+        """
+        Store a complete scan and return its id.
+
+        Rows are inserted in transactions of STORE_BATCH_SIZE; the scan only
+        becomes visible once the last batch is in.
+        """
+        with self._db:
+            scan_id = self._db.execute(
+                "INSERT INTO scans (root, started_ns) VALUES (?, ?)",
+                (str(root), time.time_ns()),
+            ).lastrowid
+
+        batch: List[Tuple[int, str, str, str, int, int, int]] = []
+        for row in rows:
+            batch.append((scan_id, row.path, _dir_of(row.path)) + tuple(row[1:]))
+            if len(batch) >= STORE_BATCH_SIZE:
+                self._insert(batch)
+                batch = []
+        self._insert(batch)
+
+        with self._db:
+            self._db.execute(
+                "UPDATE scans SET finished_ns = ? WHERE id = ?", (time.time_ns(), scan_id)
+            )
+            self._db.execute(
+                "DELETE FROM scans WHERE id NOT IN "
+                "(SELECT id FROM scans WHERE finished_ns IS NOT NULL "
+                "ORDER BY id DESC LIMIT ?) AND (finished_ns IS NOT NULL OR id < ?)",
+                (self.keep_scans, scan_id),
+            )
+        return scan_id
+
+    def _insert(self, batch: List[Tuple[int, str, str, str, int, int, int]]) -> None:
+        if not batch:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO files (scan_id, path, dir, language, lines, bytes, mtime_ns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+
+    def latest_scan(self) -> Optional[int]:
+        """Id of the most recent finished scan, or None."""
+        row = self._db.execute(
+            "SELECT MAX(id) FROM scans WHERE finished_ns IS NOT NULL"
+        ).fetchone()
+        return row[0]
+
+    def _scan(self, scan_id: Optional[int]) -> int:
+        if scan_id is None:
+            scan_id = self.latest_scan()
+            if scan_id is None:
+                raise LookupError(f"no finished scan in {self.path}")
+        return scan_id
+
+    def language_totals(
+        self,
+        scan_id: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> List[LanguageTotals]:
+        """
+        Per-language totals of a scan (the latest by default), in the order
+        languages were first seen; limited to files under `prefix` if given.
+        """
+        query = "SELECT language, SUM(lines), SUM(lines > 0), SUM(bytes) FROM files"
+        params: Tuple[object, ...] = (self._scan(scan_id),)
+        if prefix:
+            prefix = prefix.strip("/")
+            low, high = _prefix_range(prefix)
+            # Left alone, the planner prefers the language index to skip the
+            # GROUP BY sort, which means scanning the whole scan.
+            # The outer range is what the index seeks on; it also holds
+            # siblings like "a/b-c", which the OR then drops.
+            query += (
+                " INDEXED BY files_dir WHERE scan_id = ?"
+                " AND dir >= ? AND dir < ? AND (dir = ? OR dir >= ?)"
+            )
+            params += (prefix, high, prefix, low)
+        else:
+            query += " WHERE scan_id = ?"
+        query += " GROUP BY language ORDER BY MIN(rowid)"
+        return [LanguageTotals(*row) for row in self._db.execute(query, params)]
+
+    def directory_totals(
+        self,
+        language: str,
+        depth: int = 1,
+        limit: int = 10,
+        scan_id: Optional[int] = None,
+    ) -> List[Tuple[str, int, int]]:
+        """
+        The directories (cut to `depth` components) holding the most lines of
+        `language`, as (directory, lines, files), largest first.
+        """
+        rows = self._db.execute(
+            "SELECT dir, SUM(lines), SUM(lines > 0) FROM files "
+            "WHERE scan_id = ? AND language = ? GROUP BY dir",
+            (self._scan(scan_id), language),
+        )
+        totals: Dict[str, Tuple[int, int]] = {}
+        for directory, lines, files in rows:
+            key = "/".join(directory.split("/")[:depth]) if directory else "."
+            old_lines, old_files = totals.get(key, (0, 0))
+            totals[key] = (old_lines + lines, old_files + files)
+        ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+        return [(directory, lines, files) for directory, (lines, files) in ranked[:limit]]
+
+    def largest_files(
+        self,
+        language: Optional[str] = None,
+        limit: int = 10,
+        by: str = "lines",
+        scan_id: Optional[int] = None,
+    ) -> List[FileRow]:
+        """The `limit` biggest files by "lines" or "bytes", optionally of one language."""
+        if by not in ("lines", "bytes"):
+            raise ValueError(f"cannot rank files by {by!r}")
+        query = "SELECT path, language, lines, bytes, mtime_ns FROM files WHERE scan_id = ?"
+        params: Tuple[object, ...] = (self._scan(scan_id),)
+        if language is not None:
+            query += " AND language = ?"
+            params += (language,)
+        query += f" ORDER BY {by} DESC LIMIT ?"
+        return [FileRow(*row) for row in self._db.execute(query, params + (limit,))]
+
+    def iter_files(self, scan_id: Optional[int] = None) -> Iterator[FileRow]:
+        rows = self._db.execute(
+            "SELECT path, language, lines, bytes, mtime_ns FROM files "
+            "WHERE scan_id = ? ORDER BY rowid",
+            (self._scan(scan_id),),
+        )
+        for row in rows:
+            yield FileRow(*row)
+
+
+def _print_table(header: Tuple[str, ...], rows: Iterable[Tuple[object, ...]]) -> None:
+    """Print rows with the first column left-aligned and the rest right-aligned."""
+    def fmt(values: Tuple[object, ...]) -> str:
+        first, *rest = values
+        return f"{str(first):40}" + "".join(f" {str(v):>12}" for v in rest)
+
+    print(fmt(header))
+    print("-" * (40 + 13 * (len(header) - 1)))
+    for row in rows:
+        print(fmt(row))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Query a scan results database.")
+    parser.add_argument("db", type=Path)
+    parser.add_argument("--scan", type=int, help="Scan id (default: the latest).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    languages = commands.add_parser("languages", help="Totals per language.")
+    languages.add_argument("--prefix", help="Only files under this directory.")
+    directories = commands.add_parser("directories", help="Directories with the most lines.")
+    directories.add_argument("--language", required=True)
+    directories.add_argument("--depth", type=int, default=1)
+    directories.add_argument("--limit", type=int, default=10)
+    largest = commands.add_parser("largest", help="Largest files.")
+    largest.add_argument("--language")
+    largest.add_argument("--by", choices=("lines", "bytes"), default="lines")
+    largest.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if not args.db.exists():
+        parser.error(f"{args.db} does not exist")
+    with StatsStore(args.db) as store:
+        try:
+            if args.command == "languages":
+                _print_table(
+                    ("Language", "Lines", "Files", "Bytes"),
+                    store.language_totals(args.scan, args.prefix),
+                )
+            elif args.command == "directories":
+                _print_table(
+                    ("Directory", "Lines", "Files"),
+                    store.directory_totals(args.language, args.depth, args.limit, args.scan),
+                )
+            else:
+                _print_table(
+                    ("Path", "Language", "Lines", "Bytes"),
+                    (row[:4] for row in store.largest_files(
+                        args.language, args.limit, args.by, args.scan
+                    )),
+                )
+        except LookupError as exc:
+            parser.error(str(exc))
+
+
+if __name__ == "__main__":
+    main()